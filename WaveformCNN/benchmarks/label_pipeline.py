@@ -0,0 +1,61 @@
+# Throughput benchmark (batches/sec) for the label half of data_processing.get_data:
+# the old chain of three tf.numpy_function maps (filename -> basename -> category -> one-hot)
+# against the in-graph hash table lookup in data_processing.encode_labels.
+# Audio decoding is left out so only the label path is timed.
+# Run from WaveformCNN: python benchmarks/label_pipeline.py [num_files] [batch_size] [num_passes]
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tensorflow as tf
+import data_processing as data
+
+
+# Returns a batched Dataset of (file path, audio) pairs shaped like id_loader's output, plus a
+# filename : category dictionary like get_golds's output
+def synthetic_gold_batches(num_files, batch_size, slice_len=8192):
+    filenames = [str(i) + "_m1_b_aa.wav" for i in range(num_files)]
+    file_category_maps = {fn: ("voiced" if i % 2 == 0 else "voiceless") for i, fn in enumerate(filenames)}
+    paths = ["../klatt_synthesis/sounds/" + fn for fn in filenames]
+    audio = tf.zeros((num_files, slice_len, 1))
+    gold_batches = tf.data.Dataset.from_tensor_slices((paths, audio)).batch(batch_size).cache()
+    return gold_batches, file_category_maps
+
+
+# The label chain get_data used before encode_labels
+def numpy_function_labels(gold_batches, file_category_maps, category_to_encoding):
+    gold_batches = gold_batches.map(lambda fn, audio: (data.tensor_basename(fn), audio))
+    gold_batches = gold_batches.map(lambda fn, audio: (data.tensor_categories(fn, file_category_maps), audio))
+    shape_set = lambda category: tf.ensure_shape(data.tensor_encodings(category, category_to_encoding),
+                                                 ((None, len(category_to_encoding))))
+    gold_batches = gold_batches.map(lambda category, audio: (shape_set(category), audio))
+    gold_batches = gold_batches.map(lambda category, audio: (tf.cast(category, dtype=tf.float32), audio))
+    return gold_batches.map(lambda category, audio: (audio, category))
+
+
+# Returns batches per second over num_passes full iterations of dataset (after one warm-up pass)
+def batches_per_sec(dataset, num_passes):
+    for _ in dataset:
+        pass
+    num_batches = 0
+    start = time.perf_counter()
+    for _ in range(num_passes):
+        for _ in dataset:
+            num_batches += 1
+    return num_batches / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    num_passes = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    gold_batches, file_category_maps = synthetic_gold_batches(num_files, batch_size)
+    category_to_encoding, _ = data.category_encoder(["voiced", "voiceless"])
+
+    old = batches_per_sec(numpy_function_labels(gold_batches, file_category_maps, category_to_encoding), num_passes)
+    new = batches_per_sec(data.encode_labels(gold_batches, file_category_maps, category_to_encoding), num_passes)
+    print("numpy_function chain:", round(old, 1), "batches/sec")
+    print("hash table lookup:   ", round(new, 1), "batches/sec")
+    print("speedup:", round(new / old, 2))
@@ -0,0 +1,188 @@
+# Benchmark suite for the training and discrimination pipelines. Writes a synthetic corpus of wav files at 16 kHz
+# (a 2x2 grid of F1/voicing categories named like the experimental stimuli, so the same files work as a training
+# corpus and as a discrimination task) and times each stage on its own:
+#   decode: id_loader.decode_audio throughput (clips/sec)
+#   get_data: data_processing.get_data throughput (batches/sec, after the first pass)
+#   train_step_bs<N>: seconds per training step of cnn.create_model's model with batch size N
+#   run_task: discrimination_task.run_task throughput on an untrained model, decoding included (stimuli/sec)
+#   pairwise_n<N>: seconds for discrimination_task.pairwise_cosine_distances on N hidden_rep-sized vectors
+# The results are written as JSON and compared with a stored baseline results file: any stage more than
+# threshold (a fraction) worse than the baseline is reported as a regression and the exit status is 1.
+# If the baseline file doesn't exist yet, the results are saved as the baseline.
+# Run from WaveformCNN: python benchmarks/run_benchmarks.py <results json> [baseline json] [threshold] [num_clips]
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy.io import wavfile
+import tensorflow as tf
+from tensorflow import keras
+
+import cnn
+import data_processing as data
+import discrimination_task
+import id_loader
+
+
+train_batch_sizes = [8, 32]
+num_train_steps = 3
+pairwise_sizes = [256, 512, 1024, 2048]
+hidden_rep_size = 8192 #Length of the hidden_rep vector for 8192-sample input
+
+
+#Writes num_clips wav files of 0.45-0.65 s of noisy tone at fs to corpus_dir/synthetic/sounds/, and a FileID,Category
+#csv labelling them with four categories in turn
+#Returns the sound directory (ending in /) and the csv file name
+def write_synthetic_corpus(corpus_dir, num_clips, fs=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    categories = [f1 + "_F1_" + voicing + "_voicing" for f1 in ["0", "1"] for voicing in ["0", "1"]]
+    sound_dir = os.path.join(corpus_dir, "synthetic", "sounds") + "/"
+    os.makedirs(sound_dir, exist_ok=True)
+    info_csv = os.path.join(corpus_dir, "synthetic", "metadata.csv")
+    with open(info_csv, "w") as info_file:
+        info_file.write("FileID,Category\n")
+        for index in range(num_clips):
+            num_samples = rng.integers(int(0.45 * fs), int(0.65 * fs))
+            times = np.arange(num_samples) / fs
+            audio = 0.3 * np.sin(2 * np.pi * rng.uniform(90, 250) * times) + 0.05 * rng.standard_normal(num_samples)
+            file_name = "clip_%05d.wav" % index
+            wavfile.write(sound_dir + file_name, fs, (audio * 32767).astype(np.int16))
+            info_file.write(file_name + "," + categories[index % len(categories)] + "\n")
+    return sound_dir, info_csv
+
+
+#Returns a result entry for the JSON output
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def benchmark_decode(sound_dir):
+    fps = [sound_dir + file_name for file_name in sorted(os.listdir(sound_dir))]
+    start = time.perf_counter()
+    for fp in fps:
+        id_loader.decode_audio(fp.encode("utf-8"), 16000, normalize=True) #Takes byte strings, as from a Dataset
+    return {"decode": result(len(fps) / (time.perf_counter() - start), "clips/sec", True)}
+
+
+def benchmark_get_data(sound_dir, info_csv):
+    training_data, _, _ = data.get_data(sound_dir, info_csv)
+    for _ in training_data:
+        pass
+    num_batches = 0
+    start = time.perf_counter()
+    for _ in training_data:
+        num_batches += 1
+    return {"get_data": result(num_batches / (time.perf_counter() - start), "batches/sec", True)}
+
+
+def benchmark_train_steps(num_categories, batch_sizes, num_steps):
+    model = cnn.create_model(num_categories)
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        audio = rng.uniform(-1, 1, (batch_size, 8192, 1)).astype(np.float32)
+        labels = np.eye(num_categories, dtype=np.float32)[rng.integers(num_categories, size=batch_size)]
+        model.train_on_batch(audio, labels) #Warm-up (includes tracing the step for this batch shape)
+        start = time.perf_counter()
+        for _ in range(num_steps):
+            model.train_on_batch(audio, labels)
+        results["train_step_bs" + str(batch_size)] = result((time.perf_counter() - start) / num_steps, "sec/step",
+                                                            False)
+    return results
+
+
+def benchmark_run_task(sound_dir, info_csv, num_categories):
+    model = cnn.create_model(num_categories)
+    model.build((None, 8192, 1))
+    intermediate_layer_model = keras.Model(inputs=model.input, outputs=model.get_layer("hidden_rep").output)
+    discrimination_task.run_task(intermediate_layer_model, sound_dir, info_csv) #Warm-up
+    start = time.perf_counter()
+    task_data = discrimination_task.run_task(intermediate_layer_model, sound_dir, info_csv)
+    return {"run_task": result(len(task_data.stimuli) / (time.perf_counter() - start), "stimuli/sec", True)}
+
+
+def benchmark_pairwise(sizes):
+    rng = np.random.default_rng(0)
+    results = {}
+    for n in sizes:
+        reps = rng.standard_normal((n, hidden_rep_size)).astype(np.float32)
+        start = time.perf_counter()
+        discrimination_task.pairwise_cosine_distances(reps)
+        results["pairwise_n" + str(n)] = result(time.perf_counter() - start, "sec", False)
+    return results
+
+
+#Runs every stage on a fresh synthetic corpus of num_clips files and returns the results dictionary for the JSON output
+def run_suite(num_clips=256, batch_sizes=None, num_steps=num_train_steps, sizes=None):
+    batch_sizes = train_batch_sizes if batch_sizes is None else batch_sizes
+    sizes = pairwise_sizes if sizes is None else sizes
+    results = {}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        sound_dir, info_csv = write_synthetic_corpus(corpus_dir, num_clips)
+        num_categories = len(set(data.get_golds(info_csv).values()))
+        for name, stage in [("decode", lambda: benchmark_decode(sound_dir)),
+                            ("get_data", lambda: benchmark_get_data(sound_dir, info_csv)),
+                            ("train_step", lambda: benchmark_train_steps(num_categories, batch_sizes, num_steps)),
+                            ("run_task", lambda: benchmark_run_task(sound_dir, info_csv, num_categories)),
+                            ("pairwise", lambda: benchmark_pairwise(sizes))]:
+            print("Running", name, "benchmark")
+            results.update(stage())
+    return {"environment": {"python": platform.python_version(), "tensorflow": tf.__version__,
+                            "machine": platform.machine(), "cpu_count": os.cpu_count()},
+            "settings": {"num_clips": num_clips, "train_batch_sizes": batch_sizes, "num_train_steps": num_steps,
+                         "pairwise_sizes": sizes},
+            "results": results}
+
+
+#Returns a list of messages, one for every stage in both results dictionaries that got worse than baseline by more
+#than threshold (a fraction, e.g. 0.2 for 20%)
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, entry in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base_value = baseline["results"][name]["value"]
+        value = entry["value"]
+        if entry["higher_is_better"]:
+            change = (base_value - value) / base_value
+        else:
+            change = (value - base_value) / base_value
+        if change > threshold:
+            regressions.append(name + ": " + str(round(value, 4)) + " " + entry["unit"] + " vs baseline " +
+                               str(round(base_value, 4)) + " (" + str(round(100 * change, 1)) + "% worse)")
+    return regressions
+
+
+if __name__ == "__main__":
+    results_file_name = sys.argv[1]
+    baseline_file_name = sys.argv[2] if len(sys.argv) > 2 else None
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    num_clips = int(sys.argv[4]) if len(sys.argv) > 4 else 256
+
+    results = run_suite(num_clips)
+    with open(results_file_name, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    for name, entry in results["results"].items():
+        print(name + ":", round(entry["value"], 4), entry["unit"])
+
+    if baseline_file_name is None:
+        sys.exit(0)
+    if not os.path.exists(baseline_file_name):
+        with open(baseline_file_name, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print("No baseline yet; saved these results as the baseline", baseline_file_name)
+        sys.exit(0)
+    with open(baseline_file_name) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline["settings"] != results["settings"]:
+        print("Warning: baseline was run with different settings", baseline["settings"])
+    regressions = find_regressions(results, baseline, threshold)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    print(len(regressions), "regressions beyond", str(round(100 * threshold)) + "% of the baseline")
+    sys.exit(1 if regressions else 0)
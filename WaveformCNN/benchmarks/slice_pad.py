@@ -0,0 +1,60 @@
+# Per-element cost (microseconds/clip) of getting each decoded clip to exactly slice_len samples in id_loader:
+# the old tf.signal.frame + flat_map + reshape chain against the single pad_or_crop map (slice_first_only).
+# Decoding is left out (the clips are synthetic, of random lengths around slice_len) so only the slicing is timed.
+# Run from WaveformCNN: python benchmarks/slice_pad.py [num_clips] [num_passes]
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import tensorflow as tf
+import id_loader
+
+
+# Returns a Dataset of num_clips [nsamps, 1, 1] clips shaped like decode_audio's output, with lengths drawn from
+# about 0.45-0.65 s at 16 kHz like the Klatt tokens, so some are longer than slice_len and some shorter
+def synthetic_clips(num_clips):
+    lengths = np.random.default_rng(0).integers(7200, 10400, num_clips)
+    return tf.data.Dataset.from_tensor_slices(lengths).map(lambda n: tf.ones([n, 1, 1]))
+
+
+# The slicing chain id_decode_extract_and_batch used before slice_first_only
+def frame_slices(clips, slice_len):
+    def _slice_dataset_wrapper(audio):
+        audio_slices = tf.signal.frame(audio, slice_len, slice_len, pad_end=True, pad_value=0, axis=0)
+        return tf.data.Dataset.from_tensor_slices(audio_slices[:1])
+    clips = clips.flat_map(_slice_dataset_wrapper)
+    return clips.map(lambda audio: tf.reshape(audio, (slice_len, 1)))
+
+
+def pad_or_crop_slices(clips, slice_len):
+    truncated_clips = id_loader._truncated_clip_counter()
+    return clips.map(lambda audio: tf.reshape(id_loader.pad_or_crop(audio, slice_len, truncated_clips),
+                                              (slice_len, 1)))
+
+
+# Returns microseconds per element over num_passes full iterations of dataset (after one warm-up pass)
+def usec_per_element(dataset, num_passes):
+    for _ in dataset:
+        pass
+    num_elements = 0
+    start = time.perf_counter()
+    for _ in range(num_passes):
+        for _ in dataset:
+            num_elements += 1
+    return (time.perf_counter() - start) / num_elements * 1e6
+
+
+if __name__ == "__main__":
+    num_clips = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_passes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    slice_len = 8192
+
+    clips = synthetic_clips(num_clips)
+    old = usec_per_element(frame_slices(clips, slice_len), num_passes)
+    new = usec_per_element(pad_or_crop_slices(clips, slice_len), num_passes)
+    print("frame + flat_map chain:", round(old, 1), "usec/clip")
+    print("pad_or_crop:           ", round(new, 1), "usec/clip")
+    print("speedup:", round(old / new, 2))
+    print("clips longer than slice_len (per pass):", id_loader.truncated_clip_count() // (num_passes + 1))
@@ -0,0 +1,64 @@
+# Training throughput (steps/sec) of the WaveCNN model from cnn.create_model in its default float32 mode against
+# fast mode: XLA-compiled (jit_compile) alone, and XLA plus the mixed precision policy fast mode picks for this machine
+# (cnn.fast_mode_precision). The batches are random audio, so only the training step is timed.
+# Also prints how far each fast mode's hidden_rep is from float32's for the same weights.
+# Run from WaveformCNN: python benchmarks/train_step.py [batch_size] [num_steps]
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import tensorflow as tf
+import cnn
+
+
+# Returns a Dataset that repeats one batch of random [batch_size, slice_len, 1] audio with random one-hot labels
+def synthetic_batches(batch_size, num_classes=2, slice_len=8192):
+    rng = np.random.default_rng(0)
+    audio = rng.uniform(-1, 1, (batch_size, slice_len, 1)).astype(np.float32)
+    labels = np.eye(num_classes, dtype=np.float32)[rng.integers(num_classes, size=batch_size)]
+    return tf.data.Dataset.from_tensors((audio, labels)).repeat()
+
+
+# Returns training steps per second over num_steps steps (after a few warm-up steps, which include compilation)
+def steps_per_sec(model, batches, num_steps):
+    model.fit(batches, steps_per_epoch=3, epochs=1, verbose=0)
+    start = time.perf_counter()
+    model.fit(batches, steps_per_epoch=num_steps, epochs=1, verbose=0)
+    return num_steps / (time.perf_counter() - start)
+
+
+# Returns the largest absolute difference between the hidden_rep outputs of two models for the same audio
+def hidden_rep_difference(model, other_model, audio):
+    outputs = []
+    for m in (model, other_model):
+        outputs.append(tf.keras.Model(inputs=m.inputs, outputs=m.get_layer("hidden_rep").output)(audio).numpy())
+    return np.max(np.abs(outputs[0] - outputs[1])), outputs[1].dtype
+
+
+if __name__ == "__main__":
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    num_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    batches = synthetic_batches(batch_size)
+    audio = next(iter(batches))[0][:4]
+
+    modes = [("float32", dict()), ("jit_compile", dict(fast=True, precision=None))]
+    if cnn.fast_mode_precision() is not None:
+        modes.append(("jit_compile + " + cnn.fast_mode_precision(), dict(fast=True)))
+
+    results = {}
+    models = {}
+    for name, options in modes:
+        tf.random.set_seed(1)
+        model = cnn.create_model(2, **options)
+        model.build((None, 8192, 1))
+        models[name] = model
+        results[name] = steps_per_sec(model, batches, num_steps)
+        print(name + ":", round(results[name], 3), "steps/sec")
+
+    for name, _ in modes[1:]:
+        print(name, "speedup over float32:", round(results[name] / results["float32"], 2))
+        models[name].set_weights(models["float32"].get_weights())
+        difference, dtype = hidden_rep_difference(models["float32"], models[name], audio)
+        print(name, "hidden_rep dtype", dtype, "max abs difference from float32:", difference)
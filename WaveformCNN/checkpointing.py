@@ -0,0 +1,99 @@
+# Asynchronous, throttled checkpoints for training the CNN
+# Instead of writing a whole SavedModel directory synchronously every epoch (tf.keras.callbacks.ModelCheckpoint),
+# which stalls training on shared network filesystems, only the variables (weights, optimizer state and the epoch
+# number) are checkpointed, every few epochs, and the files are written by Tensorflow's async checkpointing in a
+# background thread while the next epoch trains. Only the last few checkpoints are kept. Training can resume from
+# the latest one; the SavedModel is only exported once, at the end of training.
+import os
+import shutil
+import time
+
+import tensorflow as tf
+
+import instrumentation
+
+
+#Returns the directory the training checkpoints for the model saved at model_save_path are kept in
+def checkpoint_dir(model_save_path):
+    return model_save_path.rstrip("/") + "_checkpoints"
+
+
+#Keras callback that checkpoints model's variables (weights + optimizer state), the number of finished epochs and
+#whether training has finished (when fit ends, after its last epoch or stopping early, a last checkpoint is saved
+#marked as finished, so a run interrupted before exporting the model isn't trained any further when resumed)
+#directory: directory to keep the checkpoints in (see checkpoint_dir)
+#save_every_epochs: save after every this many epochs
+#min_interval_seconds: also skip a save if the last one was less than this many seconds ago
+#keep_last: number of most recent checkpoints to keep; older ones are deleted
+#run_metrics: if not None, instrumentation.RunMetrics to record how long each save blocks training in
+#The model must be built, with its optimizer's variables created (see build_for_checkpointing), before restoring
+class AsyncCheckpointCallback(tf.keras.callbacks.Callback):
+    def __init__(self, model, directory, save_every_epochs=1, min_interval_seconds=0, keep_last=2,
+                 run_metrics=None):
+        super().__init__()
+        self.directory = directory
+        self.save_every_epochs = save_every_epochs
+        self.min_interval_seconds = min_interval_seconds
+        self.run_metrics = run_metrics
+        self.epochs_done = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.training_done = tf.Variable(False, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epochs_done=self.epochs_done,
+                                              training_done=self.training_done)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep=keep_last)
+        self.options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+        self.last_save_time = None
+        self.last_epoch = None
+
+    #Restores the latest checkpoint in the directory, if there is one
+    #Returns the number of epochs it had finished (0 if there's no checkpoint), for fit's initial_epoch
+    def restore_latest(self):
+        if self.manager.latest_checkpoint is None:
+            return 0
+        self.checkpoint.restore(self.manager.latest_checkpoint).assert_existing_objects_matched()
+        print("Resuming from checkpoint", self.manager.latest_checkpoint, "after epoch", int(self.epochs_done.numpy()))
+        return int(self.epochs_done.numpy())
+
+    #Returns True if the restored checkpoint was saved once training had finished
+    def training_finished(self):
+        return bool(self.training_done.numpy())
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.last_epoch = epoch + 1
+        if (epoch + 1) % self.save_every_epochs != 0:
+            return
+        if self.last_save_time is not None and time.perf_counter() - self.last_save_time < self.min_interval_seconds:
+            return
+        self.save(epoch + 1)
+
+    #Only called when fit ends normally, not if training is interrupted
+    def on_train_end(self, logs=None):
+        if self.last_epoch is not None:
+            self.training_done.assign(True)
+            self.save(self.last_epoch)
+        #Wait for the last checkpoint to finish writing
+        self.checkpoint.sync()
+
+    #Starts writing a checkpoint after finished_epochs epochs; this only blocks until the variables are copied
+    #(or until the previous checkpoint has finished writing, if it hasn't yet)
+    def save(self, finished_epochs):
+        self.epochs_done.assign(finished_epochs)
+        with instrumentation.stage(self.run_metrics, "checkpoint_save", epoch=finished_epochs):
+            self.manager.save(checkpoint_number=finished_epochs, options=self.options)
+        self.last_save_time = time.perf_counter()
+
+    #Deletes the checkpoint directory, e.g. once the final model has been saved
+    def remove(self):
+        self.checkpoint.sync()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+#Builds model for input_shape and creates its optimizer's variables, so a checkpoint can be restored into it
+#before training starts
+def build_for_checkpointing(model, input_shape):
+    model.build(input_shape)
+    model.optimizer.build(model.trainable_variables)
+
+
+#Returns True if there's a checkpoint to resume from in directory
+def has_checkpoint(directory):
+    return os.path.isdir(directory) and tf.train.latest_checkpoint(directory) is not None
@@ -4,6 +4,8 @@
 #Instead of the final layer being passed through a logistic function as in WaveGan,
 #I pass it through a softmax function so that more than 2 categories could be learned.
 #Also, unlike Donahue, I do not do weight clipping (to be added later).
+import os
+
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
@@ -15,9 +17,11 @@ class WaveCNN():
     # Kernel len: size of kernel window for convolution
     # dim: Number of output filters in the first layer of convolution (will be scaled up/down in other layers)
     # num_classes: length of output vectors
+    # conv_dtype: dtype or mixed precision policy name (e.g. "mixed_bfloat16") for the convolution layers;
+    # None for the default float32. hidden_rep and the classifier after it are always float32.
     #Initializes self.model, a replication of WaveGan's CNN discriminator model
     #The last hidden layer can be accessed with the name "hidden_rep"
-    def __init__(self, kernel_len=32, dim=64, use_batchnorm=True, name="cnn", num_classes=2):
+    def __init__(self, kernel_len=32, dim=64, use_batchnorm=True, name="cnn", num_classes=2, conv_dtype=None):
         # TODO: batch normalization training vs inference?
         # TODO: slice_len?
         self.model = tf.keras.Sequential()
@@ -28,45 +32,45 @@ class WaveCNN():
         # the default in v2 for now.
         # Layer 0
         # [16384, 1] -> [4096, 64]
-        self.model.add(layers.Conv1D(dim, kernel_len,strides=4,padding="same"))
+        self.model.add(layers.Conv1D(dim, kernel_len,strides=4,padding="same", dtype=conv_dtype))
         if use_batchnorm:
-            self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+            self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # Layer 1
         # [4096, 64] -> [1024, 128]
-        self.model.add(layers.Conv1D(dim * 2, kernel_len, strides=4, padding="same"))
+        self.model.add(layers.Conv1D(dim * 2, kernel_len, strides=4, padding="same", dtype=conv_dtype))
         if use_batchnorm:
-            self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+            self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # Layer 2
         # [1024, 128] -> [256, 256]
-        self.model.add(layers.Conv1D(dim*4,kernel_len,strides=4, padding="same"))
+        self.model.add(layers.Conv1D(dim*4,kernel_len,strides=4, padding="same", dtype=conv_dtype))
         if use_batchnorm:
-             self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+             self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # Layer 3
         # [256, 256] -> [64, 512]
-        self.model.add(layers.Conv1D(dim * 8, kernel_len, strides=4, padding="same"))
+        self.model.add(layers.Conv1D(dim * 8, kernel_len, strides=4, padding="same", dtype=conv_dtype))
         if use_batchnorm:
-            self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+            self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # Layer 4
         # [64, 512] -> [16, 1024]
-        self.model.add(layers.Conv1D(dim * 16, kernel_len, strides=4, padding="same"))
+        self.model.add(layers.Conv1D(dim * 16, kernel_len, strides=4, padding="same", dtype=conv_dtype))
         if use_batchnorm:
-            self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+            self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # Layer 5
         # [64, 512] -> [16, 1024]
-        self.model.add(layers.Conv1D(dim * 32, kernel_len, strides=2, padding="same"))
+        self.model.add(layers.Conv1D(dim * 32, kernel_len, strides=2, padding="same", dtype=conv_dtype))
         if use_batchnorm:
-            self.model.add(layers.BatchNormalization())
-        self.model.add(layers.LeakyReLU(alpha=0.2))
+            self.model.add(layers.BatchNormalization(dtype=conv_dtype))
+        self.model.add(layers.LeakyReLU(alpha=0.2, dtype=conv_dtype))
 
         # slice_len in original Donahue code? He has 2 extra layers depending on what slice_len is...?
         # Layer 5
@@ -78,12 +82,14 @@ class WaveCNN():
         # Flatten - in the Donahue code this is to batch_size x -1 (ie a 1D vector for each item in the batch)
         # Since I'm not messing with batch sizes in this architecture class (I think...) I suppose I flatten to
         # just 1D, so shape -1?
-        self.model.add(layers.Reshape((-1,), name="hidden_rep"))#,name="hidden_rep"))
+        # Always float32 (casting the convolution output if it's mixed precision), so distances between
+        # hidden_rep vectors are comparable between models trained with and without fast mode
+        self.model.add(layers.Reshape((-1,), name="hidden_rep", dtype="float32"))#,name="hidden_rep"))
 
         # Combine features into output later
-        self.model.add(layers.Dense(num_classes))
+        self.model.add(layers.Dense(num_classes, dtype="float32"))
 
-        self.model.add(layers.Softmax())
+        self.model.add(layers.Softmax(dtype="float32"))
         # Donahue *says* this is connected to a single logit but doesn't use an activation function,
         # and the tensorflow default is linear. It appears he puts the interpretation as probability
         # into training, not the architecture definition. To simplify getting all of the shapes to be compatible,
@@ -103,13 +109,38 @@ class WaveCNN():
 
 
 
+#Returns the name of the mixed precision policy fast mode uses on this machine: "mixed_float16" if there's a GPU,
+#"mixed_bfloat16" if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), otherwise None (float32),
+#since emulated bfloat16 is slower than float32
+def fast_mode_precision():
+    if tf.config.list_physical_devices("GPU"):
+        return "mixed_float16"
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as cpuinfo:
+            flags = cpuinfo.read().split()
+        if "avx512_bf16" in flags or "amx_bf16" in flags:
+            return "mixed_bfloat16"
+    return None
+
+
 #Set up model, set up its training parameters, and expose with a function
 #num_classes: number of categories for the classifier
-def create_model(num_classes):
-    model = WaveCNN(num_classes=num_classes).model
+#fast: True to compile the training step with XLA (jit_compile) and train the convolutions in mixed precision
+#precision: mixed precision policy name for fast mode, e.g. "mixed_bfloat16"; "auto" for fast_mode_precision(),
+#None for float32. Ignored unless fast is True.
+def create_model(num_classes, fast=False, precision="auto"):
+    if fast and precision == "auto":
+        precision = fast_mode_precision()
+    if not fast:
+        precision = None
+    model = WaveCNN(num_classes=num_classes, conv_dtype=precision).model
     #Learning rate, beta1, and clipping values from Donahue
-    model.compile(optimizer = tf.keras.optimizers.Adam(learning_rate=2e-4, beta_1=0.5, clipvalue=0.01), loss = 'categorical_crossentropy',
-                metrics=["accuracy"])
+    optimizer = tf.keras.optimizers.Adam(learning_rate=2e-4, beta_1=0.5, clipvalue=0.01)
+    if precision == "mixed_float16":
+        #float16 gradients underflow without loss scaling (bfloat16 has float32's range so doesn't need it)
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    model.compile(optimizer = optimizer, loss = 'categorical_crossentropy',
+                metrics=["accuracy"], jit_compile=fast)
     return model
 
 
@@ -0,0 +1,98 @@
+# Compact stimulus representations for the discrimination task
+# hidden_rep is the flattened last convolution block (its filters x the timesteps left), so every stimulus is a large
+# vector, and the memory and time of the pairwise distances grow with its size. These modes shrink each stimulus'
+# representation before the distances are computed:
+#   full: the representation as it is (the default)
+#   avg_pool, max_pool: the mean or maximum of each filter over time, one value per filter
+#   random_projection[:k]: multiplied by a Gaussian random matrix down to k dimensions (default 256); the matrix only
+#       depends on the seed and the layer's size, so every model is projected the same way, and cosine distances are
+#       approximately preserved
+#   pca[:k]: the first k principal components (default 32) of the model's representations of every probed stimulus,
+#       fitted once per model and layer; distances are then between the centred projections
+#Pooling and random projection work a batch at a time, so the full representations are never all kept in memory.
+import numpy as np
+
+
+modes = ["full", "avg_pool", "max_pool", "random_projection", "pca"]
+default_sizes = {"random_projection": 256, "pca": 32}
+
+
+#Returns (mode name, size) for a mode string such as "avg_pool" or "pca:16"; size is None for modes without one
+#Raises ValueError for an unknown mode or a bad size
+def parse_mode(mode):
+    name, _, size = mode.partition(":")
+    if name not in modes:
+        raise ValueError("Unknown representation mode " + repr(mode) + "; expected one of " + ", ".join(modes))
+    if name not in default_sizes:
+        if size:
+            raise ValueError("Representation mode " + name + " doesn't take a size")
+        return name, None
+    size = int(size) if size else default_sizes[name]
+    if size < 1:
+        raise ValueError("Representation mode " + repr(mode) + " needs a size of at least 1")
+    return name, size
+
+
+#Returns a string that identifies the compact representations mode makes, e.g. to cache them by: the mode name and
+#size, and the random projection's seed or, for pca, fit_key (a string identifying the stimuli it's fitted to)
+def representation_key(mode, random_seed=0, fit_key=""):
+    name, size = parse_mode(mode)
+    if name == "random_projection":
+        return name + ":" + str(size) + ":seed=" + str(random_seed)
+    if name == "pca":
+        return name + ":" + str(size) + ":fit=" + fit_key
+    return name
+
+
+class CompactRepresentation():
+    #mode: mode string (see parse_mode)
+    #time_shape: (timesteps, channels) shape of each stimulus' activations before they were flattened, for pooling;
+    #       None if the layer has no time axis (e.g. the softmax output), which pooling then leaves as it is
+    #random_seed: seed of the random projection matrix
+    #projection: [d, k] random projection matrix or principal axes, once made (random_projection) or fitted (pca)
+    #mean: [d] mean representation the principal axes are centred on (pca)
+    def __init__(self, mode, time_shape=None, random_seed=0):
+        self.mode = mode
+        self.name, self.size = parse_mode(mode)
+        self.time_shape = time_shape
+        self.random_seed = random_seed
+        self.projection = None
+        self.mean = None
+
+    #Returns True if the mode has to be fitted to every representation first (pca), so it can't reduce them a batch
+    #at a time
+    def needs_fit(self):
+        return self.name == "pca"
+
+    #Fits the principal axes to reps_list (list of [n, ...] arrays, e.g. one per task); does nothing for other modes
+    #Returns self
+    def fit(self, reps_list):
+        if not self.needs_fit():
+            return self
+        reps = np.concatenate([reps.reshape(len(reps), -1) for reps in reps_list]).astype(np.float64)
+        self.mean = reps.mean(axis=0)
+        #The principal axes are the right singular vectors of the centred representations
+        _, _, axes = np.linalg.svd(reps - self.mean, full_matrices=False)
+        self.projection = axes[:self.size].T
+        return self
+
+    #Returns the compact version of reps ([n, ...] array) as an [n, reduced size] array (reps itself for full)
+    def transform(self, reps):
+        if self.name == "full":
+            return reps
+        if self.name in ("avg_pool", "max_pool"):
+            if self.time_shape is None:
+                return reps.reshape(len(reps), -1)
+            timed_reps = reps.reshape(len(reps), -1, self.time_shape[-1])
+            return timed_reps.mean(axis=1) if self.name == "avg_pool" else timed_reps.max(axis=1)
+
+        flat_reps = reps.reshape(len(reps), -1)
+        if self.name == "random_projection":
+            if self.projection is None:
+                rng = np.random.default_rng(self.random_seed)
+                self.projection = (rng.standard_normal((flat_reps.shape[1], self.size)) /
+                                   np.sqrt(self.size)).astype(np.float32)
+            return flat_reps @ self.projection
+        if self.projection is None:
+            raise ValueError("The pca representation mode has to be fitted before it is used")
+        return ((flat_reps - self.mean) @ self.projection).astype(np.float32)
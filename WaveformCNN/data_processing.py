@@ -6,6 +6,7 @@ debug = False
 
 #import alt_id_loader as id_loader
 import id_loader #From Donahue's WaveGan
+import tfrecord_loader
 import pandas
 import os
 import numpy as np
@@ -58,9 +59,12 @@ def get_golds(gold_file_name):
 
 def get_data(wav_file_dir, info_csv, batch_size= 64 if not debug else 2,
              decode_fs = 16000,
-             fast_wav = False,
+             fast_wav = 'auto',
              shuffle = True,
-             prefetch_gpu_num = 0):
+             prefetch_gpu_num = 0,
+             cache_dir = None,
+             tfrecord_dir = None,
+             shuffle_seed = None):
     """ Generates objects from data files
     Args:
         -wav_file_dir: string name of directory where the wav files are stored(must contain only .wav files)
@@ -69,13 +73,23 @@ def get_data(wav_file_dir, info_csv, batch_size= 64 if not debug else 2,
         Processing args:
         batch size: size of batches in output
         decode_fs: sampling rate for audio in samples per second
+        fast_wav: True to decode with scipy, False with librosa, 'auto' for scipy with librosa only where needed (see id_loader.decode_audio)
         shuffle: True to shuffle the dataset order; False not to shuffle the dataset order (retains category information either way)
+        shuffle_seed: if not None (and shuffle is True), shuffle with this seed (e.g. the run seed), in a new but
+            reproducible order every epoch (see id_loader.id_decode_extract_and_batch); otherwise use the old fixed-seed shuffle
         prefetch_size: how much data to prefetch (?)
         prefetch_gpu_num: from Donahue, If nonnegative, prefetch examples to this GPU (Tensorflow device num)
+        cache_dir: if not None, directory of a decoded audio cache for wav_file_dir (see id_loader.compile_audio_cache);
+            the cache is built on first use and rebuilt whenever the wav files or decode settings change
+        tfrecord_dir: if not None, read the data from TFRecord shards written by tfrecord_loader.export_tfrecords
+            instead; wav_file_dir, info_csv, decode_fs and fast_wav aren't used (the shards already hold the decoded
+            audio and categories)
     Returns: - a batched dataset of one-hot categories (vector of int.32 and audio vectors (Tensorflow Dataset of int.32 vector with 65536 samples)
           - a dictionary of possible categories and their mappings to 0 or 1 if binary or one-hot lists if multiclass
     """
-
+    if tfrecord_dir is not None:
+        return get_tfrecord_data(tfrecord_dir, batch_size=batch_size, shuffle=shuffle,
+                                 prefetch_gpu_num=prefetch_gpu_num, shuffle_seed=shuffle_seed)
 
     #Cerys: this is ok as long as there are no directories or non-wav-files in sample_wavs
     all_sample_filenames = [wav_file_dir+fn for fn in os.listdir(wav_file_dir)]
@@ -86,50 +100,91 @@ def get_data(wav_file_dir, info_csv, batch_size= 64 if not debug else 2,
         decode_fs=decode_fs,
         decode_num_channels=1,
         decode_fast_wav=fast_wav,
-        decode_parallel_calls=4,
+        decode_parallel_calls=tf.data.AUTOTUNE,
+        slice_first_only=True,
         repeat=False, #Originally true in Donahue; I set it to False because repeat means create a structure where you "repeat the data indefinitely"
         shuffle=shuffle,
         shuffle_buffer_size=4096,
         prefetch_size=batch_size * 4,
-        prefetch_gpu_num=prefetch_gpu_num)
-
+        prefetch_gpu_num=prefetch_gpu_num,
+        cache_dir=cache_dir,
+        shuffle_seed=shuffle_seed)
 
-    #Separate the audio data from the filenames - actually don't do this, maybe causing bug of
-    #separating labels from data in shuffle?
-    # batch_filenames = sample_gold_batches.map(lambda fn, audio: fn)
-    # batch_filenames = batch_filenames.map(tensor_basename)
-    # batch_audio_vectors = sample_gold_batches.map(lambda fn, audio: audio)
 
-    #Change the filenames to string categories
-    gold_batches = gold_batches.map(lambda fn, audio: (tensor_basename(fn), audio))
     file_category_maps = get_golds(info_csv)
-    #for element in file_category_maps:
-    #    print(element, file_category_maps[element])
-    gold_batches = \
-        gold_batches.map(lambda fn, audio: (tensor_categories(fn, file_category_maps), audio))
-    #batch_categories = batch_filenames.map(lambda name: tensor_categories(name, file_category_maps))
-    # if debug:
-    #     for element in batch_categories:
-    #         print("Category",element)
-
     #Make dictionaries for translating between categories and encodings
-    category_to_encoding, encoding_to_category = category_encoder(list(set(file_category_maps.values())))
+    #Sorted, so the encoding doesn't depend on string hashing and matches the TFRecord shards' (see tfrecord_loader)
+    category_to_encoding, encoding_to_category = category_encoder(sorted(set(file_category_maps.values())))
 
+    #Fail early (like the old per-batch dictionary lookups did) if a wav file has no category
+    missing = [os.path.basename(fn) for fn in all_sample_filenames if os.path.basename(fn) not in file_category_maps]
+    if missing:
+        raise KeyError("No category in " + info_csv + " for files " + str(missing))
 
-    #Make one-hot encoding
-    #print(len(category_to_encoding))
-    shape_set = lambda category: tf.ensure_shape(tensor_encodings(category, category_to_encoding),((None,len(category_to_encoding))))
-    gold_batches = gold_batches.map(lambda category, audio: (shape_set(category), audio))
-    #if debug:
-    #    for element in batch_encoded_categories:
-    #        print("Encoding",element)
-    gold_batches = gold_batches.map(lambda category, audio: (tf.cast(category,dtype=tf.float32), audio)) #Can't be integers, has to be floats for Keras
-    
-    #Flip gold_batches; data needs to come first, then labels
-    gold_batches = gold_batches.map(lambda category, audio: (audio, category))
+    #Change the filenames to one-hot categories, and flip gold_batches; data needs to come first, then labels
+    gold_batches = encode_labels(gold_batches, file_category_maps, category_to_encoding)
 
     return gold_batches, category_to_encoding, encoding_to_category
 
+
+# get_data's reader for TFRecord shards (see tfrecord_loader.py)
+# record_dir: directory of shards written by tfrecord_loader.export_tfrecords
+# Returns the same batched Dataset of (audio, one-hot category) pairs and category dictionaries as get_data
+def get_tfrecord_data(record_dir, batch_size=64, shuffle=True, prefetch_gpu_num=0, shuffle_seed=None):
+    categories = tfrecord_loader.read_categories(record_dir)
+    category_to_encoding, encoding_to_category = category_encoder(categories)
+    gold_batches = tfrecord_loader.tfrecord_decode_and_batch(record_dir, batch_size, shuffle=shuffle,
+                                                             shuffle_buffer_size=4096,
+                                                             prefetch_size=batch_size * 4,
+                                                             prefetch_gpu_num=prefetch_gpu_num,
+                                                             shuffle_seed=1 if shuffle_seed is None else shuffle_seed)
+    #The shards store each example's category index; category_encoder puts a 1 at the same index
+    gold_batches = gold_batches.map(lambda fn, audio, label: (audio, tf.one_hot(label, len(categories))),
+                                    num_parallel_calls=tf.data.AUTOTUNE)
+    return gold_batches, category_to_encoding, encoding_to_category
+
+
+# Loads the same data as get_data, unshuffled, into numpy arrays instead of a batched Dataset, for code that
+# needs to index into the whole corpus at once (e.g. giving each model in an ensemble its own data order)
+# Takes the same arguments as get_data (except batching and shuffling)
+# Returns: - a [number of files, slice_len, 1] float32 numpy array of audio
+#          - a [number of files, number of categories] float32 numpy array of one-hot categories, parallel to the audio
+#          - the same category : encoding and encoding : category dictionaries as get_data
+def get_arrays(wav_file_dir, info_csv, decode_fs = 16000, fast_wav = 'auto', cache_dir = None):
+    gold_batches, category_to_encoding, encoding_to_category = get_data(wav_file_dir, info_csv,
+                                                                        decode_fs=decode_fs, fast_wav=fast_wav,
+                                                                        shuffle=False, cache_dir=cache_dir)
+    batches = list(gold_batches.as_numpy_iterator())
+    audio = np.concatenate([batch_audio for batch_audio, batch_categories in batches])
+    categories = np.concatenate([batch_categories for batch_audio, batch_categories in batches])
+    return audio, categories, category_to_encoding, encoding_to_category
+
+
+# Maps a batched Dataset of (filename, audio) pairs to a batched Dataset of (audio, one-hot category) pairs
+# entirely in the Tensorflow graph, so the map can run in parallel without dropping into Python for every batch.
+# The filename -> category -> one-hot index mapping is resolved once, up front, into a hash table.
+# gold_batches: batched Dataset of (string tensor of file paths, audio tensor)
+# file_category_maps: dictionary of filename (basename) : category string, from get_golds
+# category_to_encoding: dictionary of category string : one-hot list, from category_encoder
+def encode_labels(gold_batches, file_category_maps, category_to_encoding):
+    category_indices = {category: encoding.index(1.0) for category, encoding in category_to_encoding.items()}
+    filenames = list(file_category_maps.keys())
+    label_table = tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(
+            tf.constant(filenames, dtype=tf.string),
+            tf.constant([category_indices[file_category_maps[fn]] for fn in filenames], dtype=tf.int64)),
+        default_value=-1)
+    num_categories = len(category_to_encoding)
+
+    def _encode(fn, audio):
+        basename = tf.strings.regex_replace(fn, "^.*/", "")
+        #Can't be integers, has to be floats for Keras
+        category = tf.one_hot(label_table.lookup(basename), num_categories, dtype=tf.float32)
+        return audio, category
+
+    return gold_batches.map(_encode, num_parallel_calls=tf.data.AUTOTUNE)
+
+
 #Tensorflow strings can't be used like normal Python strings; if you want to call a string function on them,
 # you have to wrap operations in a
 #function that takes a Numpy array and then apply it using numpy_func
@@ -23,10 +23,8 @@ module load miniconda/4.11.0
 START_SEED=16
 END_SEED=70
 
-for ((seed_num=$START_SEED; seed_num<=$END_SEED; seed_num++)); do
-
-conda run -n fresh2 --no-capture-output python3.8 discrimination_task.py $seed_num
-
-done
+#One process for the whole seed range: the stimuli are decoded and the model is built once,
+#then each seed's weights are swapped in
+conda run -n fresh2 --no-capture-output python3.8 discrimination_task.py $START_SEED $END_SEED
 
 
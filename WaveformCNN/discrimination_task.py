@@ -1,29 +1,56 @@
-import scipy
-import scipy.spatial
-import tensorflow as tf
-from tensorflow import keras
-import data_processing as data
+#Tensorflow (and data_processing, which needs it) is only imported where a model is run or stimuli are decoded, so
+#re-runs that find every representation in a rep_cache.RepresentationCache never load it
+import copy
+import hashlib
+import numpy as np
+import compact_reps
+import instrumentation
+import os
 import sys
 import csv
+import time
 debug = True
 
 
 
 class Task():
     #name: name of the task (string)
-    #stimuli: list of (vector, category_encoding, rep) pairs
-    #       where each pair has a string condition/category encoding
-    #       and a vector corresponding to the audio of the stimuli
-    #       and a vector corresponding to the model representation of the audio
+    #stimuli: [n, slice_len, 1] numpy array of the audio of the n stimuli
+    #labels: [n, num_categories] numpy array of one-hot category encodings, parallel to stimuli
+    #reps: [n, ...] numpy array of the model representation of each stimulus, parallel to stimuli
     #encoding_categories: dictionary from one-hot encodings to categories (strings)
     #category_encodings: dictionary from categories(strings) to one-hot encodings
-    #distances: dictionary of (string category, string category) => number (distance between stimuli of the categories)
-    def __init__(self, name, stimuli = None, category_encodings = None, encoding_categories = None, distances = None):
+    #categories: list of the category (string) of each stimulus, parallel to stimuli
+    #pair_rows, pair_cols, pair_distances: parallel numpy arrays with an entry for every pair of stimuli (i < j):
+    #       the index of the first stimulus, the index of the second stimulus, and the distance between them
+    #distances: dictionary of (string category, string category) => number (mean distance between stimuli of the categories)
+    #distance_stats: dictionary of (string category, string category) => dictionary with "mean", "var" and "count"
+    #       of the distances between stimuli of the categories
+    #layer_name: name of the probed layer the reps and distances are from, when several layers are probed at once
+    #       (see compute_layer_task_distances); None otherwise
+    #rep_mode: compact_reps.py mode the reps were reduced with, if any (see compute_compact_task_distances); None for
+    #       the full representations
+    #stimuli_directory, stimuli_metadata_csv: the files the stimuli are loaded from (see task_stub)
+    #stimuli_hash: rep_cache.stimuli_hash of those files, once computed (see task_stimuli_hash)
+    def __init__(self, name, stimuli = None, labels = None, reps = None, category_encodings = None,
+                 encoding_categories = None, distances = None):
         self.name = name
         self.stimuli = stimuli
+        self.labels = labels
+        self.reps = reps
         self.category_encodings = category_encodings
         self.encoding_categories = encoding_categories
+        self.categories = None
+        self.pair_rows = None
+        self.pair_cols = None
+        self.pair_distances = None
         self.distances = distances
+        self.distance_stats = None
+        self.layer_name = None
+        self.rep_mode = None
+        self.stimuli_directory = None
+        self.stimuli_metadata_csv = None
+        self.stimuli_hash = None
 
 
 
@@ -74,65 +101,419 @@ class Task():
 #     return scipy.spatial.distance.cosine(stimuli1_rep, stimuli2_rep)
 
 
-#Computes cosine similarity of each pair of stimuli in the file named stimuli_directory
-#and returns the data in a Task object
+#Returns a compiled function that runs model on a batch of audio (inference mode) and returns its output,
+#so that getting representations doesn't pay Keras predict's per-call overhead (callbacks, progress bar, retracing)
+#model: a Keras model, e.g. the intermediate-layer model for the layer being probed
+def representation_function(model):
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=model.input_shape, dtype=tf.float32)])
+    def represent(audio_batch):
+        return model(audio_batch, training=False)
+    return represent
+
+
+#Returns the representations of every stimulus in audio as one [n, ...] numpy array, or, if represent's model has
+#several outputs (see probe_model), a list with one such array per output
+#represent: function from representation_function
+#audio: [n, slice_len, 1] numpy array of stimuli
+#batch_size: number of stimuli per forward pass
+#transforms: if not None, list with a function (or None) per output of represent's model, applied to each batch of
+#that output's representations as soon as it's computed, so only the transformed batches are kept
+def get_representations(represent, audio, batch_size=64, transforms=None):
+    reps = None
+    for start in range(0, len(audio), batch_size):
+        batch_reps = represent(audio[start:start + batch_size])
+        several_outputs = isinstance(batch_reps, (list, tuple))
+        batch_reps = [output_reps.numpy() for output_reps in batch_reps] if several_outputs else [batch_reps.numpy()]
+        if reps is None:
+            reps = [[] for _ in batch_reps]
+            transforms = transforms or [None] * len(batch_reps)
+        for output, output_reps in enumerate(batch_reps):
+            reps[output].append(output_reps if transforms[output] is None else transforms[output](output_reps))
+    reps = [np.concatenate(output_reps) for output_reps in reps]
+    return reps if several_outputs else reps[0]
+
+
+#Returns a list of (probe name, layer) pairs for every layer worth probing in a WaveCNN model: the six LeakyReLU
+#outputs of the convolution blocks (named leaky_relu_0 to leaky_relu_5, whatever Keras named the layers),
+#hidden_rep and the softmax output
+def probe_layers(model):
+    from tensorflow import keras
+    leaky_relus = [layer for layer in model.layers if isinstance(layer, keras.layers.LeakyReLU)]
+    return [("leaky_relu_" + str(index), layer) for index, layer in enumerate(leaky_relus)] + \
+           [("hidden_rep", model.get_layer("hidden_rep")), ("softmax", model.layers[-1])]
+
+
+#Returns a single model with an output for every layer from probe_layers(model), so every layer's activations come
+#from one forward pass, and the list of the outputs' probe names
+def probe_model(model):
+    from tensorflow import keras
+    layers = probe_layers(model)
+    return keras.Model(inputs=model.input, outputs=[layer.output for name, layer in layers]), \
+           [name for name, layer in layers]
+
+
+#Returns the (timesteps, channels) shape of each stimulus' activations at layer before they are flattened (for
+#hidden_rep, the last convolution block's output), for pooling them over time, or None if there's no time axis
+def layer_time_shape(layer):
+    for shape in (layer.output.shape, layer.input.shape):
+        if len(shape) == 3:
+            return tuple(shape[1:])
+    return None
+
+
+#Returns the cosine distance between every pair of stimulus representations as three parallel numpy arrays
+#(rows, cols, distances) with one entry per pair i < j, in the same order as looping over i then j.
+#The representations are normalized once and each block of rows is compared against all rows with one
+#matrix multiply, so there is no Python loop over pairs.
+#Distances involving an all-zero representation are nan, as with scipy.spatial.distance.cosine.
+#reps: [n, ...] numpy array of representations (flattened to [n, d])
+#block_size: number of rows compared at a time; bounds the working memory to block_size x n distances
+def pairwise_cosine_distances(reps, block_size=1024):
+    reps = reps.reshape(len(reps), int(np.prod(reps.shape[1:]))).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        unit_reps = reps / np.linalg.norm(reps, axis=1, keepdims=True)
+
+    n = len(unit_reps)
+    rows, cols, distances = [], [], []
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        #Only columns from start onward can be in the upper triangle for these rows
+        block_similarities = unit_reps[start:end] @ unit_reps[start:].T
+        block_rows, block_cols = np.triu_indices(end - start, k=1, m=n - start)
+        rows.append(block_rows + start)
+        cols.append(block_cols + start)
+        distances.append(np.clip(1.0 - block_similarities[block_rows, block_cols], 0.0, 2.0))
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(distances)
+
+
+#Summarizes pairwise distances by the categories of the two stimuli in each pair
+#Pairs of the same two categories in either order are pooled under the order seen first.
+#categories: list of the category (string) of each stimulus
+#rows, cols, distances: parallel arrays from pairwise_cosine_distances
+#Returns a dictionary of (string category, string category) => dictionary with the "mean", "var" (population variance)
+#and "count" of the distances between stimuli of those categories
+def aggregate_distances(categories, rows, cols, distances):
+    category_ids = {category: index for index, category in enumerate(sorted(set(categories)))}
+    ids = np.array([category_ids[category] for category in categories], dtype=np.int64)
+    num_ids = len(category_ids)
+
+    #Give each unordered category pair one integer key, then group with bincount
+    first, second = ids[rows], ids[cols]
+    keys = np.minimum(first, second) * num_ids + np.maximum(first, second)
+    counts = np.bincount(keys, minlength=num_ids * num_ids)
+    sums = np.bincount(keys, weights=distances, minlength=num_ids * num_ids)
+    squares = np.bincount(keys, weights=distances ** 2, minlength=num_ids * num_ids)
+
+    stats = {}
+    unique_keys, first_seen = np.unique(keys, return_index=True)
+    for key, pair_index in sorted(zip(unique_keys, first_seen), key=lambda key_index: key_index[1]):
+        mean = sums[key] / counts[key]
+        category_pair = (categories[rows[pair_index]], categories[cols[pair_index]])
+        stats[category_pair] = {"mean": mean, "var": max(squares[key] / counts[key] - mean ** 2, 0.0),
+                                "count": int(counts[key])}
+    return stats
+
+
+#Loads the stimuli in the file named stimuli_directory and returns them in a Task object
+#(without model representations or distances), so they can be reused for any number of models
 #Requires stimuli_directory be formatted as "...../task_name/sounds/"
-def run_task(model, stimuli_directory, stimuli_metadata_csv):
+def load_task(stimuli_directory, stimuli_metadata_csv):
+    return load_task_stimuli(task_stub(stimuli_directory, stimuli_metadata_csv))
+
 
-    #Create task and name it by the experiment
+#Returns a Task object named by the experiment for the stimuli in stimuli_directory, without loading them yet
+#(see load_task_stimuli), e.g. for when their representations may all be in a rep_cache.RepresentationCache
+#Requires stimuli_directory be formatted as "...../task_name/sounds/"
+def task_stub(stimuli_directory, stimuli_metadata_csv):
     split_path = stimuli_directory.split("/")
     task_data = Task(name=split_path[len(split_path)-3])
+    task_data.stimuli_directory = stimuli_directory
+    task_data.stimuli_metadata_csv = stimuli_metadata_csv
+    return task_data
+
 
-    #Load stimuli for an experiment
-    batched_cats_and_audio, \
-    category_encoding_map, encoding_category_map = data.get_data(stimuli_directory, stimuli_metadata_csv)
+#Loads the stimuli of task_data (Task object from task_stub) into it, if they aren't loaded yet, and returns it
+def load_task_stimuli(task_data):
+    if task_data.stimuli is not None:
+        return task_data
+    import data_processing as data
+
+    #Load stimuli for an experiment as one array of audio and a parallel array of labels
+    task_data.stimuli, task_data.labels, \
+    category_encoding_map, encoding_category_map = data.get_arrays(task_data.stimuli_directory,
+                                                                   task_data.stimuli_metadata_csv)
 
     task_data.category_encodings = category_encoding_map
     task_data.encoding_categories = encoding_category_map
     task_data.set_cue_names()
+    task_data.categories = [encoding_category_map[tuple(label)] for label in task_data.labels]
+
+    return task_data
+
+
+#Returns rep_cache.stimuli_hash of the files task_data's stimuli are loaded from (computed once per task)
+def task_stimuli_hash(task_data):
+    if task_data.stimuli_hash is None:
+        import rep_cache
+        task_data.stimuli_hash = rep_cache.stimuli_hash(task_data.stimuli_directory, task_data.stimuli_metadata_csv)
+    return task_data.stimuli_hash
+
 
-    stimuli = batched_cats_and_audio.unbatch()
-
-    #Get model representation for each stimulus by calling model.predict
-    #and adding a batch dimension with [None,:]
-    list_stimuli = list(stimuli.as_numpy_iterator())
-    list_stimuli_with_model_reps = []
-    for stimulus in list_stimuli:
-        audio = stimulus[0]
-        label = stimulus[1]
-        model_rep = model.predict(audio[None,:])
-        stim_with_model_rep = (audio, label, model_rep)
-        list_stimuli_with_model_reps.append(stim_with_model_rep)
-    list_stimuli = list_stimuli_with_model_reps
-
-
-    #stimuli = tf.data.Dataset.map(stimuli, lambda audio, label: (audio, label, model.predict(audio[None,:])))
-
-    #For each pair of stimuli, compute cosine distances
-    #Compute set of possible pairs
-    pair_indices = []
-    for i in range(len(list_stimuli)):
-        for j in range(len(list_stimuli)):
-            # Inefficient but working with small numbers of stimuli per task anyway
-            if (i,j) not in pair_indices and (j,i) not in pair_indices and i!=j:
-                pair_indices.append((i,j))
-    stimuli_pairs = [(list_stimuli[i], list_stimuli[j]) for i,j in pair_indices]
-
-    #compute cosine distances
-    distances = {}
-    for index,pair in enumerate(stimuli_pairs):
-        stimulus1 = pair[0]
-        stimulus2 = pair[1]
-        category_pair = (encoding_category_map[tuple(stimulus1[1])], encoding_category_map[tuple(stimulus2[1])])
-        stim1_rep = stimulus1[2]
-        stim2_rep = stimulus2[2]
-        distances[category_pair] = scipy.spatial.distance.cosine(stim1_rep, stim2_rep)
-
-    task_data.distances = distances
+#Returns the dictionary of task_data's categories saved with its representations in a rep_cache.RepresentationCache
+def task_cache_info(task_data):
+    return {"categories": task_data.categories,
+            "category_encodings": [[category, [int(value) for value in encoding]]
+                                   for category, encoding in task_data.category_encodings.items()]}
+
+
+#Sets task_data's categories from info (see task_cache_info) if its stimuli haven't been loaded, so distances can
+#be computed and written from cached representations alone
+def set_task_cache_info(task_data, info):
+    if task_data.categories is not None:
+        return
+    task_data.category_encodings = {category: tuple(encoding) for category, encoding in info["category_encodings"]}
+    task_data.encoding_categories = {encoding: category for category, encoding in task_data.category_encodings.items()}
+    task_data.set_cue_names()
+    task_data.categories = info["categories"]
+
+
+#Computes the model representations of the stimuli in task_data (Task object from load_task) and the cosine
+#distance between each pair of them, replacing any representations and distances from a previous model
+#represent: function from representation_function
+#batch_size: number of stimuli per forward pass when computing model representations
+#run_metrics: if not None, instrumentation.RunMetrics to record the extraction and distance stages in
+#stage_info: extra information to record with those stages (e.g. seed=3)
+def compute_task_distances(represent, task_data, batch_size=64, run_metrics=None, **stage_info):
+
+    #Get model representation for every stimulus in batched forward passes
+    with instrumentation.stage(run_metrics, "representation_extraction", samples=len(task_data.stimuli),
+                               task=task_data.name, **stage_info):
+        task_data.reps = get_representations(represent, task_data.stimuli, batch_size)
+
+    with instrumentation.stage(run_metrics, "distance_computation", samples=num_task_pairs(task_data),
+                               task=task_data.name, **stage_info):
+        set_task_distances(task_data)
 
     return task_data
 
 
+#Returns the number of pairs of stimuli in task_data
+def num_task_pairs(task_data):
+    return len(task_data.categories) * (len(task_data.categories) - 1) // 2
+
+
+#Computes cosine distances for every pair of stimuli from task_data.reps, then summarizes them by category pair
+def set_task_distances(task_data):
+    task_data.pair_rows, task_data.pair_cols, task_data.pair_distances = pairwise_cosine_distances(task_data.reps)
+    task_data.distance_stats = aggregate_distances(task_data.categories, task_data.pair_rows,
+                                                   task_data.pair_cols, task_data.pair_distances)
+    task_data.distances = {pair: stats["mean"] for pair, stats in task_data.distance_stats.items()}
+
+
+#Computes the representations of the stimuli in task_data at every probed layer with one forward pass per batch,
+#and the distances between each pair of them at each layer
+#represent: function from representation_function for a model from probe_model
+#layer_names: the probe names of represent's outputs, from probe_model
+#batch_size, run_metrics, stage_info: as for compute_task_distances
+#Returns a list with a copy of task_data for each layer (sharing its stimuli), with layer_name, reps and distances
+#set for that layer
+def compute_layer_task_distances(represent, task_data, layer_names, batch_size=64, run_metrics=None, **stage_info):
+    with instrumentation.stage(run_metrics, "representation_extraction", samples=len(task_data.stimuli),
+                               task=task_data.name, layers=len(layer_names), **stage_info):
+        layer_reps = get_representations(represent, task_data.stimuli, batch_size)
+
+    layer_tasks = []
+    with instrumentation.stage(run_metrics, "distance_computation", samples=num_task_pairs(task_data) * len(layer_names),
+                               task=task_data.name, layers=len(layer_names), **stage_info):
+        for layer_name, reps in zip(layer_names, layer_reps):
+            layer_task = copy.copy(task_data)
+            layer_task.layer_name = layer_name
+            layer_task.reps = reps
+            set_task_distances(layer_task)
+            layer_tasks.append(layer_task)
+    return layer_tasks
+
+
+#Computes compact representations (see compact_reps.py) of the stimuli of every task in tasks at every probed layer,
+#and the distances between each pair of them
+#represent: function from representation_function (for a model from probe_model if several layers are probed)
+#layer_names: the probe names of represent's outputs
+#compactors: parallel list of compact_reps.CompactRepresentation, one per layer
+#batch_size, run_metrics, stage_info: as for compute_task_distances
+#Returns a list with a copy of each task (sharing its stimuli) for each layer, with rep_mode, reps, distances and (if
+#there are several layers) layer_name set
+def compute_compact_task_distances(represent, tasks, layer_names, compactors, batch_size=64, run_metrics=None,
+                                   **stage_info):
+    layer_task_reps = compact_layer_task_reps(represent, tasks, layer_names, compactors, batch_size, run_metrics,
+                                              **stage_info)
+    return layer_task_copies(tasks, layer_names, layer_task_reps, compactors[0].mode, len(layer_names) > 1,
+                             run_metrics, **stage_info)
+
+
+#Returns compact representations of the stimuli of every task in tasks at every probed layer, as a list parallel to
+#layer_names of lists parallel to tasks
+#Pooling and random projection reduce each batch as it comes out of the model; PCA is fitted once to the
+#representations of all the tasks' stimuli at a layer, then applied to each task.
+#represent, layer_names, compactors, batch_size, run_metrics, stage_info: as for compute_compact_task_distances
+def compact_layer_task_reps(represent, tasks, layer_names, compactors, batch_size=64, run_metrics=None, **stage_info):
+    transforms = [None if compactor.needs_fit() else compactor.transform for compactor in compactors]
+    layer_task_reps = [[] for _ in layer_names]
+    for task in tasks:
+        with instrumentation.stage(run_metrics, "representation_extraction", samples=len(task.stimuli),
+                                   task=task.name, layers=len(layer_names), mode=compactors[0].mode, **stage_info):
+            reps = get_representations(represent, task.stimuli, batch_size, transforms)
+        for index, layer_reps in enumerate(reps if len(layer_names) > 1 else [reps]):
+            layer_task_reps[index].append(layer_reps)
+
+    for index, compactor in enumerate(compactors):
+        if compactor.needs_fit():
+            layer_task_reps[index] = fit_compact_reps(compactor, layer_task_reps[index], run_metrics,
+                                                      layer=layer_names[index], **stage_info)
+    return layer_task_reps
+
+
+#Fits compactor (compact_reps.CompactRepresentation) to task_reps (list of one layer's [n, ...] representations of
+#each task's stimuli) if its mode needs fitting, and returns the list of compact representations
+def fit_compact_reps(compactor, task_reps, run_metrics=None, **stage_info):
+    if compactor.needs_fit():
+        with instrumentation.stage(run_metrics, "representation_fit", samples=sum(len(reps) for reps in task_reps),
+                                   mode=compactor.mode, **stage_info):
+            compactor.fit(task_reps)
+    return [compactor.transform(reps) for reps in task_reps]
+
+
+#Returns a list with a copy of each task in tasks (sharing its stimuli) for each layer in layer_names, with the
+#reps from layer_task_reps (list parallel to layer_names of lists parallel to tasks) and the distances between them
+#rep_mode: compact_reps.py mode to record as the copies' rep_mode (None for full representations)
+#set_layer_names: whether to set the copies' layer_name (when several layers are probed)
+def layer_task_copies(tasks, layer_names, layer_task_reps, rep_mode=None, set_layer_names=False, run_metrics=None,
+                      **stage_info):
+    layer_tasks = []
+    with instrumentation.stage(run_metrics, "distance_computation",
+                               samples=sum(num_task_pairs(task) for task in tasks) * len(layer_names),
+                               layers=len(layer_names), mode=rep_mode or "full", **stage_info):
+        for task_index, task in enumerate(tasks):
+            for layer_index, layer_name in enumerate(layer_names):
+                layer_task = copy.copy(task)
+                if set_layer_names:
+                    layer_task.layer_name = layer_name
+                layer_task.rep_mode = rep_mode
+                layer_task.reps = layer_task_reps[layer_index][task_index]
+                set_task_distances(layer_task)
+                layer_tasks.append(layer_task)
+    return layer_tasks
+
+
+#Returns the full representations of the stimuli of every task in tasks at every layer in layer_names from
+#representation_cache (rep_cache.RepresentationCache), as a list parallel to layer_names of lists parallel to tasks
+#of read-only arrays memory-mapped from the cache, computing and adding the ones that aren't cached yet
+#Tasks that weren't loaded (see task_stub) get their categories from the cache.
+#model_checksum: representation_cache.model_checksum of the model probed
+#prepare_model: function called (only if something isn't cached) to get the model ready and the tasks' stimuli
+#loaded; returns (represent, time shapes), where represent is a function from representation_function with an output
+#for each layer in layer_names and time shapes is the parallel list of layer_time_shape of each layer
+#batch_size, run_metrics, stage_info: as for compute_task_distances
+#Returns the reps and the parallel list of each layer's time shape
+def cached_layer_task_reps(representation_cache, model_checksum, tasks, layer_names, prepare_model, batch_size=64,
+                           run_metrics=None, **stage_info):
+    with instrumentation.stage(run_metrics, "cache_lookup", layers=len(layer_names), **stage_info):
+        entries = [[representation_cache.get(model_checksum, layer_name, task_stimuli_hash(task)) for task in tasks]
+                   for layer_name in layer_names]
+    missing_tasks = [task_index for task_index in range(len(tasks))
+                     if any(layer_entries[task_index] is None for layer_entries in entries)]
+    if missing_tasks:
+        represent, time_shapes = prepare_model()
+        for task_index in missing_tasks:
+            task = tasks[task_index]
+            with instrumentation.stage(run_metrics, "representation_extraction", samples=len(task.stimuli),
+                                       task=task.name, layers=len(layer_names), **stage_info):
+                reps = get_representations(represent, task.stimuli, batch_size)
+            with instrumentation.stage(run_metrics, "cache_write", task=task.name, **stage_info):
+                for layer_index, layer_reps in enumerate(reps if len(layer_names) > 1 else [reps]):
+                    info = dict(task_cache_info(task), time_shape=time_shapes[layer_index])
+                    entries[layer_index][task_index] = representation_cache.put(
+                        model_checksum, layer_names[layer_index], task_stimuli_hash(task), layer_reps, info)
+
+    for task, (reps, info) in zip(tasks, entries[0]):
+        set_task_cache_info(task, info)
+    time_shapes = [layer_entries[0][1]["time_shape"] for layer_entries in entries]
+    return [[reps for reps, info in layer_entries] for layer_entries in entries], time_shapes
+
+
+#Returns compact representations (see compact_reps.py) in rep_mode of the stimuli of every task in tasks at every
+#layer in layer_names from representation_cache (rep_cache.RepresentationCache), as a list parallel to layer_names of
+#lists parallel to tasks, computing and adding the ones that aren't cached yet
+#Only the compact representations are added, keyed by compact_reps.representation_key (for pca, with the stimuli of
+#all the tasks it's fitted to), so running the same mode again makes no forward pass and fits nothing. Layers that
+#aren't cached in this mode are reduced from their cached full representations if they're all there, or else from
+#the model's.
+#Tasks that weren't loaded (see task_stub) get their categories from the cache.
+#model_checksum, prepare_model, batch_size, run_metrics, stage_info: as for cached_layer_task_reps
+#make_compactors: function from a list of layer names and the parallel list of their time shapes to the parallel
+#list of compact_reps.CompactRepresentation to reduce them with
+def cached_compact_layer_task_reps(representation_cache, model_checksum, tasks, layer_names, rep_mode, prepare_model,
+                                   make_compactors, batch_size=64, run_metrics=None, **stage_info):
+    fit_key = hashlib.sha1("\n".join(sorted(task_stimuli_hash(task) for task in tasks)).encode("utf-8")).hexdigest()
+    representation = compact_reps.representation_key(rep_mode, fit_key=fit_key)
+    with instrumentation.stage(run_metrics, "cache_lookup", layers=len(layer_names), mode=rep_mode, **stage_info):
+        entries = [[representation_cache.get(model_checksum, layer_name, task_stimuli_hash(task), representation)
+                    for task in tasks] for layer_name in layer_names]
+    missing_layers = [index for index, layer_entries in enumerate(entries)
+                      if any(entry is None for entry in layer_entries)]
+    if missing_layers:
+        missing_names = [layer_names[index] for index in missing_layers]
+        with instrumentation.stage(run_metrics, "cache_lookup", layers=len(missing_names), **stage_info):
+            full_entries = [[representation_cache.get(model_checksum, layer_name, task_stimuli_hash(task))
+                             for task in tasks] for layer_name in missing_names]
+        if all(entry is not None for layer_entries in full_entries for entry in layer_entries):
+            for task, (reps, info) in zip(tasks, full_entries[0]):
+                set_task_cache_info(task, info)
+            compactors = make_compactors(missing_names, [layer_entries[0][1]["time_shape"]
+                                                         for layer_entries in full_entries])
+            missing_reps = [fit_compact_reps(compactor, [reps for reps, info in layer_entries], run_metrics,
+                                             layer=layer_name, **stage_info)
+                            for layer_name, compactor, layer_entries in zip(missing_names, compactors, full_entries)]
+        else:
+            represent, time_shapes = prepare_model()
+            layer_task_reps = compact_layer_task_reps(represent, tasks, layer_names,
+                                                      make_compactors(layer_names, time_shapes), batch_size,
+                                                      run_metrics, **stage_info)
+            missing_reps = [layer_task_reps[index] for index in missing_layers]
+
+        with instrumentation.stage(run_metrics, "cache_write", layers=len(missing_names), mode=rep_mode, **stage_info):
+            for index, task_reps in zip(missing_layers, missing_reps):
+                for task_index, (task, reps) in enumerate(zip(tasks, task_reps)):
+                    entries[index][task_index] = representation_cache.put(
+                        model_checksum, layer_names[index], task_stimuli_hash(task), reps, task_cache_info(task),
+                        representation)
+
+    for task, (reps, info) in zip(tasks, entries[0]):
+        set_task_cache_info(task, info)
+    return [[reps for reps, info in layer_entries] for layer_entries in entries]
+
+
+#Computes cosine similarity of each pair of stimuli in the file named stimuli_directory
+#and returns the data in a Task object
+#Requires stimuli_directory be formatted as "...../task_name/sounds/"
+#batch_size: number of stimuli per forward pass when computing model representations
+def run_task(model, stimuli_directory, stimuli_metadata_csv, batch_size=64):
+    task_data = load_task(stimuli_directory, stimuli_metadata_csv)
+    return compute_task_distances(representation_function(model), task_data, batch_size)
+
+
+#Loads the weights of the model saved (with model.save) at model_save_name into model, which must have
+#the same architecture. This is much cheaper than keras.models.load_model, and any model built from
+#model's layers (e.g. an intermediate-layer model) sees the new weights without being rebuilt.
+def load_saved_weights(model, model_save_name):
+    #A SavedModel stores its weights as a Tensorflow checkpoint under variables/; the optimizer state
+    #and metrics in it aren't needed for probing
+    model.load_weights(os.path.join(model_save_name, "variables", "variables")).expect_partial()
+
+
 #Writes results for each task in tasks (list of Task object) to file named output_fn
 def write_output(output_fn, tasks):
     output_file = open(output_fn, "w+")
@@ -149,9 +530,48 @@ def write_output(output_fn, tasks):
         output_file.write("\n\n")
     output_file.close()
 
+#Returns a list of dictionaries, one for every pair of stimuli in task (Task object), with the
+#experiment name, distance, diagonal?, trial name (if defined), and the stim1_/stim2_ cue values of the pair
+def task_rows(task, trialname = None):
+    #Cue values and the diagonal check only depend on the categories, so compute them once per category pair
+    cue_values = {category: task.cue_values(category) for category in set(task.categories)}
+    pair_info = {}
+    rows = []
+    for row, col, distance in zip(task.pair_rows, task.pair_cols, task.pair_distances):
+        stim1 = task.categories[row]
+        stim2 = task.categories[col]
+        if (stim1, stim2) not in pair_info:
+            cue_values_stim1 = cue_values[stim1]
+            cue_values_stim2 = cue_values[stim2]
+
+            #compute if the stimulus pair is along the diagonal in the space
+            diagonal = 1
+            for cue in cue_values_stim1:
+                if cue_values_stim1[cue] == cue_values_stim2[cue]:
+                    diagonal = 0
+
+            #update the key names for the cue values so they can be added separately to the CSV
+            pair_dict = {"Experiment": task.name, "Diagonal?": diagonal}
+            if trialname:
+                pair_dict["Trial"] = trialname
+            if task.layer_name is not None:
+                pair_dict["Layer"] = task.layer_name
+            if task.rep_mode is not None:
+                pair_dict["Representation"] = task.rep_mode
+            pair_dict.update({"stim1_"+name: cue_values_stim1[name] for name in cue_values_stim1})
+            pair_dict.update({"stim2_"+name: cue_values_stim2[name] for name in cue_values_stim2})
+            pair_info[(stim1, stim2)] = pair_dict
+
+        pair_dict = dict(pair_info[(stim1, stim2)])
+        pair_dict["Distance"] = float(distance)
+        rows.append(pair_dict)
+    return rows
+
+
 # Outputs cosine distances and corresponding data in csv format
 # Each row corresponds to a pair of stimuli
-# Each row has trial name (if defined),
+# Each row has trial name (if defined), layer name (if several layers were probed),
+# representation mode (if the representations were made compact),
 # experiment name, cue values for Stim1, cue values for Stim2 (blanks for the cues that
 # aren't manipulated in the experiment)
 # diagonal?(1 for diagonal, 0 for not diagonal) and distance
@@ -159,6 +579,10 @@ def csv_write_output(output_fn, tasks, trialname = None):
     fields = ["Experiment","Distance", "Diagonal?"]
     if trialname:
         fields.append("Trial")
+    if any(task.layer_name is not None for task in tasks):
+        fields.append("Layer")
+    if any(task.rep_mode is not None for task in tasks):
+        fields.append("Representation")
     cues = set().union(*[set(task.cue_names) for task in tasks]) #Get names of all the cue fields across tasks
     stim1_cues = ["stim1_"+cue_name for cue_name in cues]
     stim2_cues = ["stim2_"+cue_name for cue_name in cues]
@@ -169,71 +593,216 @@ def csv_write_output(output_fn, tasks, trialname = None):
         writer = csv.DictWriter(csvfile, fieldnames=fields)
         writer.writeheader()
         for task in tasks:
-            for stimuli_pair in task.distances: #A row for each stimulus pair
-                stim1 = stimuli_pair[0]
-                stim2 = stimuli_pair[1]
-
-                cue_values_stim1 = task.cue_values(stim1)
-                cue_values_stim2 = task.cue_values(stim2)
-
-                #compute if the stimulus pair is along the diagonal in the space
-                diagonal = 1
-                for cue in cue_values_stim1:
-                    if cue_values_stim1[cue] == cue_values_stim2[cue]:
-                        diagonal = 0
-
-                #update the key names for the cue values so they can be added separately to the CSV
-                formatted_cue_values_stim1 = {"stim1_"+name: cue_values_stim1[name] for name in cue_values_stim1}
-                formatted_cue_values_stim2 = {"stim2_"+name: cue_values_stim2[name] for name in cue_values_stim2}
-
-                distance = task.distances[stimuli_pair]
-
-                pair_dict = {"Experiment": task.name, "Distance": distance,"Diagonal?": diagonal}
-                if trialname:
-                    pair_dict["Trial"] = trialname
-                pair_dict.update(formatted_cue_values_stim1)
-                pair_dict.update(formatted_cue_values_stim2)
-                writer.writerow(pair_dict)
-
-
-
-
-
+            writer.writerows(task_rows(task, trialname)) #A row for each stimulus pair
+
+
+
+
+
+#Experiments probed by the command line program; each is a directory under stimuli_root with a sounds/ directory
+#and a metadata.csv file
+stimuli_root = "../klatt_synthesis/experimental_stimuli/"
+experiment_names = ["f1_voicing_dur", "f1_closure_dur_low_f0", "f1_closure_dur_high_f0",
+                    "f0_voicing_dur", "f0_closure_dur_low_f1", "f0_closure_dur_high_f1"]
+
+
+#Returns the list of stimuli directories (".../experiment/sounds/") and the parallel list of metadata csv file names
+#for the experiments in experiments
+def experiment_paths(experiments=experiment_names, root=stimuli_root):
+    stimuli_directory_names = [root + experiment + "/sounds/" for experiment in experiments]
+    stimuli_metadata_file_names = [root + experiment + "/metadata.csv" for experiment in experiments]
+    return stimuli_directory_names, stimuli_metadata_file_names
+
+
+#Returns the name of the results csv file for the model with random seed seed_num
+def results_file_name(results_file_name_prefix, seed_num):
+    return results_file_name_prefix + str(seed_num) + "_discrim_results.csv"
+
+
+#Probes the saved model of every seed in seeds with every task in tasks and writes each seed's results csv
+#The first model is loaded in full; every later seed only has its weights swapped into the same model.
+#tasks: list of Task objects from load_task or task_stub (reused for every model); the stimuli of stubs are only
+#loaded the first time a model has to be run on them
+#model_save_name_prefix: the model for seed N is saved at model_save_name_prefix + N; seeds without one are skipped
+#results_file_name_prefix: seed N's results are written to results_file_name(results_file_name_prefix, N)
+#layer_name: name of the layer to probe, or "all" to probe every layer from probe_layers with one multi-output model
+#(the results then have a Layer column)
+#rep_mode: compact_reps.py mode to reduce the representations with before computing distances (the results then have
+#a Representation column), or "full" for the representations as they are; to try several modes without running
+#the models again, use a representation_cache
+#run_metrics: if not None, instrumentation.RunMetrics to record each stage in; written to metrics_file_name (if given)
+#after every seed
+#on_seed_done: if not None, function called with (seed, results file name or store directory, seconds taken) after
+#each seed's results are written
+#results_store_dir: if not None, each seed's results are added to the results_store.py Parquet dataset in this
+#directory instead of being written to a csv file
+#representation_cache: if not None, rep_cache.RepresentationCache the representations are read from and added to
+#(the full ones, or in a compact rep_mode only the compact ones, see cached_compact_layer_task_reps); seeds whose
+#representations are all cached are probed without loading Tensorflow, the model or the stimuli
+#Returns the list of seeds that were probed
+def probe_seeds(seeds, tasks, model_save_name_prefix="saved_models/saved_models/run_seed_",
+                results_file_name_prefix="discrim_results/run_seed_", layer_name="hidden_rep", run_metrics=None,
+                metrics_file_name=None, on_seed_done=None, results_store_dir=None, rep_mode="full",
+                representation_cache=None):
+    compact_reps.parse_mode(rep_mode) #Check the mode before loading anything
+    if results_store_dir is not None:
+        import results_store #Only needs pyarrow when a store is used
+    #The model once built: "model", its "represent" function, the probe "layer_names" and their "time_shapes", and
+    #the "seed" whose weights it has
+    probe = {}
+    #Probe layer name => compact_reps.CompactRepresentation, reused for every seed: the random projection stays the
+    #same and PCA is refitted
+    compactors = {}
+
+    #Gets the model ready to probe the seed_num model saved at model_save_name (building it the first time, and only
+    #swapping the weights in after that) and loads the stimuli of any tasks that aren't loaded yet
+    #Returns probe
+    def prepare_model(seed_num, model_save_name):
+        if not probe:
+            from tensorflow import keras
+            # Layer activation extraction code based on
+            # tutorial at https://keras.io/getting_started/faq/#how-can-i-obtain-the-output-of-an-intermediate-layer-feature-extraction
+            # Get access to probing layer
+            with instrumentation.stage(run_metrics, "model_build", seed=seed_num):
+                model = keras.models.load_model(model_save_name)
+                if layer_name == "all":
+                    intermediate_layer_model, layer_names = probe_model(model)
+                    probed_layers = [layer for name, layer in probe_layers(model)]
+                else:
+                    intermediate_layer_model = keras.Model(inputs=model.input,
+                                                           outputs=model.get_layer(layer_name).output)
+                    layer_names = [layer_name]
+                    probed_layers = [model.get_layer(layer_name)]
+                probe.update(model=model, represent=representation_function(intermediate_layer_model),
+                             layer_names=layer_names, time_shapes=[layer_time_shape(layer) for layer in probed_layers])
+            if debug:
+                intermediate_layer_model.summary()
+        elif probe["seed"] != seed_num:
+            #Later seeds only swap the weights into the same model
+            with instrumentation.stage(run_metrics, "model_load", seed=seed_num):
+                load_saved_weights(probe["model"], model_save_name)
+        probe["seed"] = seed_num
+
+        unloaded_tasks = [task for task in tasks if task.stimuli is None]
+        if unloaded_tasks:
+            with instrumentation.stage(run_metrics, "data_load") as load_stage:
+                for task in unloaded_tasks:
+                    load_task_stimuli(task)
+                load_stage["samples"] = sum(len(task.stimuli) for task in unloaded_tasks)
+        return probe
+
+    #Returns the compactor for each layer in layer_names (with parallel time_shapes), made the first time it's needed
+    def layer_compactors(layer_names, time_shapes):
+        return [compactors.setdefault(name, compact_reps.CompactRepresentation(rep_mode, time_shape))
+                for name, time_shape in zip(layer_names, time_shapes)]
+
+    probed_seeds = []
+    for seed_num in seeds:
+        model_save_name = model_save_name_prefix + str(seed_num)
+        if not os.path.isdir(model_save_name):
+            print("No saved model at", model_save_name, "- skipping seed", seed_num)
+            continue
+        seed_start = time.perf_counter()
+
+        #Get cosine distances for each pair of stimuli in each task
+        if representation_cache is not None:
+            model_checksum = representation_cache.model_checksum(model_save_name)
+            layer_names = [layer_name] if layer_name != "all" else \
+                representation_cache.model_info(model_checksum).get("probe_layers")
+            if layer_names is None:
+                layer_names = prepare_model(seed_num, model_save_name)["layer_names"]
+                representation_cache.set_model_info(model_checksum, probe_layers=layer_names)
+
+            def prepare_cached_model():
+                prepared = prepare_model(seed_num, model_save_name)
+                return prepared["represent"], prepared["time_shapes"]
+            if rep_mode != "full":
+                layer_task_reps = cached_compact_layer_task_reps(representation_cache, model_checksum, tasks,
+                                                                 layer_names, rep_mode, prepare_cached_model,
+                                                                 layer_compactors, run_metrics=run_metrics,
+                                                                 seed=seed_num)
+            else:
+                layer_task_reps, time_shapes = cached_layer_task_reps(representation_cache, model_checksum, tasks,
+                                                                      layer_names, prepare_cached_model,
+                                                                      run_metrics=run_metrics, seed=seed_num)
+            seed_tasks = layer_task_copies(tasks, layer_names, layer_task_reps, None if rep_mode == "full" else rep_mode,
+                                           layer_name == "all", run_metrics, seed=seed_num)
+        else:
+            prepared = prepare_model(seed_num, model_save_name)
+            represent, layer_names = prepared["represent"], prepared["layer_names"]
+            if rep_mode != "full":
+                seed_tasks = compute_compact_task_distances(represent, tasks, layer_names,
+                                                            layer_compactors(layer_names, prepared["time_shapes"]),
+                                                            run_metrics=run_metrics, seed=seed_num)
+            elif layer_name == "all":
+                seed_tasks = [layer_task for task in tasks
+                              for layer_task in compute_layer_task_distances(represent, task, layer_names,
+                                                                             run_metrics=run_metrics, seed=seed_num)]
+            else:
+                seed_tasks = [compute_task_distances(represent, task, run_metrics=run_metrics, seed=seed_num)
+                              for task in tasks]
+
+        #Write cosine distances for each pair in each task to output file (or the results store)
+        seed_results_file_name = results_file_name(results_file_name_prefix, seed_num)
+        with instrumentation.stage(run_metrics, "results_write", seed=seed_num):
+            if results_store_dir is not None:
+                seed_results_file_name = results_store_dir
+                results_store.append_rows(results_store_dir,
+                                          [row for task in seed_tasks
+                                           for row in task_rows(task, trialname=str(seed_num))],
+                                          seed_num)
+            else:
+                csv_write_output(seed_results_file_name, seed_tasks, trialname=str(seed_num))
+        print("Wrote", seed_results_file_name)
+        probed_seeds.append(seed_num)
+        if representation_cache is not None:
+            representation_cache.flush()
+        if run_metrics is not None and metrics_file_name is not None:
+            run_metrics.write(metrics_file_name)
+        if on_seed_done is not None:
+            on_seed_done(seed_num, seed_results_file_name, time.perf_counter() - seed_start)
+    return probed_seeds
+
+
+#Program to probe saved models with the discrimination task.
+#Command line arguments: 1st: random seed of the first model (number)
+# Second (optional): random seed of the last model (number); every model from the first to the last seed is probed
+# in the same run, so the stimuli are decoded and the model is built only once
+# Third (optional): results store directory (see results_store.py); if given, the results are added to this Parquet
+# dataset instead of being written as one csv file per seed (export them for R with results_store.py); - for none
+# Fourth (optional): layer to probe (default hidden_rep), or all to probe every LeakyReLU layer, hidden_rep and the
+# softmax output with a single multi-output model
+# Fifth (optional): representation mode (see compact_reps.py), e.g. avg_pool, max_pool, random_projection:256 or
+# pca:32, to compute distances between compact representations (default full)
+# Sixth (optional): representation cache directory (see rep_cache.py); representations are read from it and added to
+# it, so a re-run with another output or representation mode doesn't load Tensorflow; - for none
+# Seventh (optional): size cap of the representation cache in GB (default rep_cache.default_max_gb)
+#Per-stage timings and memory use are written to discrim_results/run_seed_<first>_to_<last>_discrim_metrics.json
+#(rewritten after every seed)
 if __name__ == "__main__":
-    seed_num = sys.argv[1]
-    #Run parameters: model, experimental stimuli directories, results file name, hidden layer name
-    model_save_name = "saved_models/saved_models/run_seed_"+seed_num
-    root = "../klatt_synthesis/experimental_stimuli/"
-    stimuli_directory_names = [root+"f1_voicing_dur",
-                               root+"f1_closure_dur_low_f0", root+"f1_closure_dur_high_f0",
-                               root+"f0_voicing_dur",
-                               root+"f0_closure_dur_low_f1", root+"f0_closure_dur_high_f1"]
-    stimuli_metadata_file_names = [directory_name+"/metadata.csv" for directory_name in stimuli_directory_names]
-    stimuli_directory_names = [name+"/sounds/" for name in stimuli_directory_names]
-    results_file_name = "discrim_results/run_seed_"+seed_num+"_discrim_results.csv"
-    layer_name = "hidden_rep"
-
-
-
-    # Layer activation extraction code based on
-    # tutorial at https://keras.io/getting_started/faq/#how-can-i-obtain-the-output-of-an-intermediate-layer-feature-extraction
-    # Get access to probing layer
-    model = keras.models.load_model(model_save_name)
-    intermediate_layer_model = keras.Model(inputs=model.input,
-                                           outputs=model.get_layer(layer_name).output)
-    if debug:
-        intermediate_layer_model.summary()
-    #Get cosine distances for each pair of stimuli in each task and save in a list of pairs:
-    # task name (same name as the directory for the stimuli), dictionary of stimuli filename pairs to cosine
-    # distances
-    tasks = []
-    for index, directory_name in enumerate(stimuli_directory_names):
-        task_info = run_task(intermediate_layer_model, directory_name, stimuli_metadata_file_names[index])
-        tasks.append(task_info)
-
-    #Write cosine distances for each pair in each task to output file
-    csv_write_output(results_file_name, tasks, trialname=str(seed_num))
-
-
-
-
+    start_seed = int(sys.argv[1])
+    end_seed = int(sys.argv[2]) if len(sys.argv) > 2 else start_seed
+    results_store_dir = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != "-" else None
+    #Run parameters: models, experimental stimuli directories, results file names, hidden layer name
+    model_save_name_prefix = "saved_models/saved_models/run_seed_"
+    stimuli_directory_names, stimuli_metadata_file_names = experiment_paths()
+    results_file_name_prefix = "discrim_results/run_seed_"
+    layer_name = sys.argv[4] if len(sys.argv) > 4 else "hidden_rep"
+    rep_mode = sys.argv[5] if len(sys.argv) > 5 else "full"
+    representation_cache = None
+    if len(sys.argv) > 6 and sys.argv[6] != "-":
+        import rep_cache
+        max_gb = float(sys.argv[7]) if len(sys.argv) > 7 else rep_cache.default_max_gb
+        representation_cache = rep_cache.RepresentationCache(sys.argv[6], int(max_gb * 1024 ** 3))
+    metrics_file_name = results_file_name_prefix + str(start_seed) + "_to_" + str(end_seed) + "_discrim_metrics.json"
+    run_metrics = instrumentation.RunMetrics({"script": "discrimination_task", "start_seed": start_seed,
+                                              "end_seed": end_seed, "layer_name": layer_name, "rep_mode": rep_mode})
+
+    #The stimuli for every task are loaded once, the first time a model is run on them; the same Task objects are
+    #reused for every model
+    tasks = [task_stub(directory_name, stimuli_metadata_file_names[index])
+             for index, directory_name in enumerate(stimuli_directory_names)]
+
+    probe_seeds(range(start_seed, end_seed + 1), tasks, model_save_name_prefix, results_file_name_prefix, layer_name,
+                run_metrics=run_metrics, metrics_file_name=metrics_file_name, results_store_dir=results_store_dir,
+                rep_mode=rep_mode, representation_cache=representation_cache)
@@ -0,0 +1,184 @@
+# Streaming aggregation of discrimination task distances across seeds
+# Keeps running statistics for every (experiment, stim1 cue values, stim2 cue values, Diagonal?, layer,
+# representation) group of stimulus pairs: the count, mean and variance of the distances (Welford's algorithm, merged
+# a seed at a time) and a fixed-size uniform random sample of them (a reservoir) for bootstrapping. Each seed's results
+# are added once, as the seed finishes, and the state is saved to a JSON file, so the summary table is available at
+# any point without rereading old results, and memory stays the same however many seeds are added.
+import csv
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+
+#Returns the group key of a row from discrimination_task.task_rows (or a row of a results csv):
+#(experiment, ((cue, value), ...) for stim1, ((cue, value), ...) for stim2, diagonal, layer, representation)
+#Blank cue values (cues an experiment doesn't have) are left out; layer and representation are "" unless the row has
+#a Layer or Representation (see discrimination_task.probe_seeds)
+def group_key(row):
+    stim1 = tuple(sorted((name[len("stim1_"):], str(value)) for name, value in row.items()
+                         if name.startswith("stim1_") and value not in (None, "")))
+    stim2 = tuple(sorted((name[len("stim2_"):], str(value)) for name, value in row.items()
+                         if name.startswith("stim2_") and value not in (None, "")))
+    return row["Experiment"], stim1, stim2, int(row["Diagonal?"]), row.get("Layer") or "", \
+           row.get("Representation") or ""
+
+
+class GroupStats():
+    #count, mean, m2: Welford's running count, mean and sum of squared differences from the mean
+    #reservoir: uniform random sample of at most reservoir_size of the distances seen so far
+    def __init__(self, count=0, mean=0.0, m2=0.0, reservoir=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.reservoir = reservoir if reservoir is not None else []
+
+    #Adds a batch of distances (numpy array): the batch's own statistics are merged in with Chan et al.'s parallel
+    #form of Welford's update, and the reservoir is updated with algorithm R
+    def add(self, distances, reservoir_size, rng):
+        batch_count = len(distances)
+        if batch_count == 0:
+            return
+        batch_mean = float(np.mean(distances))
+        batch_m2 = float(np.sum((distances - batch_mean) ** 2))
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.m2 += batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.mean += delta * batch_count / total
+
+        #Distance number i (counting from 0 over everything seen) replaces a random reservoir slot with probability
+        #reservoir_size / (i + 1)
+        slots = rng.integers(0, np.arange(self.count, total) + 1)
+        for index, slot in enumerate(slots):
+            if len(self.reservoir) < reservoir_size:
+                self.reservoir.append(float(distances[index]))
+            elif slot < reservoir_size:
+                self.reservoir[slot] = float(distances[index])
+        self.count = total
+
+    #Sample variance of the distances (nan with fewer than 2)
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+
+class DistanceAggregator():
+    #groups: dictionary of group key (see group_key) => GroupStats
+    #seeds: set of the seeds added so far; adding a seed again is ignored
+    #reservoir_size: number of distances kept per group for bootstrapping
+    #rng: numpy random Generator for the reservoirs
+    def __init__(self, reservoir_size=1000, random_seed=0):
+        self.groups = {}
+        self.seeds = set()
+        self.reservoir_size = reservoir_size
+        self.rng = np.random.default_rng(random_seed)
+
+    #Adds one seed's results; returns False (and adds nothing) if that seed was already added
+    #rows: iterable of row dictionaries from discrimination_task.task_rows (or a results csv) for that seed
+    def add_rows(self, rows, seed):
+        if seed in self.seeds:
+            return False
+        distances_by_group = {}
+        for row in rows:
+            distances_by_group.setdefault(group_key(row), []).append(float(row["Distance"]))
+        for key in sorted(distances_by_group):
+            self.groups.setdefault(key, GroupStats()).add(np.array(distances_by_group[key]), self.reservoir_size,
+                                                          self.rng)
+        self.seeds.add(seed)
+        return True
+
+    #Adds the results csv written by discrimination_task.csv_write_output for one seed
+    #seed: the seed; if None, it's read from the file's Trial column
+    def add_csv(self, results_file_name, seed=None):
+        with open(results_file_name, newline="") as results_file:
+            rows = list(csv.DictReader(results_file))
+        if seed is None:
+            seed = int(rows[0]["Trial"]) if rows else results_file_name
+        return self.add_rows(rows, seed)
+
+    #Returns a list of summary dictionaries, one per group, sorted by group: Experiment, Diagonal?, Layer and
+    #Representation (if the results had them), the stim1_ and stim2_ cue values, and the count, mean, variance (var)
+    #and standard deviation (sd) of the distances
+    def summary(self):
+        table = []
+        for key in sorted(self.groups):
+            experiment, stim1, stim2, diagonal, layer, representation = key
+            stats = self.groups[key]
+            row = {"Experiment": experiment, "Diagonal?": diagonal}
+            if layer:
+                row["Layer"] = layer
+            if representation:
+                row["Representation"] = representation
+            row.update({"stim1_" + cue: value for cue, value in stim1})
+            row.update({"stim2_" + cue: value for cue, value in stim2})
+            row.update({"count": stats.count, "mean": stats.mean, "var": stats.variance(),
+                        "sd": math.sqrt(stats.variance()) if stats.count > 1 else math.nan})
+            table.append(row)
+        return table
+
+    #Returns a (lower, upper) percentile bootstrap confidence interval for the mean distance of the group with key,
+    #resampling its reservoir
+    def bootstrap_mean_ci(self, key, num_resamples=1000, alpha=0.05, random_seed=0):
+        reservoir = np.array(self.groups[key].reservoir)
+        rng = np.random.default_rng(random_seed)
+        means = reservoir[rng.integers(0, len(reservoir), (num_resamples, len(reservoir)))].mean(axis=1)
+        return float(np.quantile(means, alpha / 2)), float(np.quantile(means, 1 - alpha / 2))
+
+    #Saves the aggregator's whole state to the JSON file named path, replacing it only once completely written
+    def save(self, path):
+        state = {"reservoir_size": self.reservoir_size, "rng": self.rng.bit_generator.state,
+                 "seeds": sorted(self.seeds, key=str),
+                 "groups": [{"experiment": key[0], "stim1": list(map(list, key[1])), "stim2": list(map(list, key[2])),
+                             "diagonal": key[3], "layer": key[4], "representation": key[5], "count": stats.count,
+                             "mean": stats.mean, "m2": stats.m2, "reservoir": stats.reservoir}
+                            for key, stats in self.groups.items()]}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, path)
+
+    #Returns the aggregator saved at path, or a new one if there's no file there yet
+    @staticmethod
+    def load(path, reservoir_size=1000):
+        if not os.path.exists(path):
+            return DistanceAggregator(reservoir_size)
+        with open(path) as state_file:
+            state = json.load(state_file)
+        aggregator = DistanceAggregator(state["reservoir_size"])
+        aggregator.rng.bit_generator.state = state["rng"]
+        aggregator.seeds = set(state["seeds"])
+        for group in state["groups"]:
+            key = (group["experiment"], tuple(map(tuple, group["stim1"])), tuple(map(tuple, group["stim2"])),
+                   group["diagonal"], group.get("layer", ""), group.get("representation", ""))
+            aggregator.groups[key] = GroupStats(group["count"], group["mean"], group["m2"], group["reservoir"])
+        return aggregator
+
+
+#Writes summary (from DistanceAggregator.summary) to the csv file output_fn
+def write_summary_csv(output_fn, summary):
+    cue_fields = sorted(set(name for row in summary for name in row if name.startswith("stim")))
+    fields = ["Experiment", "Diagonal?"] + [name for name in ["Layer", "Representation"]
+                                            if any(name in row for row in summary)] + \
+             [name for name in cue_fields if name.startswith("stim1_")] + \
+             [name for name in cue_fields if name.startswith("stim2_")] + ["count", "mean", "var", "sd"]
+    with open(output_fn, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(summary)
+
+
+#Program to add finished seeds' results csvs to an aggregator state file and write the current summary table, e.g.
+#python distance_aggregator.py discrim_results/aggregate.json discrim_results/summary.csv \
+#    discrim_results/run_seed_*_discrim_results.csv
+#Command line arguments: 1st: aggregator state file (created if it doesn't exist)
+# Second: summary csv file to write
+# Rest: results csv files to add (files for seeds already added are skipped)
+if __name__ == "__main__":
+    state_path = sys.argv[1]
+    summary_fn = sys.argv[2]
+    aggregator = DistanceAggregator.load(state_path)
+    added = [results_file_name for results_file_name in sys.argv[3:] if aggregator.add_csv(results_file_name)]
+    aggregator.save(state_path)
+    write_summary_csv(summary_fn, aggregator.summary())
+    print("Added", len(added), "new seeds;", len(aggregator.seeds), "seeds in", len(aggregator.groups), "groups")
@@ -2,6 +2,9 @@
 # Modified to keep track of gold labels, assumed to be on the file names
 from scipy.io.wavfile import read as wavread
 import numpy as np
+import json
+import os
+import sys
 
 import tensorflow as tf
 
@@ -10,7 +13,7 @@ random.seed(1)
 
 debug = False
 
-def decode_audio(fp, fs=None, num_channels=1, normalize=False, fast_wav=False):
+def decode_audio(fp, fs=None, num_channels=1, normalize=False, fast_wav='auto'):
   """Decodes audio file paths into 32-bit floating point vectors.
 
   Args:
@@ -18,24 +21,40 @@ def decode_audio(fp, fs=None, num_channels=1, normalize=False, fast_wav=False):
     fs: If specified, resamples decoded audio to this rate.
     mono: If true, averages channels to mono.
     fast_wav: Assume fp is a standard WAV file (PCM 16-bit or float 32-bit).
+      Cerys: if 'auto', read the file with scipy when it is a standard WAV file, resampling the
+      samples with librosa only if the file's rate isn't fs, and decode anything else with librosa.
+      This gives the same samples as fast_wav=False without librosa's file decoding.
 
   Returns:
     A np.float32 array containing the audio samples at specified sample rate.
   """
   fp = fp.decode('utf-8')
+  _wav = None
   if fast_wav:
-    # Read with scipy wavread (fast).
-    _fs, _wav = wavread(fp)
-    if fs is not None and fs != _fs:
+    # Read with scipy wavread (fast). Cerys: memory-mapped, so the samples are converted straight out of the file
+    try:
+      _fs, _wav = wavread(fp, mmap=True)
+    except ValueError:
+      if fast_wav != 'auto':
+        raise
+    if _wav is not None and fast_wav != 'auto' and fs is not None and fs != _fs:
       raise NotImplementedError('Scipy cannot resample audio.')
-    if _wav.dtype == np.int16:
+    if _wav is None:
+      pass
+    elif _wav.dtype == np.int16:
       _wav = _wav.astype(np.float32)
       _wav /= 32768.
     elif _wav.dtype == np.float32:
       _wav = np.copy(_wav)
+    elif fast_wav == 'auto':
+      _wav = None
     else:
       raise NotImplementedError('Scipy cannot process atypical WAV files.')
-  else:
+    if _wav is not None and fs is not None and fs != _fs:
+      # Cerys: same resampler librosa.core.load uses, applied along the time axis
+      import librosa
+      _wav = np.swapaxes(librosa.resample(np.swapaxes(_wav, 0, -1), orig_sr=_fs, target_sr=fs), 0, -1)
+  if _wav is None:
     # Decode with librosa load (slow but supports file formats like mp3).
     import librosa
     _wav, _fs = librosa.core.load(fp, sr=fs, mono=False)
@@ -70,6 +89,202 @@ def decode_audio(fp, fs=None, num_channels=1, normalize=False, fast_wav=False):
   return _wav
 
 
+# Cerys: decoding every wav file through librosa on every epoch (and again for every seed) is the slowest part of
+# loading. The functions below decode a directory once into a single [N, slice_len, nch] .npy file that is read back
+# as a memmap, with a sidecar index of the file names and the settings used to decode them.
+_CACHE_AUDIO_FN = 'audio.npy'
+_CACHE_INDEX_FN = 'index.json'
+
+
+def _audio_cache_key(fps, decode_fs, decode_num_channels, decode_normalize, decode_fast_wav, slice_len):
+  """Describes the files and decode settings an audio cache was built from.
+
+  Args:
+    fps: List of audio file paths.
+    (remaining args as in compile_audio_cache)
+
+  Returns:
+    A JSON-serializable dict; the cache is stale if this changes.
+  """
+  files = []
+  for fp in sorted(fps):
+    stat = os.stat(fp)
+    files.append([fp, stat.st_mtime_ns, stat.st_size])
+  return {
+    'params': {
+      'decode_fs': decode_fs,
+      'decode_num_channels': decode_num_channels,
+      'decode_normalize': decode_normalize,
+      'decode_fast_wav': decode_fast_wav,
+      'slice_len': slice_len},
+    'files': files}
+
+
+def decode_first_slice(
+    fp,
+    decode_fs,
+    decode_num_channels=1,
+    decode_normalize=True,
+    decode_fast_wav='auto',
+    slice_len=8192):
+  """Decodes one audio file and zero-pads or cuts it to slice_len samples.
+
+  Args:
+    fp: Audio file path (string).
+    (the rest are the same as compile_audio_cache)
+
+  Returns:
+    A [slice_len, decode_num_channels] np.float32 array; the same as the first zero-padded
+    frame id_decode_extract_and_batch takes from the file.
+  """
+  _wav = decode_audio(
+      fp.encode('utf-8'),
+      fs=decode_fs,
+      num_channels=decode_num_channels,
+      normalize=decode_normalize,
+      fast_wav=decode_fast_wav)
+  _wav = _wav[:slice_len, 0, :]
+  _slice = np.zeros([slice_len, decode_num_channels], dtype=np.float32)
+  _slice[:_wav.shape[0]] = _wav
+  return _slice
+
+
+def compile_audio_cache(
+    fps,
+    cache_dir,
+    decode_fs,
+    decode_num_channels=1,
+    decode_normalize=True,
+    decode_fast_wav='auto',
+    slice_len=8192):
+  """Decodes audio files once into a single padded array on disk.
+
+  Args:
+    fps: List of audio file paths.
+    cache_dir: Directory to write the cache to (created if needed).
+    decode_fs: (Re-)sample rate for decoded audio files.
+    decode_num_channels: Number of channels for decoded audio files.
+    decode_normalize: If false, do not normalize audio waveforms.
+    decode_fast_wav: If true, uses scipy to decode standard wav files ('auto': see decode_audio).
+    slice_len: Length in samples every waveform is zero-padded or cut to.
+
+  Returns:
+    A (list of string, np.float32 memmap) tuple: the file paths in cache order and the
+    [len(fps), slice_len, decode_num_channels] audio array aligned with them.
+  """
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  key = _audio_cache_key(fps, decode_fs, decode_num_channels, decode_normalize, decode_fast_wav, slice_len)
+  cache_fps = [entry[0] for entry in key['files']]
+
+  # Write to temporary names first so an interrupted compile never looks like a valid cache
+  audio_fp = os.path.join(cache_dir, _CACHE_AUDIO_FN)
+  index_fp = os.path.join(cache_dir, _CACHE_INDEX_FN)
+  tmp_audio_fp = audio_fp + '.tmp.npy'
+  audio = np.lib.format.open_memmap(
+      tmp_audio_fp,
+      mode='w+',
+      dtype=np.float32,
+      shape=(len(cache_fps), slice_len, decode_num_channels))
+  for i, fp in enumerate(cache_fps):
+    audio[i] = decode_first_slice(
+        fp,
+        decode_fs,
+        decode_num_channels=decode_num_channels,
+        decode_normalize=decode_normalize,
+        decode_fast_wav=decode_fast_wav,
+        slice_len=slice_len)
+  audio.flush()
+  del audio
+  os.replace(tmp_audio_fp, audio_fp)
+  with open(index_fp + '.tmp', 'w') as index_file:
+    json.dump(key, index_file)
+  os.replace(index_fp + '.tmp', index_fp)
+
+  return cache_fps, np.load(audio_fp, mmap_mode='r')
+
+
+def load_audio_cache(
+    fps,
+    cache_dir,
+    decode_fs,
+    decode_num_channels=1,
+    decode_normalize=True,
+    decode_fast_wav='auto',
+    slice_len=8192):
+  """Opens an audio cache written by compile_audio_cache, recompiling it if it is stale.
+
+  The cache is stale if any file in fps was added, removed, modified (mtime or size), or if
+  any of the decode settings differ from the ones the cache was built with.
+
+  Args:
+    (same as compile_audio_cache)
+
+  Returns:
+    A (list of string, np.float32 memmap) tuple as in compile_audio_cache.
+  """
+  audio_fp = os.path.join(cache_dir, _CACHE_AUDIO_FN)
+  index_fp = os.path.join(cache_dir, _CACHE_INDEX_FN)
+  if os.path.exists(audio_fp) and os.path.exists(index_fp):
+    with open(index_fp) as index_file:
+      cached_key = json.load(index_file)
+    key = _audio_cache_key(fps, decode_fs, decode_num_channels, decode_normalize, decode_fast_wav, slice_len)
+    if cached_key == key:
+      return [entry[0] for entry in key['files']], np.load(audio_fp, mmap_mode='r')
+    if debug:
+      print('Audio cache in', cache_dir, 'is stale; recompiling')
+  return compile_audio_cache(
+      fps,
+      cache_dir,
+      decode_fs,
+      decode_num_channels=decode_num_channels,
+      decode_normalize=decode_normalize,
+      decode_fast_wav=decode_fast_wav,
+      slice_len=slice_len)
+
+
+# Cerys: counts the clips pad_or_crop has cut short, so long clips aren't silently truncated
+_truncated_clips = None
+
+
+def _truncated_clip_counter():
+  # Created lazily, and outside of any Dataset.map, since a map function can't create variables
+  global _truncated_clips
+  if _truncated_clips is None:
+    _truncated_clips = tf.Variable(0, dtype=tf.int64, trainable=False, name='truncated_clips')
+  return _truncated_clips
+
+
+def truncated_clip_count():
+  """Returns the number of clips longer than slice_len that pad_or_crop has cut.
+
+  The count covers every pass over every single-slice (slice_first_only) Dataset in this process,
+  so a clip is counted once per epoch.
+  """
+  return 0 if _truncated_clips is None else int(_truncated_clips.numpy())
+
+
+def pad_or_crop(audio, slice_len, truncated_clips=None):
+  """Zero-pads or cuts a decoded clip to exactly slice_len samples in one step.
+
+  Cerys: this is the same as the first frame of tf.signal.frame(audio, slice_len, pad_end=True),
+  without framing the whole clip and throwing away every frame but the first.
+
+  Args:
+    audio: [nsamps, 1, nch] float32 tensor, as from decode_audio.
+    slice_len: Length in samples.
+    truncated_clips: If specified, a tf.Variable that is incremented if the clip is longer than slice_len.
+
+  Returns:
+    A [slice_len, nch] float32 tensor.
+  """
+  nsamps = tf.shape(audio)[0]
+  if truncated_clips is not None:
+    truncated_clips.assign_add(tf.cast(nsamps > slice_len, tf.int64))
+  audio = audio[:slice_len, 0, :]
+  return tf.pad(audio, [[0, slice_len - tf.shape(audio)[0]], [0, 0]])
+
+
 def id_decode_extract_and_batch(
     fps,
     batch_size,
@@ -77,11 +292,12 @@ def id_decode_extract_and_batch(
     decode_num_channels,
     slice_len = 8192,#- maybe not needed since I'm not slicing up the wav files; one wav file = one training datum. I will set it to be as long as a synthesized VCV will likely to be
     decode_normalize=True,
-    decode_fast_wav=False,
-    decode_parallel_calls=1,
+    decode_fast_wav='auto',
+    decode_parallel_calls=tf.data.AUTOTUNE,
     slice_randomize_offset=False, #- not needed since I'm not slicing up the wav files or discriminating real vs fake and shuffling phase;
         # one wav file = one training datum
-    slice_first_only=False, #- not needed since I'm not slicing up the wav files; one wav file = one training datum
+    slice_first_only=False, # Cerys: get_data sets this, since one wav file = one training datum; clips longer than
+        # slice_len are counted (see truncated_clip_count)
     slice_overlap_ratio=0, # - not needed since I'm not slicing up the wav files; one wav file = one training datum
     slice_pad_end=True, #- needed to make slices same length to be compatible for batching; Donahue has this optional,
         # but I may remove it and just automatically pad
@@ -89,7 +305,9 @@ def id_decode_extract_and_batch(
     shuffle=True,
     shuffle_buffer_size=1000,
     prefetch_size=None,
-    prefetch_gpu_num=None):
+    prefetch_gpu_num=None,
+    cache_dir=None,
+    shuffle_seed=None):
   """Decodes audio file paths into mini-batches of samples.
 
   Args:
@@ -99,10 +317,11 @@ def id_decode_extract_and_batch(
     decode_fs: (Re-)sample rate for decoded audio files.
     decode_num_channels: Number of channels for decoded audio files.
     decode_normalize: If false, do not normalize audio waveforms.
-    decode_fast_wav: If true, uses scipy to decode standard wav files.
-    decode_parallel_calls: Number of parallel decoding threads.
+    decode_fast_wav: If true, uses scipy to decode standard wav files ('auto': see decode_audio).
+    decode_parallel_calls: Number of parallel decoding threads (AUTOTUNE lets tf.data pick).
     Cerys: not used ---slice_randomize_offset: If true, randomize starting position for slice.
-    ---slice_first_only: If true, only use first slice from each audio file.
+    slice_first_only: If true, only use first slice from each audio file. Cerys: decodes, pads and cuts each
+      file in one map (see pad_or_crop) instead of framing the whole file.
     ---slice_overlap_ratio: Ratio of overlap between adjacent slices.
     ---slice_pad_end: If true, allows zero-padded examples from the end of each audio file.
     repeat: If true (for training), continuously iterate through the dataset.
@@ -110,6 +329,12 @@ def id_decode_extract_and_batch(
     shuffle_buffer_size: Number of examples to queue up before grabbing a batch.
     prefetch_size: Number of examples to prefetch from the queue.
     prefetch_gpu_num: If specified, prefetch examples to GPU.
+    cache_dir: If specified, read audio from (or first compile) a decoded audio cache in this
+      directory instead of decoding every file; see compile_audio_cache.
+    shuffle_seed: Cerys: if specified (and shuffle is true), shuffle an index per file with this seed,
+      in a new order every epoch, instead of shuffling the file list with the module's random and then
+      the examples through a shuffle buffer. Cached audio is gathered by index a batch at a time; files
+      are decoded in the single-slice mode (see slice_first_only).
 
   Old:
   /Returns:
@@ -121,13 +346,50 @@ def id_decode_extract_and_batch(
     A tuple of (string, np.float32 tensor) tuples where the np.float32 tensors represent audio waveforms
     audio: batch_size, slice_len, 1, nch
   """
+  if cache_dir is not None:
+    # Cerys: cached mode skips decoding and slicing entirely; the cache is already padded to slice_len
+    cache_fps, cache_audio = load_audio_cache(
+        fps,
+        cache_dir,
+        decode_fs,
+        decode_num_channels=decode_num_channels,
+        decode_normalize=decode_normalize,
+        decode_fast_wav=decode_fast_wav,
+        slice_len=slice_len)
+    # Cerys: only indices go through the pipeline; each batch's rows are read from the memmap, so the audio comes
+    # from the OS page cache (shared by every process reading the same cache) instead of a private in-memory copy
+    if shuffle and shuffle_seed is not None:
+      dataset = _shuffled_indices(len(cache_fps), shuffle_seed, repeat)
+    else:
+      order = list(range(len(cache_fps)))
+      if shuffle:
+        random.shuffle(order)
+      dataset = tf.data.Dataset.from_tensor_slices(np.array(order, dtype=np.int64))
+      if repeat:
+        dataset = dataset.repeat()
+      if shuffle:
+        dataset = dataset.shuffle(buffer_size=shuffle_buffer_size, seed=1)
+    dataset = dataset.batch(batch_size, drop_remainder=False)
+    dataset = dataset.map(_cache_batch_reader(cache_fps, cache_audio), num_parallel_calls=tf.data.AUTOTUNE)
+    return _prefetch(dataset, prefetch_size, prefetch_gpu_num)
+
   # Create dataset of filepaths
-  if shuffle:
-      print(fps)
-      random.shuffle(fps) #Random's shuffle function is in-place
-      print(fps)
+  if shuffle and shuffle_seed is not None:
+    # Cerys: the shuffle is already done on the file indices, so there's no need to shuffle the examples again
+    fps_tensor = tf.constant(fps)
+    dataset = _shuffled_indices(len(fps), shuffle_seed, repeat).map(lambda index: tf.gather(fps_tensor, index))
+    repeat = False
+    shuffle = False
+    # Two iterations of a reshuffled Dataset don't come out in the same order, so the file names have to travel
+    # with their audio (as they do in the single-slice mode) rather than be zipped back on afterwards
+    slice_first_only = True
+  else:
+    if shuffle:
+        print(fps)
+        random.shuffle(fps) #Random's shuffle function is in-place
+        print(fps)
 
-  dataset = tf.data.Dataset.from_tensor_slices(fps)
+    dataset = tf.data.Dataset.from_tensor_slices(fps)
 
   # Shuffle all filepaths every epoch
   #I think doing it with Dataset is buggy for keeping track of the labels, so I shuffle them with random - they're just strings, so it won't take long
@@ -207,6 +469,17 @@ def id_decode_extract_and_batch(
   # dataset = dataset.map(
   #     _decode_audio_shaped,
   #     num_parallel_calls=decode_parallel_calls)
+  if slice_first_only:
+    truncated_clips = _truncated_clip_counter()
+
+    def _decode_and_slice(fp):
+      audio = pad_or_crop(_decode_audio_shaped(fp), slice_len, truncated_clips)
+      return fp, tf.reshape(audio, (slice_len, 1))
+
+    dataset = dataset.map(_decode_and_slice, num_parallel_calls=decode_parallel_calls)
+    return _shuffle_batch_and_prefetch(
+        dataset, batch_size, shuffle, shuffle_buffer_size, prefetch_size, prefetch_gpu_num)
+
   fp_dataset = dataset
   dataset = dataset.map(
     _decode_audio_shaped,
@@ -229,6 +502,67 @@ def id_decode_extract_and_batch(
       length += 1
     print("LENGTH", length)
 
+  return _shuffle_batch_and_prefetch(
+      dataset, batch_size, shuffle, shuffle_buffer_size, prefetch_size, prefetch_gpu_num)
+
+
+def _cache_batch_reader(cache_fps, cache_audio):
+  """Returns a function from a batch of cache indices to their (file paths, audio) tensors.
+
+  Args:
+    cache_fps: List of the cached file paths, in cache order.
+    cache_audio: [n, slice_len, 1, nch] np.float32 memmap of the cached audio.
+  """
+  fps_array = np.array([fp.encode('utf-8') for fp in cache_fps])
+
+  def _read_rows(indices):
+    # Reading the rows in file order keeps the memmap reads sequential
+    order = np.argsort(indices)
+    audio = np.empty((len(indices),) + cache_audio.shape[1:], dtype=np.float32)
+    audio[order] = cache_audio[indices[order]]
+    return fps_array[indices], audio
+
+  def _read_batch(indices):
+    fps, audio = tf.numpy_function(_read_rows, [indices], [tf.string, tf.float32], stateful=False)
+    fps.set_shape([None])
+    audio.set_shape([None] + list(cache_audio.shape[1:]))
+    return fps, audio
+
+  return _read_batch
+
+
+def _shuffled_indices(num_examples, shuffle_seed, repeat):
+  """Returns a Dataset of the indices 0 to num_examples - 1 in a seeded order that changes every epoch.
+
+  Shuffling int64 indices is cheap, so the shuffle buffer holds the whole epoch without a long fill.
+  """
+  dataset = tf.data.Dataset.range(num_examples).shuffle(
+      num_examples, seed=shuffle_seed, reshuffle_each_iteration=True)
+  if repeat:
+    dataset = dataset.repeat()
+  return dataset
+
+
+def _prefetch(dataset, prefetch_size, prefetch_gpu_num):
+  """Prefetches a batched dataset (see id_decode_extract_and_batch for the arguments)."""
+  if prefetch_size is not None:
+    dataset = dataset.prefetch(prefetch_size)
+    if prefetch_gpu_num is not None and prefetch_gpu_num >= 0:
+      dataset = dataset.apply(
+          tf.data.experimental.prefetch_to_device(
+            '/device:GPU:{}'.format(prefetch_gpu_num)))
+  return dataset
+
+
+def _shuffle_batch_and_prefetch(dataset, batch_size, shuffle, shuffle_buffer_size, prefetch_size, prefetch_gpu_num):
+  """Shuffles, batches and prefetches a dataset of (file path, audio) examples.
+
+  Args:
+    (same as id_decode_extract_and_batch)
+
+  Returns:
+    The batched dataset.
+  """
   # Shuffle examples
   if shuffle:
     dataset = dataset.shuffle(buffer_size=shuffle_buffer_size, seed=1)
@@ -251,12 +585,7 @@ def id_decode_extract_and_batch(
     print("LENGTH", length)
 
   # Prefetch a number of batches
-  if prefetch_size is not None:
-    dataset = dataset.prefetch(prefetch_size)
-    if prefetch_gpu_num is not None and prefetch_gpu_num >= 0:
-      dataset = dataset.apply(
-          tf.data.experimental.prefetch_to_device(
-            '/device:GPU:{}'.format(prefetch_gpu_num)))
+  dataset = _prefetch(dataset, prefetch_size, prefetch_gpu_num)
 
 
   # Get tensors - why is this part necessary? Oh, because of prefetching? No... prefetching just returns
@@ -277,3 +606,13 @@ def id_decode_extract_and_batch(
 #   return [element[index] for element in batch]
 
 
+# Compiles the decoded audio cache for a directory of wav files ahead of training, e.g.
+# python id_loader.py ../klatt_synthesis/sounds_pulse_voicing_artificial_closure_dur/ audio_caches/pulse_voicing/
+# Command line arguments: 1st: directory of wav files (end with /), 2nd: cache directory, 3rd (optional): sample rate
+if __name__ == "__main__":
+  wav_file_dir = sys.argv[1]
+  cache_dir = sys.argv[2]
+  decode_fs = int(sys.argv[3]) if len(sys.argv) > 3 else 16000
+  fps = [wav_file_dir + fn for fn in os.listdir(wav_file_dir)]
+  cache_fps, audio = load_audio_cache(fps, cache_dir, decode_fs)
+  print("Cached", len(cache_fps), "files with shape", audio.shape, "in", cache_dir)
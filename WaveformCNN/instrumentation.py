@@ -0,0 +1,136 @@
+# Lightweight per-stage instrumentation for training and probing runs: wall time, sample counts and peak memory of
+# each stage (data load, model build, every epoch, checkpoint saves, representation extraction, distances...),
+# written as one structured metrics JSON per run, e.g. next to the saved model.
+# Importing this module doesn't load Tensorflow; the Keras callback that records training epochs is in
+# timing_callbacks.py.
+import contextlib
+import json
+import os
+import sys
+import time
+
+
+#Returns the peak resident memory of this process so far, in MB
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+#Returns the current resident memory of this process in MB, or None where /proc isn't available
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+class RunMetrics():
+    #run_info: dictionary of facts about the run (e.g. seed, paths) to save with the metrics
+    #stages: list of dictionaries, one per finished stage, in order, each with the stage "name", its "wall_time"
+    #       (seconds), "samples" (if counted), "rss_mb"/"peak_rss_mb" at its end, and any extra information
+    #summary: dictionary of extra run-level results (e.g. whether training was input-bound)
+    def __init__(self, run_info=None):
+        self.run_info = dict(run_info or {})
+        self.stages = []
+        self.summary = {}
+        self.start_time = time.time()
+        self._start_counter = time.perf_counter()
+
+    #Context manager that times the code inside it as a stage called name and records it when it ends
+    #samples: number of samples (clips, stimuli, ...) the stage processes, if known up front
+    #info: extra keyword information to save with the stage (e.g. seed=3)
+    #Yields the stage's dictionary, so samples or other information can be added once known
+    @contextlib.contextmanager
+    def stage(self, name, samples=None, **info):
+        entry = {"name": name}
+        entry.update(info)
+        if samples is not None:
+            entry["samples"] = samples
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            self.add(entry.pop("name"), time.perf_counter() - start, **entry)
+
+    #Records a stage timed elsewhere (e.g. by a Keras callback)
+    def add(self, name, wall_time, **info):
+        entry = {"name": name, "wall_time": wall_time}
+        entry.update(info)
+        entry["rss_mb"] = current_rss_mb()
+        #ru_maxrss can lag slightly behind /proc's current figure
+        entry["peak_rss_mb"] = max(peak_rss_mb(), entry["rss_mb"] or 0)
+        self.stages.append(entry)
+
+    #Returns a dictionary of stage name => total "count", "wall_time" and "samples" over every stage of that name
+    def stage_totals(self):
+        totals = {}
+        for entry in self.stages:
+            total = totals.setdefault(entry["name"], {"count": 0, "wall_time": 0.0, "samples": 0})
+            total["count"] += 1
+            total["wall_time"] += entry["wall_time"]
+            total["samples"] += entry.get("samples", 0)
+        return totals
+
+    #Returns everything recorded so far as a JSON-serializable dictionary
+    def to_dict(self):
+        return {"run": self.run_info,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+                "total_wall_time": time.perf_counter() - self._start_counter,
+                "peak_rss_mb": peak_rss_mb(),
+                "summary": self.summary,
+                "stage_totals": self.stage_totals(),
+                "stages": self.stages}
+
+    #Writes the metrics to the JSON file named path (replacing it, so it can be rewritten as a run goes on)
+    def write(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2, default=float)
+        os.replace(temp_path, path)
+
+
+#Returns run_metrics.stage(name, ...) or, if run_metrics is None, a context manager that does nothing,
+#so instrumented functions can take an optional RunMetrics
+def stage(run_metrics, name, samples=None, **info):
+    if run_metrics is None:
+        return contextlib.nullcontext({})
+    return run_metrics.stage(name, samples, **info)
+
+
+#Times reading num_batches batches from dataset on its own (no training step) and records it as an "input_probe"
+#stage. Comparing it with the training step time shows whether training is input-bound: in Keras fit, waiting for the
+#next batch is part of each step (the batch is fetched inside the compiled step, so callbacks can't time the wait on
+#its own), so a step can't take less than the input pipeline needs to produce a batch.
+#The first warmup_batches batches aren't timed: they include creating the iterator, filling the shuffle buffer and
+#the first batch's latency, which a training epoch only pays once.
+#Run it after training, so the extra pass doesn't change the data order training sees.
+#step_time: mean seconds per training step (e.g. timing_callbacks.EpochTimingCallback.mean_step_time()), or None
+#input_bound_ratio: training is recorded as input-bound if a batch takes at least this fraction of a step's time to
+#read. With prefetching, input and compute overlap and a step takes about as long as the slower of the two, so an
+#input time close to the step time means the step is waiting on input; the default leaves a 20% margin for the noise
+#of timing a few batches.
+#Returns the mean seconds per batch of the input pipeline (None if dataset has no batches past the warm-up)
+def probe_input_pipeline(run_metrics, dataset, num_batches=5, step_time=None, warmup_batches=1,
+                         input_bound_ratio=0.8):
+    input_time = None
+    with run_metrics.stage("input_probe") as entry:
+        iterator = iter(dataset)
+        warmup_start = time.perf_counter()
+        entry["warmup_batches"] = sum(1 for _ in zip(range(warmup_batches), iterator))
+        entry["warmup_time"] = time.perf_counter() - warmup_start
+        batches_read = 0
+        start = time.perf_counter()
+        for _ in zip(range(num_batches), iterator):
+            batches_read += 1
+        if batches_read:
+            input_time = (time.perf_counter() - start) / batches_read
+        entry["batches"] = batches_read
+    run_metrics.summary["input_sec_per_batch"] = input_time
+    if step_time and input_time is not None:
+        run_metrics.summary["step_sec_per_batch"] = step_time
+        run_metrics.summary["input_bound"] = input_time >= input_bound_ratio * step_time
+        run_metrics.summary["input_bound_ratio"] = input_bound_ratio
+    return input_time
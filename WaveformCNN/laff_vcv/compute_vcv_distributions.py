@@ -3,9 +3,23 @@ import parselmouth
 import os
 import matplotlib.pyplot as plt
 import math
+import hashlib
+import json
+import multiprocessing
+import numpy as np
 
 debug = False
 
+#Praat analysis settings for the vowel measurements; they're part of the measurement cache key (see measurement_key),
+#so changing any of them re-measures every token
+formant_time_step = 0.0025 #seconds
+formant_max_number = 5
+formant_window_length = 0.025 #seconds
+formant_pre_emphasis = 50 #Hz
+pitch_time_step = 0.0 #0 means Praat picks the time step from the pitch floor
+pitch_floor = 75 #Hz
+pitch_ceiling = 500 #Hz
+
 class VcvToken:
     voiced = ["b", "d", "g"]
     voiceless = ["p", "t", "k"]
@@ -76,14 +90,19 @@ def read_measurements(grid_file_name, wav_file_name):
     closure_dur = closure.maxTime - closure.minTime
     stop = Stop(stop_label, voicing_dur, closure_dur)
 
-    if speaker_info[0] == "f1":
-        max_hz = 7000
-    else:
-        max_hz = 5000
+    max_hz = speaker_max_hz(speaker_info)
     vowel1, vowel2 = read_vowel_measurements(wav_file_name, vowel_tier[0], vowel_tier[1], vowel_label, vowel_label, max_hz)
 
     return VcvToken(speaker_info, stop, vowel1, vowel2)
 
+#speaker_info: speaker label from a token file name, e.g. "f1"
+#Returns the maximum frequency(Hz) to look for formants in for that speaker
+def speaker_max_hz(speaker_info):
+    if speaker_info[0] == "f1":
+        return 7000
+    else:
+        return 5000
+
 #praat_object: Parselmouth praat object to get the estimate from
 #frequency_type: string, "f0" or "formant"
 #formant_num: define if frequency type is formant, the number of the formant to estimate
@@ -119,6 +138,76 @@ def get_praat_estimate(praat_object, frequency_type, formant_num = 0, point=True
     return estimate, offset
 
 
+#The offsets get_praat_estimate tries for a point estimate, built up the same way it does (repeatedly adding .001),
+#so the times tried match it exactly
+search_offsets = [0]
+while search_offsets[-1] + .001 <= 0.04:
+    search_offsets.append(search_offsets[-1] + .001)
+search_offsets = np.array(search_offsets)
+
+
+#praat_object: a Parselmouth Formant or Pitch object
+#frequency_type: string, "f0" or "formant"
+#num_formants: if frequency type is formant, the number of formants to extract
+#Returns a [num_formants, number of frames] (or [1, number of frames] for f0) numpy array of the track's values
+#in Hz, with nan in frames where Praat has no value, so the track only has to be read out of Praat once
+def get_praat_track(praat_object, frequency_type, num_formants=0):
+    if frequency_type == "formant":
+        #The matrix has 0 in frames where the formant isn't defined
+        values = np.array([parselmouth.praat.call(praat_object, "To Matrix", formant_num).values[0]
+                           for formant_num in range(1, num_formants + 1)])
+        values[values <= 0] = np.nan
+    else:
+        #Unvoiced frames have frequency 0; Praat counts a frame as voiced if it's between 0 and the pitch ceiling
+        values = praat_object.selected_array["frequency"][np.newaxis, :].copy()
+        values[(values <= 0) | (values >= praat_object.ceiling)] = np.nan
+    return values
+
+
+#Array version of Praat's "Get value at time" with linear interpolation (Sampled_getValueAtX in the Praat source)
+#praat_object: the Parselmouth Formant or Pitch object the track came from (for its time grid)
+#track: [levels, frames] numpy array from get_praat_track
+#times: numpy array of times, in seconds
+#Returns a [levels, len(times)] numpy array of values, nan where Praat would return undefined
+def track_values_at_times(praat_object, track, times):
+    num_frames = track.shape[1]
+    #Same arithmetic as Praat: 1-based real-valued frame index, then the nearer and farther of the two frames around it
+    index = (times - praat_object.x1) / praat_object.dx + 1.0
+    left = np.floor(index).astype(int)
+    phase = index - left
+    near = np.where(phase < 0.5, left, left + 1)
+    far = np.where(phase < 0.5, left + 1, left)
+    phase = np.where(phase < 0.5, phase, 1.0 - phase)
+
+    near_valid = (near >= 1) & (near <= num_frames) & (times >= praat_object.xmin) & (times <= praat_object.xmax)
+    far_valid = (far >= 1) & (far <= num_frames)
+    near_values = track[:, np.clip(near, 1, num_frames) - 1]
+    far_values = track[:, np.clip(far, 1, num_frames) - 1]
+    near_values[:, ~near_valid] = np.nan
+    #If the farther frame is out of range or undefined, Praat uses the nearer frame's value on its own
+    far_values = np.where(far_valid & ~np.isnan(far_values), far_values, near_values)
+    return near_values + phase * (far_values - near_values)
+
+
+#Array version of get_praat_estimate's point estimates, for every level of a track at once
+#praat_object, track: as for track_values_at_times
+#timepoint: time to take the estimate from, in seconds
+#offsetDirection: move measurement backward (-1) or forward(1)
+#Returns a list with, for each level, the estimate at the first offset up to 40ms where the value is defined
+#(nan if there isn't one) and the offset used to calculate it, the same as get_praat_estimate
+def get_track_estimates(praat_object, track, timepoint, offsetDirection=-1):
+    values = track_values_at_times(praat_object, track, timepoint + offsetDirection * search_offsets)
+    estimates = []
+    for level_values in values:
+        defined = np.flatnonzero(~np.isnan(level_values))
+        if len(defined) > 0:
+            estimate = float(level_values[defined[0]])
+            offset = search_offsets[defined[0]]
+        else:
+            estimate = math.nan
+            offset = search_offsets[-1] #get_praat_estimate's offset after the last try
+        estimates.append((estimate, (offset + .001) - .001))
+    return estimates
 
 
 #wav_file_name: string name of a wav file
@@ -161,36 +250,38 @@ def read_vowel_measurements(wav_file_name, vowel1, vowel2, vowel1_label, vowel2_
     # Read wavfile with Praat for formant data
     sound = parselmouth.Sound(wav_file_name)
     #TODO: adjust parameters for different speakers
-    formants = parselmouth.praat.call(sound, "To Formant (burg)", 0.0025, 5, max_hz, 0.025, 50)
+    formants = parselmouth.praat.call(sound, "To Formant (burg)", formant_time_step, formant_max_number, max_hz,
+                                      formant_window_length, formant_pre_emphasis)
 
     #Take midpoint measurements of steady state vs transition regions
+    #Read the formant tracks out of Praat once, then take every point estimate from the arrays
     formant_range = range(1,5)
-    for formant_num in formant_range:
+    formant_track = get_praat_track(formants, "formant", num_formants=len(formant_range))
+    #First vowel: value during the flat part of the vowel, and during the transitional part of the vowel -
+    #take 10ms earlier because of messy closure
+    v1_steady_estimates = get_track_estimates(formants, formant_track, v1_steady_midpoint)
+    v1_transit_estimates = get_track_estimates(formants, formant_track, vowel1.maxTime - .01)
+    #Second vowel: value during the flat part of the vowel, and during the transitional part of the vowel
+    v2_steady_estimates = get_track_estimates(formants, formant_track, v2_steady_midpoint, offsetDirection=1)
+    v2_transit_estimates = get_track_estimates(formants, formant_track, vowel2.minTime, offsetDirection=1)
+    for index, formant_num in enumerate(formant_range):
 
         #########First vowel
 
-        #Value during the flat part of the vowel
-        v1_steady, offset = get_praat_estimate(formants, "formant", formant_num, point=True,
-                                               timepoint=v1_steady_midpoint)
+        v1_steady, offset = v1_steady_estimates[index]
         if math.isnan(v1_steady) or offset > 0:
             print(wav_file_name, "v1 steady", formant_num, v1_steady, "offset", offset, v1_steady_midpoint)
 
-        #Value during the transitional part of the vowel - take 10ms earlier because of messy closure
-        v1_transit, offset = get_praat_estimate(formants, "formant", formant_num, point=True,
-                                               timepoint=vowel1.maxTime - .01)
+        v1_transit, offset = v1_transit_estimates[index]
         if math.isnan(v1_transit) or offset > 0:
             print(wav_file_name, "v1 transit", formant_num, v1_transit, "offset", offset)
 
         ########Second vowel
-        # Value during the flat part of the vowel
-        v2_steady, offset = get_praat_estimate(formants, "formant", formant_num, point=True,
-                                                   timepoint=v2_steady_midpoint, offsetDirection=1)
+        v2_steady, offset = v2_steady_estimates[index]
         if math.isnan(v2_steady) or offset > 0:
             print(wav_file_name, "v2 steady", formant_num, v2_steady, "offset", offset)
 
-        # Value during the transitional part of the vowel
-        v2_transit, offset = get_praat_estimate(formants, "formant", formant_num, point=True,
-                                                    timepoint=vowel2.minTime, offsetDirection=1)
+        v2_transit, offset = v2_transit_estimates[index]
         if math.isnan(v2_transit) or offset > 0:
             print(wav_file_name, "v2 transit", formant_num, v2_transit, "offset", offset)
 
@@ -202,7 +293,7 @@ def read_vowel_measurements(wav_file_name, vowel1, vowel2, vowel1_label, vowel2_
     #Take f0 measurements of steady state vs transition regions (worried f0 won't be well defined if I go too near the  closure)
     #TODO: adjust parameters for different speakers
     #check for cleanness in f0 contours
-    pitch = parselmouth.praat.call(sound, "To Pitch", 0.0, 75, 500)  # create a praat pitch object
+    pitch = parselmouth.praat.call(sound, "To Pitch", pitch_time_step, pitch_floor, pitch_ceiling)  # create a praat pitch object
 
     #Vowel1 steady pitch
     v1_steady_f0, offset = get_praat_estimate(pitch,"f0",point=False,span_begin=v1_steady_min,span_end=v1_steady_max)
@@ -215,13 +306,15 @@ def read_vowel_measurements(wav_file_name, vowel1, vowel2, vowel1_label, vowel2_
     if math.isnan(v2_steady_f0) or offset > 0:
         print(wav_file_name, "v2 steady f0", v2_steady_f0, "offset", offset)
 
+    pitch_track = get_praat_track(pitch, "f0")
+
     #Vowel1 transitional pitch
-    v1_transit_f0, offset = get_praat_estimate(pitch, "f0", point=True, timepoint=vowel1.maxTime)
+    v1_transit_f0, offset = get_track_estimates(pitch, pitch_track, vowel1.maxTime)[0]
     if math.isnan(v1_transit_f0) or offset > 0:
         print(wav_file_name, "v1 transit f0", v1_transit_f0, "offset", offset)
 
     # Vowel2 transitional pitch
-    v2_transit_f0, offset = get_praat_estimate(pitch, "f0", point=True, timepoint=vowel2.minTime, offsetDirection=1)
+    v2_transit_f0, offset = get_track_estimates(pitch, pitch_track, vowel2.minTime, offsetDirection=1)[0]
     if math.isnan(v2_transit_f0) or offset > 0:
         print(wav_file_name, "v2 transit f0", v2_transit_f0, "offset", offset)
 
@@ -329,25 +422,104 @@ def plot_vowel_measures(tokens,condition, label, nbins=30, plot_dir = "laff_plot
                            nbins, label=label,
                            savename=plot_dir + label + "_v2_transition_F" + str(formant_no) + ".png")
 
-#Returns two lists of VCV objects with values measured from the Laff corpus
-#The first list is composed of voiced stops(bdg), the second voiceless stops(ptk)
-def get_vcv_data(path="../../laff_vcv_tokens_with_stops"):
+#Returns a dictionary version of a VCV token that can be written to json (and read back with token_from_dict)
+def token_to_dict(vcv):
+    return {"speaker": vcv.speaker,
+            "stop": {"label": vcv.stop.label, "voicing_dur": vcv.stop.voicing_dur,
+                     "closure_dur": vcv.stop.closure_dur},
+            "vowel1": {"label": vcv.vowel1.label, "measurements": vcv.vowel1.measurement_dict},
+            "vowel2": {"label": vcv.vowel2.label, "measurements": vcv.vowel2.measurement_dict}}
+
+
+#Returns the VCV token object for a dictionary from token_to_dict
+def token_from_dict(token_dict):
+    vowels = []
+    for vowel_key in ["vowel1", "vowel2"]:
+        vowel = Vowel(token_dict[vowel_key]["label"])
+        #json turns the integer measurement keys into strings
+        for measure, values in token_dict[vowel_key]["measurements"].items():
+            vowel.measurement_dict[int(measure)] = dict(values)
+        vowels.append(vowel)
+    stop = token_dict["stop"]
+    return VcvToken(token_dict["speaker"], Stop(stop["label"], stop["voicing_dur"], stop["closure_dur"]),
+                    vowels[0], vowels[1])
+
+
+#grid_file_name, wav_file_name: a token's textgrid and wav file
+#Returns a hash (string) of the contents of both files and every analysis setting that read_measurements uses,
+#so a cached measurement is only reused if neither the files nor the settings have changed
+def measurement_key(grid_file_name, wav_file_name):
+    speaker_info = os.path.basename(grid_file_name).split("_")[1]
+    settings = [speaker_max_hz(speaker_info), formant_time_step, formant_max_number, formant_window_length,
+                formant_pre_emphasis, pitch_time_step, pitch_floor, pitch_ceiling]
+    key = hashlib.sha1()
+    for file_name in [grid_file_name, wav_file_name]:
+        with open(file_name, "rb") as token_file:
+            key.update(token_file.read())
+    key.update(json.dumps(settings).encode())
+    return key.hexdigest()
+
+
+#Worker function for measure_tokens: measures one token
+#filenames: (textgrid file name, wav file name) tuple
+#Returns the token as a dictionary (see token_to_dict), which is cheaper to send back from a worker process
+def measure_token(filenames):
+    grid_file_name, wav_file_name = filenames
+    return token_to_dict(read_measurements(grid_file_name, wav_file_name))
+
+
+#Measures every token (textgrid + wav pair) in path, in a pool of worker processes
+#Each token's measurements are saved to cache_dir/<token name>.json with its measurement_key; tokens whose files
+#and analysis settings haven't changed since then are read back from there instead of being measured again
+#path: directory of tokens
+#cache_dir: directory for the measurement cache, or None to measure every token without caching
+#processes: number of worker processes, None for one per CPU core
+#Returns a list of VCV token objects, in sorted token name order
+def measure_tokens(path, cache_dir="vcv_measurement_cache", processes=None):
     files = os.listdir(path)
     token_names = list(set([file[0:file.index(".")] for file in files]))
     token_names.sort()
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    token_dicts = {}
+    keys = {}
+    to_measure = []
+    for token_name in token_names:
+        filename = path + "/" + token_name
+        if cache_dir is not None:
+            keys[token_name] = measurement_key(filename + ".TextGrid", filename + ".wav")
+            cache_file_name = os.path.join(cache_dir, token_name + ".json")
+            if os.path.exists(cache_file_name):
+                with open(cache_file_name) as cache_file:
+                    cached = json.load(cache_file)
+                if cached["key"] == keys[token_name]:
+                    token_dicts[token_name] = cached["token"]
+                    continue
+        to_measure.append(token_name)
+
+    if len(to_measure) > 0:
+        print("Measuring", len(to_measure), "of", len(token_names), "tokens")
+        jobs = [(path + "/" + token_name + ".TextGrid", path + "/" + token_name + ".wav") for token_name in to_measure]
+        with multiprocessing.Pool(processes) as pool:
+            measured = pool.map(measure_token, jobs)
+        for token_name, token_dict in zip(to_measure, measured):
+            token_dicts[token_name] = token_dict
+            if cache_dir is not None:
+                with open(os.path.join(cache_dir, token_name + ".json"), "w") as cache_file:
+                    json.dump({"key": keys[token_name], "token": token_dict}, cache_file)
+
+    return [token_from_dict(token_dicts[token_name]) for token_name in token_names]
 
+
+#Returns two lists of VCV objects with values measured from the Laff corpus
+#The first list is composed of voiced stops(bdg), the second voiceless stops(ptk)
+#cache_dir, processes: see measure_tokens
+def get_vcv_data(path="../../laff_vcv_tokens_with_stops", cache_dir="vcv_measurement_cache", processes=None):
     voiced_stops = ["b", "d", "g"]  # this should be done with something like enums, but that's low priority for now
     voiceless_stops = ["p", "t", "k"]
 
-    tokens = []
-    for token_name in token_names:
-        #print("Working on", token_name)
-        filename = path + "/" + token_name
-        vcv = read_measurements(filename + ".TextGrid", filename + ".wav")
-        #if debug:
-        #    print("\t", vcv.stop.voicing_dur, vcv.stop.closure_dur)
-        #    print("\t", vcv.vowel1.measurement_dict)
-        tokens.append(vcv)
+    tokens = measure_tokens(path, cache_dir=cache_dir, processes=processes)
 
     #Filter out glottal stops
     voiced_stops = [token for token in tokens if token.stop.label in voiced_stops]
@@ -357,22 +529,11 @@ def get_vcv_data(path="../../laff_vcv_tokens_with_stops"):
 
 if __name__ == "__main__":
     path = "../../laff_vcv_tokens_with_stops"
-    files = os.listdir(path)
-    token_names = list(set([file[0:file.index(".")] for file in files]))
-    token_names.sort()
 
     voiced_stops = ["b","d","g"]#technically this should be done with enums, but that's low priority for now
     voiceless_stops = ["p","t","k"] #TODO: glottal stops
 
-    tokens = []
-    for token_name in token_names:
-        print("Working on", token_name)
-        filename = path + "/"+token_name
-        vcv = read_measurements(filename+".TextGrid", filename+".wav")
-        #if debug:
-        #    print("\t", vcv.stop.voicing_dur, vcv.stop.closure_dur)
-        #    print("\t", vcv.vowel1.measurement_dict)
-        tokens.append(vcv)
+    tokens = measure_tokens(path)
 
     print(len([token for token in tokens if token.stop.label in voiced_stops+voiceless_stops]))
     exit()
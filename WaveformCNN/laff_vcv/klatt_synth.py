@@ -0,0 +1,259 @@
+# Klatt-style formant synthesizer for the VCV training tokens, in numpy
+# Renders the rows that sample_params.generate_klatt_parameter_file writes, with the same formant, f0 and amplitude
+# timecourses that klatt_synthesis/praat_vcv_synthesis.R writes into KlattGrid scripts, but in-process and a batch of
+# tokens at a time instead of one Praat process per token.
+# It isn't sample-identical to Praat's KlattGrid (the glottal pulse and gain details differ), but the tokens have
+# the same timing, formant and f0 targets and closure voicing.
+import csv
+import os
+import sys
+
+import numpy as np
+from scipy.io import wavfile
+
+
+#Same values as praat_vcv_synthesis.R
+formant_bandwidths = [60, 90, 120, 250, 250] #Hz, for F1-F5
+formant_amp = 60 #dB
+f0_amp = 60 #dB
+#Small transition times because Klatt linear interpolation - can't change instantaneously
+higher_formants_fade = 0.01
+closure_voicing_fade = 0.01
+voicing_return_time = 0.01
+
+#Glottal flow pulse shape: flow = x^power1 - x^power2 over the open part of each period (Praat's KlattGrid defaults)
+open_phase = 0.7
+power1 = 3
+power2 = 4
+
+
+#row: dictionary of Klatt parameters for one token, as written by generate_klatt_parameter_file
+#Returns a dictionary of named times (seconds) when transitions should occur; port of get_waypoints in the R script
+def get_waypoints(row):
+    vowel_dur = float(row["VowelDur"])
+    closure_dur = float(row["ClosureDur"])
+    closure_voicing_dur = float(row["ClosureVoicingDur"])
+
+    #Waypoints around the closure a bit different for if there's closure voicing or not
+    waypoints = {"voicing": closure_voicing_dur > 0, "v1_end": vowel_dur}
+    if waypoints["voicing"]:
+        waypoints["closure_begin"] = vowel_dur + higher_formants_fade
+        waypoints["voicing_end"] = waypoints["closure_begin"] + closure_voicing_dur
+        waypoints["silence_begin"] = waypoints["voicing_end"] + closure_voicing_fade
+        waypoints["closure_end"] = waypoints["silence_begin"] + (closure_dur - closure_voicing_dur)
+    else:
+        waypoints["closure_begin"] = vowel_dur + closure_voicing_fade
+        waypoints["closure_end"] = waypoints["closure_begin"] + closure_dur
+    waypoints["v2_begin"] = waypoints["closure_end"] + voicing_return_time
+    waypoints["v2_end"] = waypoints["v2_begin"] + vowel_dur
+
+    #Formant and f0 transition points within-vowel are the same for both
+    waypoints["f0_v1_trans_time"] = vowel_dur - float(row["f0TransitionDur"])
+    waypoints["f0_v2_trans_time"] = waypoints["v2_begin"] + float(row["f0TransitionDur"])
+    for formant in range(1, 6):
+        transition_dur = float(row["F1TransitionDur"] if formant == 1 else row["OtherFsTransitionDur"])
+        waypoints["F" + str(formant) + "_v1_trans_time"] = vowel_dur - transition_dur
+        waypoints["F" + str(formant) + "_v2_trans_time"] = waypoints["v2_begin"] + transition_dur
+    return waypoints
+
+
+#row: dictionary of Klatt parameters for one token, as written by generate_klatt_parameter_file
+#num_formants: number of oral formants to synthesize (praat_vcv_synthesis.R uses 3)
+#Returns a dictionary of point tiers, each a list of (time, value) points like the KlattGrid "Add ... point" commands:
+# "F1".."Fn": formant frequencies (Hz), "A1".."An": formant amplitudes (dB), "B1".."Bn": formant bandwidths (Hz),
+# "f0": pitch (Hz) and "AV": voicing amplitude (dB)
+def get_tiers(row, num_formants=3):
+    waypoints = get_waypoints(row)
+    voicing = waypoints["voicing"]
+    v1_end = waypoints["v1_end"]
+    closure_begin = waypoints["closure_begin"]
+    closure_end = waypoints["closure_end"]
+    v2_begin = waypoints["v2_begin"]
+    max_time = waypoints["v2_end"]
+
+    tiers = {}
+    for formant in range(1, num_formants + 1):
+        name = str(formant)
+        steady_freq = float(row["F" + name + "steady"])
+        offset_freq = float(row["F" + name + "offset"])
+        tiers["B" + name] = [(0, formant_bandwidths[formant - 1])]
+
+        #Amplitude: positive through v1, then held at half (closure voicing, F1 only) or faded out for the closure,
+        #then back for v2
+        if voicing and formant == 1:
+            tiers["A" + name] = [(0, formant_amp), (v1_end, formant_amp), (closure_begin, formant_amp / 2),
+                                 (waypoints["voicing_end"], formant_amp / 2), (waypoints["silence_begin"], 0)]
+        else:
+            tiers["A" + name] = [(0, formant_amp), (v1_end, formant_amp), (closure_begin, 0), (closure_end, 0)]
+        tiers["A" + name] += [(v2_begin, formant_amp), (max_time, formant_amp)]
+
+        #Frequency: steady, then interpolate to the offset frequency at the end of v1
+        tiers["F" + name] = [(0, steady_freq), (waypoints["F" + name + "_v1_trans_time"], steady_freq),
+                             (v1_end, offset_freq)]
+        #If F1 and closure voicing, switch to closure voicing frequency value, then back to the offset frequency
+        #before the closure ends, during silence
+        if voicing and formant == 1:
+            closure_freq = float(row["F1Closure"])
+            tiers["F" + name] += [(closure_begin, closure_freq), (waypoints["voicing_end"], closure_freq),
+                                  (closure_end, offset_freq)]
+        #Transition from offset frequency to steady frequency at the beginning of v2
+        tiers["F" + name] += [(v2_begin, offset_freq), (waypoints["F" + name + "_v2_trans_time"], steady_freq),
+                              (max_time, steady_freq)]
+
+    f0_steady = float(row["f0steady"])
+    f0_offset = float(row["f0offset"])
+    tiers["f0"] = [(0, f0_steady), (waypoints["f0_v1_trans_time"], f0_steady), (v1_end, f0_offset)]
+    if voicing:
+        f0_closure = float(row["f0Closure"])
+        tiers["f0"] += [(closure_begin, f0_closure), (waypoints["voicing_end"], f0_closure), (closure_end, f0_offset)]
+        tiers["AV"] = [(0, f0_amp), (waypoints["voicing_end"], f0_amp), (waypoints["silence_begin"], 0),
+                       (closure_end, 0)]
+    else:
+        tiers["AV"] = [(0, f0_amp), (v1_end, f0_amp), (closure_begin, 0), (closure_end, 0)]
+    tiers["f0"] += [(v2_begin, f0_offset), (waypoints["f0_v2_trans_time"], f0_steady), (max_time, f0_steady)]
+    tiers["AV"] += [(v2_begin, f0_amp), (max_time, f0_amp)]
+    return tiers
+
+
+#points: list of (time, value) points
+#times: numpy array of times (seconds)
+#Returns the tier's value at each time: linear interpolation between points and constant outside them,
+#like a Praat RealTier. Like Praat, a point at a time that already has a point is ignored.
+def tier_values(points, times):
+    point_times = []
+    point_values = []
+    for time, value in sorted(points, key=lambda point: point[0]):
+        if time not in point_times:
+            point_times.append(time)
+            point_values.append(value)
+    return np.interp(times, point_times, point_values)
+
+
+#f0: [batch, samples] numpy array of f0 (Hz) at every sample
+#fs: sampling rate (Hz)
+#Returns a [batch, samples] numpy array of the derivative of a glottal flow pulse train with that f0
+def glottal_source(f0, fs):
+    #Position within the current period, from the running phase
+    phase = np.cumsum(f0 / fs, axis=1)
+    position = (phase - np.floor(phase)) / open_phase
+    flow = np.where(position < 1, position ** power1 - position ** power2, 0)
+    return np.diff(flow, axis=1, prepend=0) * fs / 1000
+
+
+#Returns the coefficients of Klatt's digital resonator for formant frequencies and bandwidths (Hz, numpy arrays)
+#y[n] = a*x[n] + b*y[n-1] + c*y[n-2]
+#peak_gain: if True, scale the resonator to a gain of 1 at the formant frequency (what Praat does for parallel
+#formants), otherwise to a gain of 1 at 0 Hz (Klatt's cascade resonators)
+def resonator_coefficients(frequencies, bandwidths, fs, peak_gain=False):
+    radius = np.exp(-np.pi * bandwidths / fs)
+    cos_angle = np.cos(2 * np.pi * frequencies / fs)
+    c = -radius ** 2
+    b = 2 * radius * cos_angle
+    if peak_gain:
+        #cos(2 * angle) = 2cos(angle)^2 - 1
+        a = (1 - radius) * np.sqrt(1 - 2 * radius * (2 * cos_angle ** 2 - 1) + radius ** 2)
+    else:
+        a = 1 - b - c
+    return a, b, c
+
+
+#Filters source through time-varying resonators, one sample at a time but for every token and formant at once
+#source: [samples, batch, formants] numpy array (or [samples, batch, 1] to use the same input for every formant)
+#a, b, c: [samples, batch, formants] numpy arrays of resonator coefficients
+#Returns the [samples, batch, formants] resonator outputs
+def run_resonators(source, a, b, c):
+    output = np.empty(a.shape)
+    previous = np.zeros(a.shape[1:])
+    before_previous = np.zeros(a.shape[1:])
+    for n in range(a.shape[0]):
+        current = a[n] * source[n] + b[n] * previous + c[n] * before_previous
+        output[n] = current
+        before_previous = previous
+        previous = current
+    return output
+
+
+#Synthesizes a batch of tokens at once
+#rows: list of dictionaries of Klatt parameters, as written by generate_klatt_parameter_file
+#fs: sampling rate (Hz); 44100 is what the Praat scripts use
+#model: "parallel" (formants filter the source side by side and are scaled by their amplitude tiers, as in the
+#Praat scripts) or "cascade" (formants filter the source one after another; the formant amplitude tiers aren't used)
+#num_formants: number of oral formants
+#Returns a list of 1-d numpy float arrays, one per row, each scaled to a peak of 0.99
+def synthesize_batch(rows, fs=44100, model="parallel", num_formants=3):
+    all_tiers = [get_tiers(row, num_formants) for row in rows]
+    lengths = [int(round(max(time for time, value in tiers["f0"]) * fs)) for tiers in all_tiers]
+    times = np.arange(max(lengths)) / fs
+
+    def tier_matrix(name):
+        return np.stack([tier_values(tiers[name], times) for tiers in all_tiers]) #[batch, samples]
+
+    voicing_gain = 10 ** (tier_matrix("AV") / 20)
+    source = (glottal_source(tier_matrix("f0"), fs) * voicing_gain).T[:, :, np.newaxis] #[samples, batch, 1]
+
+    formant_names = [str(formant) for formant in range(1, num_formants + 1)]
+    frequencies = np.stack([tier_matrix("F" + name) for name in formant_names], axis=2).transpose(1, 0, 2)
+    bandwidths = np.stack([tier_matrix("B" + name) for name in formant_names], axis=2).transpose(1, 0, 2)
+    a, b, c = resonator_coefficients(frequencies, bandwidths, fs, peak_gain=(model == "parallel"))
+
+    if model == "parallel":
+        gains = np.stack([10 ** (tier_matrix("A" + name) / 20) for name in formant_names], axis=2).transpose(1, 0, 2)
+        output = np.sum(run_resonators(source, a, b, c) * gains, axis=2)
+    elif model == "cascade":
+        output = source[:, :, 0]
+        for formant in range(num_formants):
+            output = run_resonators(output[:, :, np.newaxis], a[:, :, formant:formant + 1],
+                                    b[:, :, formant:formant + 1], c[:, :, formant:formant + 1])[:, :, 0]
+    else:
+        raise ValueError("Unknown vocal tract model " + model)
+
+    sounds = []
+    for token, length in enumerate(lengths):
+        sound = output[:length, token]
+        peak = np.max(np.abs(sound))
+        sounds.append(sound * 0.99 / peak if peak > 0 else sound)
+    return sounds
+
+
+#Synthesizes every row, batch_size tokens at a time, and saves each to out_dir/<Name>.wav as 16-bit PCM
+#out_dir: output directory (end with /)
+#Other arguments as for synthesize_batch
+def write_wavs(rows, out_dir, fs=44100, batch_size=64, model="parallel", num_formants=3):
+    os.makedirs(out_dir, exist_ok=True)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        for row, sound in zip(batch, synthesize_batch(batch, fs, model, num_formants)):
+            wavfile.write(out_dir + row["Name"] + ".wav", fs, np.round(sound * 32767).astype(np.int16))
+
+
+#Synthesizes every row straight into a training array, skipping the wav files
+#Each token is rendered at fs, normalized to a peak of 1 and zero-padded or cut to slice_len samples, the same as
+#id_loader.compile_audio_cache does for decoded wavs
+#Returns a [len(rows), slice_len, 1] float32 numpy array, in the same order as rows
+def synthesize_array(rows, fs=16000, slice_len=8192, batch_size=64, model="parallel", num_formants=3):
+    audio = np.zeros((len(rows), slice_len, 1), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        for index, sound in enumerate(synthesize_batch(rows[start:start + batch_size], fs, model, num_formants)):
+            sound = sound[:slice_len] / 0.99
+            audio[start + index, :len(sound), 0] = sound
+    return audio
+
+
+#Returns the rows of a Klatt parameter csv file from generate_klatt_parameter_file, as a list of dictionaries
+def read_klatt_parameter_file(klatt_param_fn):
+    with open(klatt_param_fn, newline='') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+#Program to synthesize a wav file for every token in a Klatt parameter file
+#Command line arguments: 1st: Klatt parameter csv file (from sample_params.py)
+# Second: output directory for the wav files (end with /)
+# Third (optional): sampling rate, 44100 by default like the Praat scripts
+if __name__ == "__main__":
+    klatt_param_fn = sys.argv[1]
+    out_dir = sys.argv[2]
+    fs = int(sys.argv[3]) if len(sys.argv) > 3 else 44100
+
+    rows = read_klatt_parameter_file(klatt_param_fn)
+    print("Synthesizing", len(rows), "tokens to", out_dir)
+    write_wavs(rows, out_dir, fs)
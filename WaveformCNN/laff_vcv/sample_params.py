@@ -38,15 +38,16 @@ def normalize(tokens):
 #Return a noisy sample from the distribution of VCV tokens in #tokens with a stop label of #label
 #tokens: list of Vcv objects
 #label: string
-def generate_sample_vcv(tokens, label, frequency_stdevs, closure_dur_stdev, closure_voicing_stdev):
+#rng: source of randomness (the random module, or a random.Random instance for a separately seeded stream)
+def generate_sample_vcv(tokens, label, frequency_stdevs, closure_dur_stdev, closure_voicing_stdev, rng=random):
 
     #Joint sample of values
     tok_indices = list(range(0, len(tokens)))
-    sample_token = tokens[random.sample(tok_indices, 1)[0]]
+    sample_token = tokens[rng.sample(tok_indices, 1)[0]]
 
     #Get closure voicing duration and add noise
     voicing = sample_token.stop.voicing_dur
-    voicing += random.gauss(0, closure_voicing_stdev) #Can I measure variation for a non parameterized distribution?
+    voicing += rng.gauss(0, closure_voicing_stdev) #Can I measure variation for a non parameterized distribution?
     voicing = voicing if voicing > 0 else 0
 
     #Get closure duration and add noise
@@ -56,7 +57,7 @@ def generate_sample_vcv(tokens, label, frequency_stdevs, closure_dur_stdev, clos
     #for artificial_closure_dur version (neaten up code so version-type is accounted for with
     # a single point of control instead of switching manually here)
     closure_dur = .08 if label == "voiced" else .15
-    closure_dur += random.gauss(0, .02) #Smaller standard deviation so they don't overlap as much
+    closure_dur += rng.gauss(0, .02) #Smaller standard deviation so they don't overlap as much
     #Upper and lower limits on what a sensible closure duration would be, based on upper and lower limits
     #from the data
     closure_dur = .06 if closure_dur < 0.06 else closure_dur
@@ -76,11 +77,11 @@ def generate_sample_vcv(tokens, label, frequency_stdevs, closure_dur_stdev, clos
     for formant in new_v1.measurement_dict:
         steady_stdv = frequency_stdevs[vowel_quality][formant]["steady"]
         new_v1.measurement_dict[formant]["steady"] = sample_token.vowel1.measurement_dict[formant]["steady"]
-        new_v1.measurement_dict[formant]["steady"] += random.gauss(0, steady_stdv)
+        new_v1.measurement_dict[formant]["steady"] += rng.gauss(0, steady_stdv)
 
         transit_stdv = frequency_stdevs[vowel_quality][formant]["transit"]
         new_v1.measurement_dict[formant]["transit"] = sample_token.vowel1.measurement_dict[formant]["transit"]
-        new_v1.measurement_dict[formant]["transit"] += random.gauss(0, transit_stdv)
+        new_v1.measurement_dict[formant]["transit"] += rng.gauss(0, transit_stdv)
         if formant == 1 and new_v1.measurement_dict[formant]["transit"] < 90:
             print(vowel_quality, sample_token.vowel1.measurement_dict[formant]["transit"], transit_stdv)
 
@@ -109,6 +110,35 @@ def generate_stop_metadata_file(out_file_name, tokens):
             writer.writerow({"FileID":file_id+".wav", "Category": values.stop.label})
 
 
+#token_label: fileID for the token
+#data: Vcv object
+#Returns the token's row of Klatt synthesis parameters (as a dictionary), as written by generate_klatt_parameter_file
+#and read by klatt_synth.py
+def klatt_parameter_row(token_label, data):
+    return {"Name" : token_label,
+            "VowelDur": constant_synth_params["VowelDur"],
+            "ClosureDur" : data.stop.closure_dur,
+            "F1offset": data.vowel1.measurement_dict[1]["transit"],
+            "F1steady": data.vowel1.measurement_dict[1]["steady"],
+            "F2offset": constant_synth_params["F2offset"],
+            "F2steady": constant_synth_params["F2steady"],
+            "F3offset": constant_synth_params["F3offset"],
+            "F3steady": constant_synth_params["F3steady"],
+            "F4offset": constant_synth_params["F4offset"],
+            "F4steady": constant_synth_params["F4steady"],
+            "F5offset": constant_synth_params["F5offset"],
+            "F5steady": constant_synth_params["F5steady"],
+            "f0offset": data.vowel1.measurement_dict[0]["transit"],
+            "f0steady": data.vowel1.measurement_dict[0]["steady"],
+            "f0TransitionDur": constant_synth_params["f0TransitionDur"],
+            "F1TransitionDur": constant_synth_params["F1TransitionDur"],
+            "OtherFsTransitionDur":constant_synth_params["OtherFsTransitionDur"],
+            "F1Closure": constant_synth_params["F1Closure"],
+            "f0Closure": constant_synth_params["f0Closure"],
+            "ClosureVoicingDur": data.stop.voicing_dur
+           }
+
+
 #tokens: (string, Vcv object) pair
 # where the string is the fileID for the Vcv object
 # Outputs to out_file_name the fileIDs and stop labels of each token in tokens
@@ -122,31 +152,7 @@ def generate_klatt_parameter_file(out_file_name, tokens):
         col_writer.writerow(fieldnames)
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         for token in tokens:
-            token_label = token[0]
-            data = token[1]
-            row = {"Name" : token_label,
-                    "VowelDur": constant_synth_params["VowelDur"],
-                    "ClosureDur" : data.stop.closure_dur,
-                    "F1offset": data.vowel1.measurement_dict[1]["transit"],
-                    "F1steady": data.vowel1.measurement_dict[1]["steady"],
-                    "F2offset": constant_synth_params["F2offset"],
-                    "F2steady": constant_synth_params["F2steady"],
-                    "F3offset": constant_synth_params["F3offset"],
-                    "F3steady": constant_synth_params["F3steady"],
-                    "F4offset": constant_synth_params["F4offset"],
-                    "F4steady": constant_synth_params["F4steady"],
-                    "F5offset": constant_synth_params["F5offset"],
-                    "F5steady": constant_synth_params["F5steady"],
-                    "f0offset": data.vowel1.measurement_dict[0]["transit"],
-                    "f0steady": data.vowel1.measurement_dict[0]["steady"],
-                    "f0TransitionDur": constant_synth_params["f0TransitionDur"],
-                    "F1TransitionDur": constant_synth_params["F1TransitionDur"],
-                    "OtherFsTransitionDur":constant_synth_params["OtherFsTransitionDur"],
-                    "F1Closure": constant_synth_params["F1Closure"],
-                    "f0Closure": constant_synth_params["f0Closure"],
-                    "ClosureVoicingDur": data.stop.voicing_dur
-                   }
-            writer.writerow(row)
+            writer.writerow(klatt_parameter_row(token[0], token[1]))
 
 #tokens: list of Vcv object
 #Returns:
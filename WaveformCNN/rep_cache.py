@@ -0,0 +1,194 @@
+# On-disk cache of model representations of the discrimination task stimuli
+# Each entry is one model's activations at one layer for one experiment's stimuli, saved as a .npy file (read back
+# memory-mapped, so only the parts used are paged in) with a small JSON of the stimuli's categories, keyed by:
+#   - a checksum of the SavedModel's weights (its variables/ files), so a retrained seed gets new entries
+#   - the layer name
+#   - a hash of the contents of the experiment's stimulus files and metadata csv
+#   - the representation: "full" for the activations as they are, or a compact_reps.representation_key for compact
+#     representations, which are cached instead of the full ones when a compact mode is used
+# Re-running discrimination_task.py with the same representation mode (or any compact mode, once the full
+# representations are cached) then reads everything from the cache, without loading Tensorflow, decoding the stimuli
+# or loading the model.
+# index.json records each entry's size and when it was last used; whenever the cache grows past its size cap, the
+# least recently used entries are deleted. Lookups only update the index in memory; call flush (e.g. after each
+# model) to write it. The cache is meant to be used by one process at a time.
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+default_max_gb = 20
+
+
+#Adds the names and contents of the files named in file_names (under directory) to data_hash, a file at a time
+def _hash_files(data_hash, directory, file_names):
+    for file_name in file_names:
+        data_hash.update(file_name.encode("utf-8"))
+        with open(os.path.join(directory, file_name), "rb") as data_file:
+            for chunk in iter(lambda: data_file.read(1 << 20), b""):
+                data_hash.update(chunk)
+
+
+#Returns a checksum of the weights of the model saved (with model.save) at model_save_name
+def saved_model_checksum(model_save_name):
+    variables_dir = os.path.join(model_save_name, "variables")
+    data_hash = hashlib.sha1()
+    _hash_files(data_hash, variables_dir, sorted(os.listdir(variables_dir)))
+    return data_hash.hexdigest()
+
+
+#Returns a hash of the contents of the stimulus files in stimuli_directory and of the stimuli_metadata_csv file
+def stimuli_hash(stimuli_directory, stimuli_metadata_csv):
+    data_hash = hashlib.sha1()
+    _hash_files(data_hash, stimuli_directory, sorted(os.listdir(stimuli_directory)))
+    _hash_files(data_hash, os.path.dirname(stimuli_metadata_csv) or ".", [os.path.basename(stimuli_metadata_csv)])
+    return data_hash.hexdigest()
+
+
+class RepresentationCache():
+    #directory: directory the cache is kept in (created if needed)
+    #max_bytes: size cap of the cached representations; least recently used entries are deleted to stay under it
+    #index: dictionary with "entries" (key => dictionary of the entry's "model", "layer", "stimuli",
+    #       "representation", "bytes" and "last_used" time), "checksums" (weights checksums already computed, by model path) and "models"
+    #       (dictionary of information about each model checksum, e.g. its probe layer names)
+    def __init__(self, directory, max_bytes=default_max_gb * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index = {"entries": {}, "checksums": {}, "models": {}}
+        self.index_changed = False
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                self.index.update(json.load(index_file))
+        #Entries whose files have gone (e.g. deleted by hand) are forgotten
+        self.index["entries"] = {key: entry for key, entry in self.index["entries"].items()
+                                 if os.path.exists(self._reps_path(key))}
+
+    def _reps_path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def _info_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    #Writes the index, replacing the old one only once the new one is completely written
+    def _write_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path + ".tmp", "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(index_path + ".tmp", index_path)
+        self.index_changed = False
+
+    #Writes the index if it has changed since it was last written (e.g. entries were looked up)
+    def flush(self):
+        if self.index_changed:
+            self._write_index()
+
+    #Returns the key of the entry for model_checksum, layer_name, stimuli_hash and representation
+    @staticmethod
+    def entry_key(model_checksum, layer_name, stimuli_hash, representation="full"):
+        fields = [model_checksum, layer_name, stimuli_hash]
+        if representation != "full":
+            #Left out for full representations, so caches from before compact ones were cached stay valid
+            fields.append(representation)
+        return hashlib.sha1("\n".join(fields).encode("utf-8")).hexdigest()
+
+    #Returns saved_model_checksum(model_save_name), only reading the weights again if their files changed since
+    #the last time
+    def model_checksum(self, model_save_name):
+        variables_dir = os.path.join(model_save_name, "variables")
+        stamp = [[file_name, os.path.getsize(os.path.join(variables_dir, file_name)),
+                  os.path.getmtime(os.path.join(variables_dir, file_name))]
+                 for file_name in sorted(os.listdir(variables_dir))]
+        path = os.path.abspath(model_save_name)
+        known = self.index["checksums"].get(path)
+        if known is None or known["stamp"] != stamp:
+            known = {"stamp": stamp, "checksum": saved_model_checksum(model_save_name)}
+            self.index["checksums"][path] = known
+            self.index_changed = True
+        return known["checksum"]
+
+    #Returns the dictionary of information recorded about the model with model_checksum ({} if none)
+    def model_info(self, model_checksum):
+        return self.index["models"].get(model_checksum, {})
+
+    #Records information (keyword arguments, JSON-serializable) about the model with model_checksum
+    def set_model_info(self, model_checksum, **info):
+        self.index["models"].setdefault(model_checksum, {}).update(info)
+        self.index_changed = True
+
+    #Returns (reps, info) for the entry of model_checksum, layer_name, stimuli_hash and representation, or None if it
+    #isn't cached
+    #reps: read-only [n, ...] numpy array memory-mapped from the cache
+    #info: the dictionary it was added with
+    def get(self, model_checksum, layer_name, stimuli_hash, representation="full"):
+        key = self.entry_key(model_checksum, layer_name, stimuli_hash, representation)
+        if key not in self.index["entries"]:
+            return None
+        reps = np.load(self._reps_path(key), mmap_mode="r")
+        with open(self._info_path(key)) as info_file:
+            info = json.load(info_file)
+        self.index["entries"][key]["last_used"] = time.time()
+        self.index_changed = True
+        return reps, info
+
+    #Adds reps ([n, ...] numpy array) with info (JSON-serializable dictionary, e.g. the stimuli's categories) as the
+    #entry of model_checksum, layer_name, stimuli_hash and representation, then evicts least recently used entries if the cache is
+    #over its size cap; the index is written straight away, so it never misses files that are in the cache
+    #Returns (reps, info) as get would
+    def put(self, model_checksum, layer_name, stimuli_hash, reps, info, representation="full"):
+        key = self.entry_key(model_checksum, layer_name, stimuli_hash, representation)
+        #Write to temporary names first, so an interrupted write never leaves a partial entry
+        with open(self._info_path(key) + ".tmp", "w") as info_file:
+            json.dump(info, info_file)
+        with open(self._reps_path(key) + ".tmp", "wb") as reps_file:
+            np.save(reps_file, np.ascontiguousarray(reps))
+        os.replace(self._info_path(key) + ".tmp", self._info_path(key))
+        os.replace(self._reps_path(key) + ".tmp", self._reps_path(key))
+        self.index["entries"][key] = {"model": model_checksum, "layer": layer_name, "stimuli": stimuli_hash,
+                                      "representation": representation,
+                                      "bytes": os.path.getsize(self._reps_path(key)), "last_used": time.time()}
+        self.evict(keep=key)
+        self._write_index()
+        return np.load(self._reps_path(key), mmap_mode="r"), info
+
+    #Returns the total size of the cached representations in bytes
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self.index["entries"].values())
+
+    #Deletes least recently used entries until the cache is no bigger than max_bytes (or the max_bytes argument)
+    #keep: key of an entry never to delete (e.g. the one just added)
+    #Returns the number of entries deleted
+    def evict(self, max_bytes=None, keep=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_bytes()
+        deleted = 0
+        for key in sorted(self.index["entries"], key=lambda key: self.index["entries"][key]["last_used"]):
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.index["entries"].pop(key)["bytes"]
+            for path in (self._reps_path(key), self._info_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            deleted += 1
+        if deleted:
+            self._write_index()
+        return deleted
+
+
+#Program to show how much a cache holds and, optionally, shrink it to a new size cap, e.g.
+#python rep_cache.py rep_cache/ 5
+#Command line arguments: 1st: cache directory
+# Second (optional): size cap in GB to evict least recently used entries down to
+if __name__ == "__main__":
+    cache = RepresentationCache(sys.argv[1])
+    if len(sys.argv) > 2:
+        print("Deleted", cache.evict(float(sys.argv[2]) * 1024 ** 3), "entries")
+    print(len(cache.index["entries"]), "entries,", round(cache.total_bytes() / 1024 ** 3, 3), "GB, for",
+          len(set(entry["model"] for entry in cache.index["entries"].values())), "models")
@@ -0,0 +1,140 @@
+# Columnar store for discrimination task results: a Parquet dataset partitioned by experiment and seed
+# (<store dir>/Experiment=<name>/Seed=<N>/part-0.parquet), with typed columns (Distance is float64, Diagonal? int8,
+# numeric cue values int64) instead of one wide text csv per seed.
+# Each seed's results are added as new partition files without touching the others; probing a seed again replaces
+# only its own files. query reads back only the experiments, seeds and columns asked for, and export_csv writes
+# the same csv layout as discrimination_task.csv_write_output for the R analysis.
+# Needs pyarrow (and pandas for query/export_csv).
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+partition_schema = pa.schema([("Experiment", pa.string()), ("Seed", pa.int64())])
+_part_file_name = "part-0.parquet"
+
+
+#Returns the pyarrow type for a column of rows from discrimination_task.task_rows
+#name: column name
+#values: the column's values (None where a row doesn't have the column)
+def column_type(name, values):
+    if name == "Distance":
+        return pa.float64()
+    if name == "Diagonal?":
+        return pa.int8()
+    if name.startswith("stim1_") or name.startswith("stim2_"):
+        present = [str(value) for value in values if value is not None and value != ""]
+        if present and all(value.lstrip("-").isdigit() for value in present):
+            return pa.int64()
+    return pa.string()
+
+
+#Returns a pyarrow Table of rows (dictionaries from discrimination_task.task_rows), without the partition columns
+def rows_to_table(rows):
+    names = []
+    for row in rows:
+        for name in row:
+            if name not in names and name not in partition_schema.names:
+                names.append(name)
+    columns = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        value_type = column_type(name, values)
+        if value_type == pa.int64():
+            values = [None if value is None or value == "" else int(value) for value in values]
+        elif value_type == pa.string():
+            values = [None if value is None else str(value) for value in values]
+        columns[name] = pa.array(values, type=value_type)
+    return pa.table(columns)
+
+
+#Adds one seed's results to the store in store_dir, replacing any earlier results for that seed and experiment
+#rows: list of row dictionaries from discrimination_task.task_rows, from any number of experiments
+#seed: the model's random seed
+def append_rows(store_dir, rows, seed):
+    rows_by_experiment = {}
+    for row in rows:
+        rows_by_experiment.setdefault(row["Experiment"], []).append(row)
+    for experiment, experiment_rows in rows_by_experiment.items():
+        partition_dir = os.path.join(store_dir, "Experiment=" + experiment, "Seed=" + str(seed))
+        os.makedirs(partition_dir, exist_ok=True)
+        #Write to a temporary name first, so a reader never sees a half-written file
+        temp_path = os.path.join(partition_dir, "." + _part_file_name + ".tmp")
+        pq.write_table(rows_to_table(experiment_rows), temp_path)
+        os.replace(temp_path, os.path.join(partition_dir, _part_file_name))
+
+
+#Returns the (experiment, seed) pairs stored in store_dir
+def stored_partitions(store_dir):
+    partitions = []
+    if not os.path.isdir(store_dir):
+        return partitions
+    for experiment_dir in sorted(os.listdir(store_dir)):
+        if not experiment_dir.startswith("Experiment="):
+            continue
+        for seed_dir in sorted(os.listdir(os.path.join(store_dir, experiment_dir))):
+            if seed_dir.startswith("Seed=") and \
+                    os.path.exists(os.path.join(store_dir, experiment_dir, seed_dir, _part_file_name)):
+                partitions.append((experiment_dir[len("Experiment="):], int(seed_dir[len("Seed="):])))
+    return partitions
+
+
+#Returns a pyarrow Table of the stored results for the given experiments and seeds (all of them if None),
+#reading only the partitions and columns needed
+#columns: list of column names to load (all if None); "Experiment" and "Seed" are the partition columns
+def query_table(store_dir, experiments=None, seeds=None, columns=None):
+    partitioning = ds.partitioning(partition_schema, flavor="hive")
+    row_filter = None
+    if experiments is not None:
+        row_filter = ds.field("Experiment").isin(list(experiments))
+    if seeds is not None:
+        seed_filter = ds.field("Seed").isin([int(seed) for seed in seeds])
+        row_filter = seed_filter if row_filter is None else row_filter & seed_filter
+    dataset = ds.dataset(store_dir, format="parquet", partitioning=partitioning)
+    #Experiments have different cue columns, so the dataset's schema is the union of the files' schemas rather than
+    #just the first file's
+    fragments = list(dataset.get_fragments(filter=row_filter))
+    if not fragments:
+        return pa.table({name: pa.array([], type=partition_schema.field(name).type)
+                         for name in (columns or partition_schema.names) if name in partition_schema.names})
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [partition_schema])
+    dataset = ds.dataset([fragment.path for fragment in fragments], schema=schema, format="parquet",
+                         partitioning=partitioning, partition_base_dir=store_dir)
+    if columns is not None:
+        columns = [name for name in columns if name in schema.names]
+    return dataset.to_table(columns=columns, filter=row_filter)
+
+
+#Same as query_table, but returns a pandas DataFrame
+def query(store_dir, experiments=None, seeds=None, columns=None):
+    return query_table(store_dir, experiments, seeds, columns).to_pandas()
+
+
+#Writes the stored results for the given experiments and seeds (all if None) to the csv file output_fn in the same
+#layout as discrimination_task.csv_write_output: Experiment, Distance, Diagonal?, Trial, Layer and Representation (if
+#stored), then the stim1_ and stim2_ cue columns, blank where an experiment doesn't have the cue
+def export_csv(store_dir, output_fn, experiments=None, seeds=None):
+    table = query_table(store_dir, experiments, seeds)
+    fields = [name for name in ["Experiment", "Distance", "Diagonal?", "Trial", "Layer", "Representation"]
+              if name in table.column_names]
+    fields += sorted(name for name in table.column_names if name.startswith("stim1_"))
+    fields += sorted(name for name in table.column_names if name.startswith("stim2_"))
+    #Integer columns with blanks stay integers (not 0.0) in the csv
+    frame = table.select(fields).to_pandas(integer_object_nulls=True)
+    frame.to_csv(output_fn, index=False)
+    return len(frame)
+
+
+#Program to export results from a store to one csv file for the R analysis, e.g.
+#python results_store.py discrim_results/store/ discrim_results/all_seeds.csv [first seed] [last seed]
+#Command line arguments: 1st: store directory
+# Second: output csv file
+# Third and fourth (optional): range of seeds to export (default all)
+if __name__ == "__main__":
+    store_dir = sys.argv[1]
+    output_fn = sys.argv[2]
+    seeds = range(int(sys.argv[3]), int(sys.argv[4]) + 1) if len(sys.argv) > 4 else None
+    print("Wrote", export_csv(store_dir, output_fn, seeds=seeds), "rows to", output_fn)
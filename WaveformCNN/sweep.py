@@ -0,0 +1,184 @@
+# Resume-aware sweep over a range of seeds: trains every seed (with train_many_seeds.py's scheduling across the cores)
+# and probes it with the discrimination task, keeping a manifest (JSON) of each seed's dataset hash, configuration
+# hashes, status and timings. The manifest is rewritten as each seed finishes a step, so re-running the same sweep
+# (e.g. after its SLURM job was preempted) only does the work that's left:
+#   - seeds whose model and discrimination results exist for the same data and configuration are skipped
+#   - seeds that were trained but not probed (or whose probing configuration changed) are only probed
+#   - seeds interrupted partway through training continue from their last checkpoint (see checkpointing.py), unless
+#     their training worker failed, in which case they're trained again from scratch
+#   - seeds trained on different data or with a different training configuration are trained again from scratch
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import train_many_seeds
+
+
+#Returns a hash of the training data: the names and contents of the files in wavfile_directory and the contents of
+#label_csv_file
+def dataset_hash(wavfile_directory, label_csv_file):
+    data_hash = hashlib.sha1()
+    for file_name in sorted(os.listdir(wavfile_directory)):
+        data_hash.update(file_name.encode("utf-8"))
+        with open(os.path.join(wavfile_directory, file_name), "rb") as wav_file:
+            data_hash.update(hashlib.sha1(wav_file.read()).digest())
+    with open(label_csv_file, "rb") as csv_file:
+        data_hash.update(csv_file.read())
+    return data_hash.hexdigest()
+
+
+#Returns a hash of a configuration dictionary
+def config_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+#Returns the manifest saved at manifest_path as a dictionary of seed (string) => entry dictionary, or {} if there
+#isn't one yet
+def read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+#Writes the manifest to manifest_path, replacing the old one only once the new one is completely written
+def write_manifest(manifest_path, manifest):
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+#Returns what a seed still needs: "train" (then probe), "probe" or nothing ("done")
+#entry: the seed's manifest entry, or None
+#data_hash, train_config_hash, probe_config_hash: hashes of the current sweep
+def seed_needs(entry, model_save_name, results_file_name, data_hash, train_config_hash, probe_config_hash):
+    if entry is None or entry["dataset_hash"] != data_hash or entry["train_config_hash"] != train_config_hash:
+        return "train"
+    if entry["status"] not in ("trained", "done") or not os.path.isdir(model_save_name):
+        return "train"
+    if entry["status"] != "done" or entry["probe_config_hash"] != probe_config_hash or \
+            not os.path.exists(results_file_name):
+        return "probe"
+    return "done"
+
+
+#Trains and probes every seed in seeds that isn't already done, recording progress in the manifest at manifest_path
+#seeds: list of int random seeds
+#wavfile_directory, label_csv_file, num_workers, cache_dir: as for train_many_seeds.train_many_seeds
+#model_save_prefix: seed N's model is saved at model_save_prefix + N
+#results_file_name_prefix: seed N's discrimination results are written as for discrimination_task.results_file_name
+#epochs: maximum number of epochs per seed (train_cnn.num_epochs if None)
+#layer_name, experiments: the layer probed and the experiments (see discrimination_task.experiment_names) probed
+#rep_mode: compact_reps.py representation mode the distances are computed with (see discrimination_task.probe_seeds)
+#aggregate_path: if not None, each seed's results are added to the distance_aggregator.DistanceAggregator saved in
+#this file as soon as the seed is probed (seeds already in it aren't added again, so use a new file if the probing
+#configuration changes)
+#Returns the manifest
+def run_sweep(seeds, wavfile_directory, label_csv_file, num_workers, cache_dir, manifest_path,
+              model_save_prefix="saved_models/saved_models/run_seed_", results_file_name_prefix="discrim_results/run_seed_",
+              epochs=None, layer_name="hidden_rep", experiments=None, aggregate_path=None, rep_mode="full"):
+    import checkpointing
+    import discrimination_task
+    import train_cnn
+    if epochs is None:
+        epochs = train_cnn.num_epochs
+    if experiments is None:
+        experiments = discrimination_task.experiment_names
+
+    data_hash = dataset_hash(wavfile_directory, label_csv_file)
+    train_config_hash = config_hash(train_cnn.training_config(epochs))
+    probe_config = {"layer_name": layer_name, "experiments": list(experiments)}
+    if rep_mode != "full":
+        #Left out for full representations, so manifests from before the modes were added stay valid
+        probe_config["rep_mode"] = rep_mode
+    probe_config_hash = config_hash(probe_config)
+    manifest = read_manifest(manifest_path)
+
+    def update(run_seed, **fields):
+        entry = manifest.setdefault(str(run_seed), {"seed": run_seed})
+        entry.update(fields)
+        entry["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        write_manifest(manifest_path, manifest)
+
+    to_train = []
+    to_probe = []
+    for run_seed in seeds:
+        model_save_name = model_save_prefix + str(run_seed)
+        seed_results_file_name = discrimination_task.results_file_name(results_file_name_prefix, run_seed)
+        entry = manifest.get(str(run_seed))
+        needs = seed_needs(entry, model_save_name, seed_results_file_name, data_hash, train_config_hash,
+                           probe_config_hash)
+        if needs == "train":
+            if entry is None or entry["dataset_hash"] != data_hash or entry["train_config_hash"] != train_config_hash:
+                #Checkpoints from other data or another configuration mustn't be resumed from
+                shutil.rmtree(checkpointing.checkpoint_dir(model_save_name), ignore_errors=True)
+            update(run_seed, dataset_hash=data_hash, train_config_hash=train_config_hash,
+                   probe_config_hash=probe_config_hash, status="training", model_save_name=model_save_name,
+                   results_file_name=seed_results_file_name)
+            to_train.append(run_seed)
+        elif needs == "probe":
+            to_probe.append(run_seed)
+    print(len(seeds) - len(to_train) - len(to_probe), "seeds already done;", len(to_train), "to train;",
+          len(to_probe), "to probe only")
+
+    if to_train:
+        def on_trained(result):
+            update(result["seed"], status="trained", train_time=result["wall_time"], epochs_trained=result["epochs"])
+        results, failed_seeds, total_wall_time = train_many_seeds.train_many_seeds(
+            to_train, model_save_prefix, wavfile_directory, label_csv_file, num_workers, cache_dir, epochs=epochs,
+            on_result=on_trained)
+        for run_seed in failed_seeds:
+            #Its checkpoint may be what made it fail, so the next sweep trains it again from scratch
+            shutil.rmtree(checkpointing.checkpoint_dir(model_save_prefix + str(run_seed)), ignore_errors=True)
+            update(run_seed, status="failed")
+        to_probe += [result["seed"] for result in results]
+
+    if to_probe:
+        stimuli_directory_names, stimuli_metadata_file_names = discrimination_task.experiment_paths(experiments)
+        tasks = [discrimination_task.load_task(directory_name, stimuli_metadata_file_names[index])
+                 for index, directory_name in enumerate(stimuli_directory_names)]
+
+        def on_probed(run_seed, seed_results_file_name, wall_time):
+            if aggregate_path is not None:
+                import distance_aggregator
+                aggregator = distance_aggregator.DistanceAggregator.load(aggregate_path)
+                if aggregator.add_csv(seed_results_file_name, run_seed):
+                    aggregator.save(aggregate_path)
+            update(run_seed, status="done", probe_config_hash=probe_config_hash, probe_time=wall_time,
+                   results_file_name=seed_results_file_name)
+        discrimination_task.probe_seeds(sorted(to_probe), tasks, model_save_prefix, results_file_name_prefix,
+                                        layer_name, on_seed_done=on_probed, rep_mode=rep_mode)
+    return manifest
+
+
+#Program to train and probe a range of seeds, picking up where an earlier run of the same sweep left off
+#Command line arguments: 1st: first random seed (number)
+# Second: last random seed (number)
+# Third: name of directory containing sound data (end with /)
+# Fourth: name of stop category information csv file
+# Fifth: number of seeds to train at the same time
+# Sixth: directory for the shared decoded audio cache
+# Seventh (optional): manifest file (default sweep_manifest.json)
+# Eighth (optional): distance aggregator state file to add each probed seed to (see distance_aggregator.py)
+#Models are saved to saved_models/saved_models/run_seed_N and results to discrim_results/, as with
+#train_many_seeds.py and discrimination_task.py
+if __name__ == "__main__":
+    seeds = list(range(int(sys.argv[1]), int(sys.argv[2]) + 1))
+    wavfile_directory = sys.argv[3]
+    label_csv_file = sys.argv[4]
+    num_workers = int(sys.argv[5])
+    cache_dir = sys.argv[6]
+    manifest_path = sys.argv[7] if len(sys.argv) > 7 else "sweep_manifest.json"
+    aggregate_path = sys.argv[8] if len(sys.argv) > 8 else None
+
+    manifest = run_sweep(seeds, wavfile_directory, label_csv_file, num_workers, cache_dir, manifest_path,
+                         aggregate_path=aggregate_path)
+    statuses = [manifest.get(str(run_seed), {}).get("status", "missing") for run_seed in seeds]
+    print({status: statuses.count(status) for status in sorted(set(statuses))})
+    failed = [run_seed for run_seed, status in zip(seeds, statuses) if status != "done"]
+    if failed:
+        print("Seeds not done:", failed)
@@ -0,0 +1,155 @@
+# On-the-fly synthetic training data: instead of training on a fixed corpus of wav files synthesized ahead of time,
+# every batch is a fresh set of VCV tokens sampled from the LAFF measurement distributions
+# (laff_vcv/sample_params.py) and synthesized with laff_vcv/klatt_synth.py, straight into the training tensors.
+# The batches are synthesized in worker processes while the CNN trains and nothing is written to disk.
+# Batch number `step` of epoch `epoch` for a run seed is always the same tokens, however many workers there are.
+import atexit
+import collections
+import multiprocessing
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "laff_vcv"))
+import compute_vcv_distributions
+import klatt_synth
+import sample_params
+
+
+#Categories of the synthetic tokens, in one-hot encoding order
+synthetic_categories = ["voiced", "voiceless"]
+
+
+#Measures the LAFF tokens (see compute_vcv_distributions.get_vcv_data) and works out the noise to add to samples
+#path: directory of LAFF tokens
+#cache_dir: measurement cache directory
+#Returns a dictionary of category : (list of Vcv tokens, noise arguments for sample_params.generate_sample_vcv)
+def load_distributions(path="../laff_vcv_tokens_with_stops", cache_dir="laff_vcv/vcv_measurement_cache"):
+    voiced_dist, voiceless_dist = compute_vcv_distributions.get_vcv_data(path, cache_dir=cache_dir)
+    return {"voiced": (voiced_dist, sample_params.compute_noise_boundaries(voiced_dist)),
+            "voiceless": (voiceless_dist, sample_params.compute_noise_boundaries(voiceless_dist))}
+
+
+#distributions: from load_distributions
+#rng: random.Random instance
+#num_tokens: number of tokens to sample
+#Returns a list of Klatt parameter rows (see sample_params.klatt_parameter_row) and a parallel numpy array of
+#category indices into synthetic_categories; each token's category is picked with equal probability
+def sample_rows(distributions, rng, num_tokens):
+    rows = []
+    category_indices = []
+    for index in range(num_tokens):
+        category_index = rng.randrange(len(synthetic_categories))
+        tokens, noise = distributions[synthetic_categories[category_index]]
+        original, sample = sample_params.generate_sample_vcv(tokens, synthetic_categories[category_index], *noise,
+                                                             rng=rng)
+        rows.append(sample_params.klatt_parameter_row(str(index), sample))
+        category_indices.append(category_index)
+    return rows, np.array(category_indices)
+
+
+#Returns the random.Random instance for one batch of the stream, seeded from the run seed, epoch and step
+def batch_rng(run_seed, epoch, step):
+    return random.Random(str((run_seed, epoch, step)))
+
+
+_worker_distributions = None
+
+
+#Runs once in each worker process to give it the distributions to sample from
+def init_worker(distributions):
+    global _worker_distributions
+    _worker_distributions = distributions
+
+
+#Samples and synthesizes one batch; runs in a worker process
+#job: (run_seed, epoch, step, batch_size, fs, slice_len) tuple
+#Returns a [batch_size, slice_len, 1] float32 numpy array of audio and a numpy array of category indices
+def make_batch(job):
+    run_seed, epoch, step, batch_size, fs, slice_len = job
+    rows, category_indices = sample_rows(_worker_distributions, batch_rng(run_seed, epoch, step), batch_size)
+    return klatt_synth.synthesize_array(rows, fs=fs, slice_len=slice_len, batch_size=batch_size), category_indices
+
+
+#Returns a Dataset of steps_per_epoch batches of (audio, one-hot category) pairs, like data_processing.get_data's,
+#where every batch is freshly sampled and synthesized. Each pass over the Dataset (each Keras epoch) is a new epoch
+#of the stream, with different tokens.
+#run_seed: int seed for the stream
+#steps_per_epoch: number of batches in each pass
+#num_workers: number of synthesis worker processes, 0 to synthesize in this process
+#distributions: from load_distributions (loaded here if None)
+#fs, slice_len: sampling rate and length in samples of the audio, as for id_loader
+#Also returns the category : encoding and encoding : category dictionaries (see data_processing.category_encoder),
+#and the worker pool (None if num_workers is 0), which the caller should terminate once done with the Dataset
+def synthetic_dataset(run_seed, steps_per_epoch, batch_size=64, num_workers=1, distributions=None, fs=16000,
+                      slice_len=8192):
+    #Imported here so the worker processes, which import this module, never load Tensorflow
+    import tensorflow as tf
+    import data_processing as data
+
+    if distributions is None:
+        distributions = load_distributions()
+    category_to_encoding, encoding_to_category = data.category_encoder(synthetic_categories)
+    one_hot = np.array([category_to_encoding[category] for category in synthetic_categories], dtype=np.float32)
+
+    pool = None
+    if num_workers > 0:
+        pool = multiprocessing.get_context("spawn").Pool(num_workers, initializer=init_worker,
+                                                         initargs=(distributions,))
+        #In case the caller never terminates it, so the workers never outlive this process
+        atexit.register(pool.terminate)
+    epoch = [0]
+
+    def generate():
+        jobs = [(run_seed, epoch[0], step, batch_size, fs, slice_len) for step in range(steps_per_epoch)]
+        epoch[0] += 1
+        if pool is None:
+            init_worker(distributions)
+            for job in jobs:
+                audio, category_indices = make_batch(job)
+                yield audio, one_hot[category_indices]
+            return
+        #Keep only a couple of batches per worker in flight, so memory stays constant however long the epoch is
+        in_flight = collections.deque()
+        for job in jobs:
+            in_flight.append(pool.apply_async(make_batch, (job,)))
+            if len(in_flight) >= 2 * num_workers:
+                audio, category_indices = in_flight.popleft().get()
+                yield audio, one_hot[category_indices]
+        while in_flight:
+            audio, category_indices = in_flight.popleft().get()
+            yield audio, one_hot[category_indices]
+
+    dataset = tf.data.Dataset.from_generator(generate, output_signature=(
+        tf.TensorSpec(shape=(None, slice_len, 1), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, len(synthetic_categories)), dtype=tf.float32)))
+    return dataset.prefetch(1), category_to_encoding, encoding_to_category, pool
+
+
+#Program to train and save a CNN voiced vs voiceless stop categorizer on an on-the-fly synthetic stream
+#Command line arguments: 1st: random seed (number)
+# Second: name to save model to under saved_models (string)
+# Third: number of batches per epoch
+# Fourth (optional): number of synthesis worker processes (default 1)
+if __name__ == "__main__":
+    import tensorflow as tf
+    import train_cnn
+
+    run_seed = int(sys.argv[1])
+    model_save_path = "saved_models/" + sys.argv[2]
+    steps_per_epoch = int(sys.argv[3])
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+
+    np.random.seed(run_seed)
+    tf.random.set_seed(run_seed)
+    training_data, category_encoding_map, encoding_category_map, pool = synthetic_dataset(
+        run_seed, steps_per_epoch, num_workers=num_workers)
+    print("Categories are ", category_encoding_map.keys())
+    try:
+        train_cnn.fit_cnn(training_data, len(category_encoding_map.keys()), model_save_path)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
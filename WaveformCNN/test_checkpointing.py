@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import checkpointing
+
+
+def make_model():
+    model = tf.keras.Sequential([tf.keras.layers.Dense(2)])
+    model.compile(optimizer=tf.keras.optimizers.Adam(0.1), loss="mse")
+    checkpointing.build_for_checkpointing(model, (None, 3))
+    return model
+
+
+def make_data():
+    rng = np.random.default_rng(0)
+    return tf.data.Dataset.from_tensor_slices((rng.standard_normal((16, 3)), rng.standard_normal((16, 2)))).batch(4)
+
+
+#Keras callback that interrupts training at the start of epoch number stop_epoch (counting from 0)
+class Interrupt(tf.keras.callbacks.Callback):
+    def __init__(self, stop_epoch):
+        super().__init__()
+        self.stop_epoch = stop_epoch
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if epoch == self.stop_epoch:
+            raise KeyboardInterrupt
+
+
+def restore(directory):
+    model = make_model()
+    callback = checkpointing.AsyncCheckpointCallback(model, directory)
+    return model, callback, callback.restore_latest()
+
+
+def test_no_checkpoint(tmp_path):
+    directory = checkpointing.checkpoint_dir(str(tmp_path / "model"))
+    assert directory == str(tmp_path / "model_checkpoints")
+    assert not checkpointing.has_checkpoint(directory)
+    model, callback, epochs_done = restore(directory)
+    assert epochs_done == 0
+    assert not callback.training_finished()
+
+
+def test_finished_training_is_marked(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    model = make_model()
+    callback = checkpointing.AsyncCheckpointCallback(model, directory, save_every_epochs=2, keep_last=2)
+    model.fit(make_data(), epochs=5, callbacks=[callback], verbose=0)
+    assert checkpointing.has_checkpoint(directory)
+    #Saved after epochs 2 and 4, then once more at the end of training; only the last 2 are kept
+    assert sorted(name for name in os.listdir(directory) if name.endswith(".index")) == \
+           ["ckpt-4.index", "ckpt-5.index"]
+
+    restored_model, restored_callback, epochs_done = restore(directory)
+    assert epochs_done == 5
+    assert restored_callback.training_finished()
+    for weights, restored_weights in zip(model.get_weights(), restored_model.get_weights()):
+        assert np.array_equal(weights, restored_weights)
+    assert restored_model.optimizer.iterations.numpy() == model.optimizer.iterations.numpy()
+
+
+def test_early_stopping_is_marked_finished(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    model = make_model()
+    callback = checkpointing.AsyncCheckpointCallback(model, directory, save_every_epochs=10)
+    stop = tf.keras.callbacks.EarlyStopping(monitor="loss", min_delta=1e9, patience=1)
+    model.fit(make_data(), epochs=20, callbacks=[stop, callback], verbose=0)
+    model, callback, epochs_done = restore(directory)
+    assert epochs_done == 2
+    assert callback.training_finished()
+
+
+def test_interrupted_training_resumes(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    model = make_model()
+    callback = checkpointing.AsyncCheckpointCallback(model, directory)
+    try:
+        model.fit(make_data(), epochs=5, callbacks=[callback, Interrupt(3)], verbose=0)
+    except KeyboardInterrupt:
+        pass
+    callback.checkpoint.sync()
+
+    model, callback, epochs_done = restore(directory)
+    assert epochs_done == 3
+    assert not callback.training_finished()
+    history = model.fit(make_data(), epochs=5, initial_epoch=epochs_done, callbacks=[callback], verbose=0)
+    assert history.epoch == [3, 4]
+    model, callback, epochs_done = restore(directory)
+    assert epochs_done == 5
+    assert callback.training_finished()
+
+
+def test_remove(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    model = make_model()
+    callback = checkpointing.AsyncCheckpointCallback(model, directory)
+    model.fit(make_data(), epochs=1, callbacks=[callback], verbose=0)
+    callback.remove()
+    assert not os.path.exists(directory)
+    assert not checkpointing.has_checkpoint(directory)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import compact_reps
+
+
+@pytest.mark.parametrize("mode, expected", [("full", ("full", None)), ("avg_pool", ("avg_pool", None)),
+                                            ("max_pool", ("max_pool", None)),
+                                            ("random_projection", ("random_projection", 256)),
+                                            ("random_projection:64", ("random_projection", 64)),
+                                            ("pca", ("pca", 32)), ("pca:3", ("pca", 3))])
+def test_parse_mode(mode, expected):
+    assert compact_reps.parse_mode(mode) == expected
+
+
+@pytest.mark.parametrize("mode", ["", "mean_pool", "avg_pool:4", "full:1", "pca:0", "pca:-2", "pca:x"])
+def test_parse_mode_rejects(mode):
+    with pytest.raises(ValueError):
+        compact_reps.parse_mode(mode)
+
+
+def test_pooling_over_time():
+    #[n, timesteps * channels] flattened the way the layer's output is: channels vary fastest
+    reps = np.arange(2 * 3 * 4, dtype=np.float32).reshape(2, 3 * 4)
+    timed = reps.reshape(2, 3, 4)
+    assert np.array_equal(compact_reps.CompactRepresentation("avg_pool", (3, 4)).transform(reps), timed.mean(axis=1))
+    assert np.array_equal(compact_reps.CompactRepresentation("max_pool", (3, 4)).transform(reps), timed.max(axis=1))
+    assert compact_reps.CompactRepresentation("avg_pool").transform(reps).shape == (2, 12)
+
+
+def test_random_projection_is_the_same_for_every_batch():
+    reps = np.random.default_rng(0).standard_normal((10, 50)).astype(np.float32)
+    compactor = compact_reps.CompactRepresentation("random_projection:8")
+    whole = compactor.transform(reps)
+    assert whole.shape == (10, 8)
+    assert np.allclose(np.concatenate([compactor.transform(reps[:4]), compactor.transform(reps[4:])]), whole)
+    assert np.allclose(compact_reps.CompactRepresentation("random_projection:8").transform(reps), whole)
+
+
+def test_pca():
+    rng = np.random.default_rng(0)
+    basis = rng.standard_normal((3, 30))
+    reps_list = [rng.standard_normal((20, 3)) @ basis + 1 for _ in range(2)]
+    compactor = compact_reps.CompactRepresentation("pca:3")
+    assert compactor.needs_fit()
+    with pytest.raises(ValueError):
+        compactor.transform(reps_list[0])
+    compactor.fit(reps_list)
+    reduced = compactor.transform(reps_list[0])
+    assert reduced.shape == (20, 3)
+    #The data only has 3 dimensions, so the 3 principal components keep the distances between stimuli
+    centred = reps_list[0] - compactor.mean
+    assert np.allclose(np.linalg.norm(reduced[0] - reduced[1]), np.linalg.norm(centred[0] - centred[1]), rtol=1e-4)
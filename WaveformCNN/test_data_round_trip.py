@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pandas
+import pytest
+import scipy.io.wavfile
+
+import data_processing as data
+import tfrecord_loader
+
+
+SLICE_LEN = 8192
+#Shorter, exactly as long as and longer than the slice, in three categories
+CLIPS = [("a_0.wav", "voiced", 3000), ("a_1.wav", "voiceless", SLICE_LEN), ("a_2.wav", "nasal", 10000),
+         ("b_0.wav", "voiceless", 5000), ("b_1.wav", "nasal", 100), ("b_2.wav", "voiced", 9000),
+         ("c_0.wav", "voiced", SLICE_LEN + 1)]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("corpus")
+    wav_dir = str(directory / "wavs") + "/"
+    os.makedirs(wav_dir)
+    rng = np.random.default_rng(0)
+    for fn, category, nsamps in CLIPS:
+        scipy.io.wavfile.write(wav_dir + fn, 16000, rng.integers(-20000, 20000, nsamps, dtype=np.int16))
+    info_csv = str(directory / "categories.csv")
+    pandas.DataFrame({"FileID": [fn for fn, _, _ in CLIPS],
+                      "Category": [category for _, category, _ in CLIPS]}).to_csv(info_csv, index=False)
+    record_dir = str(directory / "records")
+    tfrecord_loader.export_tfrecords(wav_dir, info_csv, record_dir, num_shards=3)
+    return wav_dir, info_csv, record_dir
+
+
+#Returns the audio and one-hot categories of every example in a Dataset from get_data or get_tfrecord_data, in order
+def unbatch(gold_batches):
+    batches = list(gold_batches.as_numpy_iterator())
+    return np.concatenate([audio for audio, _ in batches]), np.concatenate([labels for _, labels in batches])
+
+
+def test_encodings_agree(corpus):
+    wav_dir, info_csv, record_dir = corpus
+    _, wav_to_encoding, wav_from_encoding = data.get_data(wav_dir, info_csv, shuffle=False)
+    _, record_to_encoding, record_from_encoding = data.get_tfrecord_data(record_dir, shuffle=False)
+    expected_to_encoding, expected_from_encoding = data.category_encoder(["nasal", "voiced", "voiceless"])
+    assert wav_to_encoding == record_to_encoding == expected_to_encoding
+    assert wav_from_encoding == record_from_encoding == expected_from_encoding
+    assert tfrecord_loader.read_categories(record_dir) == ["nasal", "voiced", "voiceless"]
+
+
+def test_round_trip(corpus):
+    wav_dir, info_csv, record_dir = corpus
+    golds = data.get_golds(info_csv)
+
+    #get_data reads the files in os.listdir order
+    wav_gold_batches, category_to_encoding, _ = data.get_data(wav_dir, info_csv, batch_size=3, shuffle=False)
+    wav_audio, wav_labels = unbatch(wav_gold_batches)
+    wav_file_ids = os.listdir(wav_dir)
+
+    #get_tfrecord_data drops the file IDs, so they're read from the same unshuffled shards alongside
+    record_audio, record_labels = unbatch(data.get_tfrecord_data(record_dir, batch_size=3, shuffle=False)[0])
+    record_batches = list(tfrecord_loader.tfrecord_decode_and_batch(record_dir, 3, shuffle=False).as_numpy_iterator())
+    record_file_ids = [fn.decode("utf-8") for file_ids, _, _ in record_batches for fn in file_ids]
+    record_indices = [index for _, _, indices in record_batches for index in indices]
+
+    assert sorted(wav_file_ids) == sorted(record_file_ids) == sorted(fn for fn, _, _ in CLIPS)
+    assert wav_audio.shape == record_audio.shape == (len(CLIPS), SLICE_LEN, 1)
+    assert wav_audio.dtype == record_audio.dtype == np.float32
+    record_order = {fn: i for i, fn in enumerate(record_file_ids)}
+    for wav_index, fn in enumerate(wav_file_ids):
+        record_index = record_order[fn]
+        expected = category_to_encoding[golds[fn]]
+        np.testing.assert_array_equal(wav_labels[wav_index], expected)
+        np.testing.assert_array_equal(record_labels[record_index], expected)
+        assert record_indices[record_index] == expected.index(1.0)
+        #Bit for bit, not just close
+        assert wav_audio[wav_index].tobytes() == record_audio[record_index].tobytes()
+
+
+def test_unknown_file(corpus, tmp_path):
+    wav_dir, info_csv, record_dir = corpus
+    pandas.read_csv(info_csv).iloc[1:].to_csv(tmp_path / "missing.csv", index=False)
+    with pytest.raises(KeyError):
+        data.get_data(wav_dir, str(tmp_path / "missing.csv"))
+    with pytest.raises(KeyError):
+        tfrecord_loader.export_tfrecords(wav_dir, str(tmp_path / "missing.csv"), str(tmp_path / "records"))
@@ -0,0 +1,117 @@
+import types
+
+import numpy as np
+import pytest
+
+import compact_reps
+import discrimination_task
+import rep_cache
+
+
+layer_names = ["conv", "hidden_rep"]
+time_shapes = [(4, 3), (2, 5)]
+
+
+def make_task(name, num_stimuli, stimuli_seed, loaded=True):
+    task = discrimination_task.Task(name=name)
+    task.stimuli_hash = name + "_stimuli"
+    if loaded:
+        task.stimuli = np.random.default_rng(stimuli_seed).standard_normal((num_stimuli, 16, 1)).astype(np.float32)
+        task.category_encodings = {"0_voicing": (1, 0), "1_voicing": (0, 1)}
+        task.encoding_categories = {encoding: category for category, encoding in task.category_encodings.items()}
+        task.set_cue_names()
+        task.categories = ["0_voicing", "1_voicing"] * (num_stimuli // 2)
+    return task
+
+
+def make_tasks(loaded=True):
+    return [make_task("task_a", 6, 0, loaded), make_task("task_b", 8, 1, loaded)]
+
+
+class Model():
+    #Stands in for the probed model: counts the times it's prepared and the batches it's run on
+    def __init__(self):
+        self.prepared = 0
+        self.batches = 0
+        rng = np.random.default_rng(2)
+        self.weights = [rng.standard_normal((16, int(np.prod(shape)))).astype(np.float32) for shape in time_shapes]
+
+    def represent(self, audio_batch):
+        self.batches += 1
+        flat_audio = audio_batch.reshape(len(audio_batch), -1)
+        return [types.SimpleNamespace(numpy=lambda weights=weights: np.maximum(flat_audio @ weights, 0))
+                for weights in self.weights]
+
+    def prepare(self):
+        self.prepared += 1
+        return self.represent, time_shapes
+
+
+@pytest.fixture
+def fits(monkeypatch):
+    counter = {"fits": 0}
+    fit = compact_reps.CompactRepresentation.fit
+
+    def counting_fit(self, reps_list):
+        counter["fits"] += 1
+        return fit(self, reps_list)
+    monkeypatch.setattr(compact_reps.CompactRepresentation, "fit", counting_fit)
+    return counter
+
+
+def compact_reps_of(cache, tasks, rep_mode, model):
+    def make_compactors(names, shapes):
+        return [compact_reps.CompactRepresentation(rep_mode, shape) for shape in shapes]
+    return discrimination_task.cached_compact_layer_task_reps(cache, "model", tasks, layer_names, rep_mode,
+                                                              model.prepare, make_compactors)
+
+
+def test_second_run_in_the_same_mode_is_read_from_the_cache(tmp_path, fits):
+    model = Model()
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    first = compact_reps_of(cache, make_tasks(), "pca:3", model)
+    assert model.prepared == 1 and fits["fits"] == len(layer_names)
+    assert [reps.shape for reps in first[0]] == [(6, 3), (8, 3)]
+    cache.flush()
+
+    #A new run: the stimuli aren't loaded and the model isn't run or refitted
+    model = Model()
+    tasks = make_tasks(loaded=False)
+    second = compact_reps_of(rep_cache.RepresentationCache(str(tmp_path)), tasks, "pca:3", model)
+    assert model.prepared == 0 and model.batches == 0 and fits["fits"] == len(layer_names)
+    for first_reps, second_reps in zip(first, second):
+        for first_task_reps, second_task_reps in zip(first_reps, second_reps):
+            assert np.array_equal(first_task_reps, second_task_reps)
+    assert tasks[1].categories == make_tasks()[1].categories
+
+
+def test_only_compact_representations_are_cached(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    compact_reps_of(cache, make_tasks(), "avg_pool", Model())
+    entries = cache.index["entries"].values()
+    assert len(entries) == len(layer_names) * 2
+    assert set(entry["representation"] for entry in entries) == {"avg_pool"}
+
+
+def test_cache_key_includes_mode_size_and_fitted_stimuli(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    compact_reps_of(cache, make_tasks(), "pca:3", Model())
+    for rep_mode, tasks in [("pca:2", make_tasks()), ("max_pool", make_tasks()), ("pca:3", make_tasks()[:1])]:
+        model = Model()
+        compact_reps_of(cache, tasks, rep_mode, model)
+        assert model.prepared == 1
+
+
+def test_made_from_cached_full_representations(tmp_path, fits):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    model = Model()
+    discrimination_task.cached_layer_task_reps(cache, "model", make_tasks(), layer_names, model.prepare)
+    assert model.prepared == 1
+
+    model = Model()
+    from_full = compact_reps_of(cache, make_tasks(loaded=False), "pca:3", model)
+    assert model.prepared == 0
+    from_model = compact_reps_of(rep_cache.RepresentationCache(str(tmp_path / "other")), make_tasks(), "pca:3", Model())
+    for full_reps, model_reps in zip(from_full, from_model):
+        for full_task_reps, model_task_reps in zip(full_reps, model_reps):
+            assert np.allclose(full_task_reps, model_task_reps, atol=1e-5)
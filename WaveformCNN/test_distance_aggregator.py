@@ -0,0 +1,124 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import distance_aggregator
+
+
+def make_rows(seed, num_pairs=40):
+    #Rows like discrimination_task.task_rows's: two experiments with different cues, so some cue columns are blank
+    rng = np.random.default_rng(seed)
+    rows = []
+    for index in range(num_pairs):
+        experiment = ["f1_voicing_dur", "closure_f0"][index % 2]
+        row = {"Experiment": experiment, "Distance": float(rng.random()), "Diagonal?": int(rng.integers(0, 2)),
+               "Trial": str(seed), "Layer": ["conv_0", "conv_1"][index % 3 == 0], "Representation": "avg_pool"}
+        for stim in ["stim1_", "stim2_"]:
+            if experiment == "f1_voicing_dur":
+                row.update({stim + "voicing": int(rng.integers(0, 3)), stim + "F1": int(rng.integers(0, 2)),
+                            stim + "Closure": "", stim + "f0": ""})
+            else:
+                row.update({stim + "voicing": "", stim + "F1": "", stim + "Closure": int(rng.integers(0, 2)),
+                            stim + "f0": int(rng.integers(0, 2))})
+        rows.append(row)
+    return rows
+
+
+def summary_frame(aggregator):
+    return pd.DataFrame(aggregator.summary())
+
+
+def test_summary_matches_pandas_groupby():
+    aggregator = distance_aggregator.DistanceAggregator()
+    all_rows = []
+    for seed in range(5):
+        rows = make_rows(seed)
+        aggregator.add_rows(rows, seed)
+        all_rows += rows
+
+    frame = pd.DataFrame(all_rows)
+    frame["key"] = [distance_aggregator.group_key(row) for row in all_rows]
+    expected = frame.groupby("key")["Distance"].agg(["count", "mean", "var"])
+    assert len(aggregator.groups) == len(expected)
+    for key, stats in aggregator.groups.items():
+        assert stats.count == expected.loc[[key], "count"].iloc[0]
+        assert stats.mean == pytest.approx(expected.loc[[key], "mean"].iloc[0])
+        if stats.count > 1:
+            assert stats.variance() == pytest.approx(expected.loc[[key], "var"].iloc[0])
+        else:
+            assert math.isnan(stats.variance())
+
+
+def test_summary_columns():
+    aggregator = distance_aggregator.DistanceAggregator()
+    aggregator.add_rows(make_rows(0), 0)
+    row = aggregator.summary()[0]
+    assert row["Layer"] in ("conv_0", "conv_1")
+    assert row["Representation"] == "avg_pool"
+    assert all(value != "" for value in row.values())
+
+
+def test_seed_added_once():
+    aggregator = distance_aggregator.DistanceAggregator()
+    assert aggregator.add_rows(make_rows(0), 0)
+    assert not aggregator.add_rows(make_rows(0), 0)
+    assert sum(stats.count for stats in aggregator.groups.values()) == 40
+
+
+def test_save_reload_and_continue(tmp_path):
+    path = str(tmp_path / "aggregate.json")
+    uninterrupted = distance_aggregator.DistanceAggregator(reservoir_size=5)
+    for seed in range(4):
+        uninterrupted.add_rows(make_rows(seed), seed)
+
+    resumed = distance_aggregator.DistanceAggregator.load(path, reservoir_size=5)
+    for seed in range(4):
+        resumed.add_rows(make_rows(seed), seed)
+        resumed.save(path)
+        resumed = distance_aggregator.DistanceAggregator.load(path)
+    assert not resumed.add_rows(make_rows(3), 3)
+
+    assert resumed.seeds == uninterrupted.seeds
+    assert resumed.groups.keys() == uninterrupted.groups.keys()
+    for key, stats in uninterrupted.groups.items():
+        assert resumed.groups[key].count == stats.count
+        assert resumed.groups[key].mean == pytest.approx(stats.mean)
+        assert resumed.groups[key].m2 == pytest.approx(stats.m2)
+        #The random state is saved too, so the reservoirs come out exactly the same
+        assert resumed.groups[key].reservoir == stats.reservoir
+
+
+def test_group_stats_uneven_batches():
+    rng = np.random.default_rng(1)
+    batches = [rng.normal(3, 2, size) for size in [1, 7, 0, 250, 3, 1, 64]]
+    stats = distance_aggregator.GroupStats()
+    for batch in batches:
+        stats.add(batch, 20, rng)
+    distances = np.concatenate(batches)
+    assert stats.count == len(distances)
+    assert stats.mean == pytest.approx(np.mean(distances))
+    assert stats.variance() == pytest.approx(np.var(distances, ddof=1))
+    assert len(stats.reservoir) == 20
+    assert set(stats.reservoir) <= set(distances.tolist())
+
+
+def test_group_stats_reservoir_keeps_everything_until_full():
+    stats = distance_aggregator.GroupStats()
+    stats.add(np.array([1.0]), 10, np.random.default_rng(0))
+    stats.add(np.array([2.0, 3.0, 4.0]), 10, np.random.default_rng(0))
+    assert stats.reservoir == [1.0, 2.0, 3.0, 4.0]
+    assert math.isnan(distance_aggregator.GroupStats(1, 5.0).variance())
+
+
+def test_reservoir_is_uniform():
+    #Every distance should end up in the reservoir with probability reservoir_size / count
+    rng = np.random.default_rng(2)
+    hits = np.zeros(100)
+    for _ in range(2000):
+        stats = distance_aggregator.GroupStats()
+        for start in range(0, 100, 30):
+            stats.add(np.arange(start, min(start + 30, 100), dtype=float), 10, rng)
+        hits[np.array(stats.reservoir, dtype=int)] += 1
+    assert np.allclose(hits / 2000, 0.1, atol=0.03)
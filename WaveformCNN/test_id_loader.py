@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import scipy.io.wavfile
+import tensorflow as tf
+
+import id_loader
+
+
+SLICE_LEN = 16
+
+
+#The first frame of the whole clip framed with end padding, which pad_or_crop replaces
+def first_frame(audio, slice_len):
+    return tf.signal.frame(audio, slice_len, slice_len, pad_end=True, axis=0)[0, :, 0, :]
+
+
+def make_clip(nsamps, nch=1):
+    rng = np.random.default_rng(nsamps)
+    return tf.constant(rng.standard_normal((nsamps, 1, nch)), dtype=tf.float32)
+
+
+@pytest.mark.parametrize("nsamps", [1, 5, SLICE_LEN - 1, SLICE_LEN, SLICE_LEN + 1, 3 * SLICE_LEN + 7])
+@pytest.mark.parametrize("nch", [1, 2])
+def test_matches_first_frame(nsamps, nch):
+    audio = make_clip(nsamps, nch)
+    result = id_loader.pad_or_crop(audio, SLICE_LEN)
+    assert result.shape == (SLICE_LEN, nch)
+    np.testing.assert_array_equal(result.numpy(), first_frame(audio, SLICE_LEN).numpy())
+
+
+def test_matches_first_frame_in_map():
+    #In a Dataset.map the clip length isn't known when the function is traced
+    lengths = [3, SLICE_LEN, 40]
+    dataset = tf.data.Dataset.from_generator(lambda: (make_clip(n) for n in lengths),
+                                             output_signature=tf.TensorSpec((None, 1, 1), tf.float32))
+    for audio, result in zip(dataset, dataset.map(lambda audio: id_loader.pad_or_crop(audio, SLICE_LEN))):
+        np.testing.assert_array_equal(result.numpy(), first_frame(audio, SLICE_LEN).numpy())
+
+
+def test_counts_only_longer_clips():
+    truncated_clips = tf.Variable(0, dtype=tf.int64)
+    for nsamps, expected in [(5, 0), (SLICE_LEN, 0), (SLICE_LEN + 1, 1), (2 * SLICE_LEN, 2), (SLICE_LEN - 1, 2)]:
+        id_loader.pad_or_crop(make_clip(nsamps), SLICE_LEN, truncated_clips)
+        assert int(truncated_clips.numpy()) == expected
+
+
+def test_truncated_clip_count(tmp_path):
+    fps = []
+    for i, nsamps in enumerate([10, SLICE_LEN, SLICE_LEN + 1, 50]):
+        fp = str(tmp_path / (str(i) + ".wav"))
+        scipy.io.wavfile.write(fp, 16000, np.full(nsamps, 1000, dtype=np.int16))
+        fps.append(fp)
+    dataset = id_loader.id_decode_extract_and_batch(fps, batch_size=2, decode_fs=16000, decode_num_channels=1,
+                                                    slice_len=SLICE_LEN, slice_first_only=True, shuffle=False)
+
+    before = id_loader.truncated_clip_count()
+    for epoch in range(2):
+        audio = np.concatenate([batch[1].numpy() for batch in dataset])
+        assert audio.shape == (4, SLICE_LEN, 1)
+        assert id_loader.truncated_clip_count() - before == 2 * (epoch + 1)
+    #The short clip is zero-padded
+    assert not audio[0, 10:].any() and audio[0, :10].all()
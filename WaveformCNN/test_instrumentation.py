@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+import instrumentation
+
+
+class SlowStartDataset():
+    #Stands in for a Dataset whose first batch is slow (e.g. while the shuffle buffer fills)
+    def __init__(self, num_batches, first_batch_time=0.3, batch_time=0.01):
+        self.num_batches = num_batches
+        self.first_batch_time = first_batch_time
+        self.batch_time = batch_time
+
+    def __iter__(self):
+        for index in range(self.num_batches):
+            time.sleep(self.first_batch_time if index == 0 else self.batch_time)
+            yield index
+
+
+def test_warmup_isnt_timed():
+    run_metrics = instrumentation.RunMetrics()
+    input_time = instrumentation.probe_input_pipeline(run_metrics, SlowStartDataset(10), num_batches=5,
+                                                      step_time=0.1)
+    assert input_time == pytest.approx(0.01, abs=0.02)
+    stage = run_metrics.stages[0]
+    assert stage["name"] == "input_probe" and stage["batches"] == 5 and stage["warmup_batches"] == 1
+    assert stage["warmup_time"] >= 0.3
+    assert run_metrics.summary["input_bound"] is False
+
+
+def test_input_bound_ratio():
+    run_metrics = instrumentation.RunMetrics()
+    instrumentation.probe_input_pipeline(run_metrics, SlowStartDataset(4, batch_time=0.05), num_batches=3,
+                                         step_time=0.06)
+    assert run_metrics.summary["input_bound"] is True
+    instrumentation.probe_input_pipeline(run_metrics, SlowStartDataset(4, batch_time=0.05), num_batches=3,
+                                         step_time=0.06, input_bound_ratio=2.0)
+    assert run_metrics.summary["input_bound"] is False
+
+
+def test_too_few_batches():
+    run_metrics = instrumentation.RunMetrics()
+    assert instrumentation.probe_input_pipeline(run_metrics, SlowStartDataset(1, first_batch_time=0), step_time=1) \
+           is None
+    assert "input_bound" not in run_metrics.summary
+    assert run_metrics.stages[0]["batches"] == 0
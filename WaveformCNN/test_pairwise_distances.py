@@ -0,0 +1,76 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+import scipy.spatial.distance
+
+import discrimination_task
+
+
+#The per-pair computation pairwise_cosine_distances replaced: every pair i < j, looping over i then j
+def per_pair_distances(reps):
+    flat_reps = reps.reshape(len(reps), -1)
+    pairs = list(itertools.combinations(range(len(reps)), 2))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        distances = [scipy.spatial.distance.cosine(flat_reps[i], flat_reps[j]) for i, j in pairs]
+    return [i for i, j in pairs], [j for i, j in pairs], np.array(distances)
+
+
+def make_reps(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, 4, 3)).astype(np.float32)
+
+
+@pytest.mark.parametrize("n, block_size", [(10, 1024), (10, 3), (10, 1), (10, 10), (7, 2)])
+def test_matches_per_pair_scipy(n, block_size):
+    reps = make_reps(n)
+    rows, cols, distances = discrimination_task.pairwise_cosine_distances(reps, block_size=block_size)
+    expected_rows, expected_cols, expected_distances = per_pair_distances(reps)
+    assert list(rows) == expected_rows and list(cols) == expected_cols
+    assert np.allclose(distances, expected_distances, atol=1e-6)
+
+
+def test_zero_vector_gives_nan():
+    reps = make_reps(5)
+    reps[2] = 0
+    rows, cols, distances = discrimination_task.pairwise_cosine_distances(reps, block_size=2)
+    expected_distances = per_pair_distances(reps)[2]
+    involves_zero = (rows == 2) | (cols == 2)
+    assert np.isnan(distances[involves_zero]).all() and np.isnan(expected_distances[involves_zero]).all()
+    assert np.allclose(distances[~involves_zero], expected_distances[~involves_zero], atol=1e-6)
+
+
+def test_identical_and_opposite_vectors():
+    reps = np.array([[1.0, 2.0], [2.0, 4.0], [-1.0, -2.0]])
+    rows, cols, distances = discrimination_task.pairwise_cosine_distances(reps)
+    assert np.allclose(distances, [0.0, 2.0, 2.0])
+
+
+@pytest.mark.parametrize("n", [0, 1])
+def test_no_pairs(n):
+    rows, cols, distances = discrimination_task.pairwise_cosine_distances(make_reps(n))
+    assert len(rows) == len(cols) == len(distances) == 0
+
+
+def test_aggregate_pools_both_orders():
+    categories = ["b", "a", "b", "a", "c"]
+    reps = make_reps(len(categories), seed=1)
+    rows, cols, distances = discrimination_task.pairwise_cosine_distances(reps)
+    stats = discrimination_task.aggregate_distances(categories, rows, cols, distances)
+
+    #Group every pair's scipy distance by its unordered category pair, named in the order first seen
+    expected = {}
+    names = {}
+    for i, j, distance in zip(*per_pair_distances(reps)):
+        key = frozenset([categories[i], categories[j]])
+        names.setdefault(key, (categories[i], categories[j]))
+        expected.setdefault(key, []).append(distance)
+    assert list(stats) == list(names.values())
+    assert ("b", "a") in stats and ("a", "b") not in stats
+    for key, key_distances in expected.items():
+        pair_stats = stats[names[key]]
+        assert pair_stats["count"] == len(key_distances)
+        assert pair_stats["mean"] == pytest.approx(np.mean(key_distances))
+        assert pair_stats["var"] == pytest.approx(np.var(key_distances), rel=1e-5, abs=1e-9)
+    assert sum(pair_stats["count"] for pair_stats in stats.values()) == len(categories) * (len(categories) - 1) // 2
@@ -0,0 +1,109 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+import rep_cache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    #A clock that ticks on every call, so the order entries were used in never depends on the timer's resolution
+    ticks = itertools.count()
+    monkeypatch.setattr(rep_cache.time, "time", lambda: float(next(ticks)))
+
+
+def make_model(directory, weights):
+    os.makedirs(os.path.join(directory, "variables"), exist_ok=True)
+    with open(os.path.join(directory, "variables", "variables.data-00000-of-00001"), "wb") as weights_file:
+        weights_file.write(weights)
+    return directory
+
+
+def reps(value):
+    return np.full((4, 8), value, dtype=np.float32)
+
+
+def test_put_and_get(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    cache.put("model", "layer", "stimuli", reps(1), {"categories": ["a"]})
+    cached_reps, info = cache.get("model", "layer", "stimuli")
+    assert np.array_equal(cached_reps, reps(1))
+    assert info == {"categories": ["a"]}
+    assert cache.get("model", "other_layer", "stimuli") is None
+
+
+def test_get_only_writes_index_on_flush(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    cache.put("model", "layer", "stimuli", reps(1), {})
+    index_path = os.path.join(str(tmp_path), "index.json")
+    with open(index_path) as index_file:
+        written = index_file.read()
+    for _ in range(3):
+        cache.get("model", "layer", "stimuli")
+    with open(index_path) as index_file:
+        assert index_file.read() == written
+    cache.flush()
+    key = cache.entry_key("model", "layer", "stimuli")
+    assert rep_cache.RepresentationCache(str(tmp_path)).index["entries"][key]["last_used"] == \
+           cache.index["entries"][key]["last_used"]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    cache.put("model", "a", "stimuli", reps(1), {})
+    entry_bytes = cache.total_bytes()
+    cache.max_bytes = 2 * entry_bytes
+    cache.put("model", "b", "stimuli", reps(2), {})
+    cache.get("model", "a", "stimuli")
+    cache.put("model", "c", "stimuli", reps(3), {})
+    assert cache.get("model", "b", "stimuli") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), cache.entry_key("model", "b", "stimuli") + ".npy"))
+    assert cache.get("model", "a", "stimuli") is not None
+    assert cache.get("model", "c", "stimuli") is not None
+    assert cache.total_bytes() == 2 * entry_bytes
+
+
+def test_keeps_entry_just_added(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path), max_bytes=1)
+    cache.put("model", "a", "stimuli", reps(1), {})
+    cache.put("model", "b", "stimuli", reps(2), {})
+    assert cache.get("model", "a", "stimuli") is None
+    assert cache.get("model", "b", "stimuli") is not None
+
+
+def test_forgets_deleted_entries(tmp_path):
+    cache = rep_cache.RepresentationCache(str(tmp_path))
+    cache.put("model", "layer", "stimuli", reps(1), {})
+    os.remove(os.path.join(str(tmp_path), cache.entry_key("model", "layer", "stimuli") + ".npy"))
+    assert rep_cache.RepresentationCache(str(tmp_path)).get("model", "layer", "stimuli") is None
+
+
+def test_model_checksum_changes_with_weights(tmp_path, monkeypatch):
+    model = make_model(str(tmp_path / "model"), b"weights")
+    cache = rep_cache.RepresentationCache(str(tmp_path / "cache"))
+    checksum = cache.model_checksum(model)
+    cache.put(checksum, "layer", "stimuli", reps(1), {})
+
+    #Unchanged weights aren't read again
+    def fail(model_save_name):
+        raise AssertionError("weights read again")
+    with monkeypatch.context() as patch:
+        patch.setattr(rep_cache, "saved_model_checksum", fail)
+        assert cache.model_checksum(model) == checksum
+
+    make_model(model, b"retrained weights")
+    new_checksum = cache.model_checksum(model)
+    assert new_checksum != checksum
+    assert new_checksum == rep_cache.saved_model_checksum(model)
+    assert cache.get(new_checksum, "layer", "stimuli") is None
+
+
+def test_stimuli_hash_changes_with_contents(tmp_path):
+    (tmp_path / "stimuli").mkdir()
+    (tmp_path / "stimuli" / "a.wav").write_bytes(b"audio")
+    (tmp_path / "metadata.csv").write_text("name\na.wav\n")
+    stimuli_hash = rep_cache.stimuli_hash(str(tmp_path / "stimuli"), str(tmp_path / "metadata.csv"))
+    (tmp_path / "stimuli" / "a.wav").write_bytes(b"other audio")
+    assert rep_cache.stimuli_hash(str(tmp_path / "stimuli"), str(tmp_path / "metadata.csv")) != stimuli_hash
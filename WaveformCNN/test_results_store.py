@@ -0,0 +1,83 @@
+import csv
+
+import pytest
+
+#Skipped where pyarrow isn't installed (or can't be imported)
+pytest.importorskip("pyarrow", exc_type=ImportError)
+import pyarrow as pa
+
+import results_store
+
+
+def make_rows(seed, layer=None):
+    rows = []
+    for index in range(4):
+        rows.append({"Experiment": "f1_voicing_dur", "Distance": 0.1 * index + seed, "Diagonal?": index % 2,
+                     "Trial": str(seed), "stim1_voicing": index, "stim1_F1": 1, "stim2_voicing": 0, "stim2_F1": 0})
+        rows.append({"Experiment": "closure_f0", "Distance": 0.2 * index + seed, "Diagonal?": 0, "Trial": str(seed),
+                     "stim1_Closure": 0, "stim1_f0": index, "stim2_Closure": 1, "stim2_f0": 0})
+    if layer is not None:
+        for row in rows:
+            row["Layer"] = layer
+    return rows
+
+
+def test_append_and_query(tmp_path):
+    store_dir = str(tmp_path)
+    results_store.append_rows(store_dir, make_rows(1), 1)
+    results_store.append_rows(store_dir, make_rows(2), 2)
+    assert results_store.stored_partitions(store_dir) == [("closure_f0", 1), ("closure_f0", 2),
+                                                          ("f1_voicing_dur", 1), ("f1_voicing_dur", 2)]
+    table = results_store.query_table(store_dir)
+    assert table.num_rows == 16
+    assert table.schema.field("Distance").type == pa.float64()
+    assert table.schema.field("Diagonal?").type == pa.int8()
+    assert table.schema.field("stim1_f0").type == pa.int64()
+    #Cues of other experiments are null
+    frame = results_store.query(store_dir, seeds=[1])
+    closure = frame[frame["Experiment"] == "closure_f0"]
+    assert len(closure) == 4
+    assert closure["stim1_voicing"].isna().all()
+    assert sorted(closure["stim1_f0"]) == [0, 1, 2, 3]
+
+
+def test_query_reads_only_what_is_asked_for(tmp_path):
+    store_dir = str(tmp_path)
+    for seed in [1, 2, 3]:
+        results_store.append_rows(store_dir, make_rows(seed), seed)
+    frame = results_store.query(store_dir, experiments=["f1_voicing_dur"], seeds=[2, 3], columns=["Seed", "Distance"])
+    assert list(frame.columns) == ["Seed", "Distance"]
+    assert sorted(frame["Seed"].unique()) == [2, 3]
+    assert len(frame) == 8
+    assert results_store.query_table(store_dir, seeds=[9]).num_rows == 0
+
+
+def test_appending_a_seed_again_replaces_it(tmp_path):
+    store_dir = str(tmp_path)
+    results_store.append_rows(store_dir, make_rows(1), 1)
+    results_store.append_rows(store_dir, make_rows(2), 2)
+    rows = [row for row in make_rows(1) if row["Experiment"] == "f1_voicing_dur"]
+    for row in rows:
+        row["Distance"] = 5.0
+    results_store.append_rows(store_dir, rows, 1)
+    frame = results_store.query(store_dir, experiments=["f1_voicing_dur"])
+    assert len(frame) == 8
+    assert (frame[frame["Seed"] == 1]["Distance"] == 5.0).all()
+    assert (frame[frame["Seed"] == 2]["Distance"] != 5.0).all()
+
+
+def test_export_csv(tmp_path):
+    store_dir = str(tmp_path / "store")
+    results_store.append_rows(store_dir, make_rows(1, layer="conv_0"), 1)
+    output_fn = str(tmp_path / "export.csv")
+    assert results_store.export_csv(store_dir, output_fn) == 8
+    with open(output_fn, newline="") as export_file:
+        reader = csv.DictReader(export_file)
+        assert reader.fieldnames == ["Experiment", "Distance", "Diagonal?", "Trial", "Layer", "stim1_Closure",
+                                     "stim1_F1", "stim1_f0", "stim1_voicing", "stim2_Closure", "stim2_F1",
+                                     "stim2_f0", "stim2_voicing"]
+        rows = list(reader)
+    closure_row = next(row for row in rows if row["Experiment"] == "closure_f0")
+    assert closure_row["Layer"] == "conv_0"
+    assert closure_row["stim1_Closure"] == "0" and closure_row["stim1_voicing"] == ""
+    assert closure_row["stim2_Closure"] == "1"
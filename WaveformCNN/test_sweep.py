@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+import sweep
+
+
+@pytest.fixture
+def paths(tmp_path):
+    model_save_name = str(tmp_path / "run_seed_1")
+    results_file_name = str(tmp_path / "run_seed_1_discrim_results.csv")
+    os.makedirs(model_save_name)
+    open(results_file_name, "w").close()
+    return model_save_name, results_file_name
+
+
+def entry(status, dataset_hash="data", train_config_hash="train", probe_config_hash="probe"):
+    return {"seed": 1, "status": status, "dataset_hash": dataset_hash, "train_config_hash": train_config_hash,
+            "probe_config_hash": probe_config_hash}
+
+
+def needs(seed_entry, paths):
+    return sweep.seed_needs(seed_entry, *paths, "data", "train", "probe")
+
+
+def test_new_seed_is_trained(paths):
+    assert needs(None, paths) == "train"
+
+
+def test_done_seed_is_skipped(paths):
+    assert needs(entry("done"), paths) == "done"
+
+
+@pytest.mark.parametrize("status", ["training", "failed"])
+def test_unfinished_training_is_trained(paths, status):
+    assert needs(entry(status), paths) == "train"
+
+
+def test_changed_data_or_training_is_trained_again(paths):
+    assert needs(entry("done", dataset_hash="old"), paths) == "train"
+    assert needs(entry("done", train_config_hash="old"), paths) == "train"
+
+
+def test_missing_model_is_trained_again(paths):
+    os.rmdir(paths[0])
+    assert needs(entry("done"), paths) == "train"
+
+
+def test_trained_seed_is_probed(paths):
+    assert needs(entry("trained"), paths) == "probe"
+
+
+def test_changed_probing_or_missing_results_is_probed_again(paths):
+    assert needs(entry("done", probe_config_hash="old"), paths) == "probe"
+    os.remove(paths[1])
+    assert needs(entry("done"), paths) == "probe"
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    assert sweep.read_manifest(manifest_path) == {}
+    manifest = {"1": entry("done")}
+    sweep.write_manifest(manifest_path, manifest)
+    assert sweep.read_manifest(manifest_path) == manifest
+    assert not os.path.exists(manifest_path + ".tmp")
+
+
+def test_config_hash():
+    assert sweep.config_hash({"epochs": 10, "fast": False}) == sweep.config_hash({"fast": False, "epochs": 10})
+    assert sweep.config_hash({"epochs": 10}) != sweep.config_hash({"epochs": 11})
+
+
+def test_dataset_hash(tmp_path):
+    (tmp_path / "wavs").mkdir()
+    (tmp_path / "wavs" / "a.wav").write_bytes(b"audio")
+    (tmp_path / "labels.csv").write_text("a.wav,voiced\n")
+    data_hash = sweep.dataset_hash(str(tmp_path / "wavs") + "/", str(tmp_path / "labels.csv"))
+    (tmp_path / "labels.csv").write_text("a.wav,voiceless\n")
+    assert sweep.dataset_hash(str(tmp_path / "wavs") + "/", str(tmp_path / "labels.csv")) != data_hash
+
+
+def test_training_config_covers_training_settings():
+    import train_cnn
+    config = train_cnn.training_config(10)
+    assert config["batch_size"] == 64 and config["decode_fs"] == 16000 and config["slice_len"] == 8192
+    assert sweep.config_hash(config) == sweep.config_hash(train_cnn.training_config(10))
+    assert sweep.config_hash(config) != sweep.config_hash(train_cnn.training_config(11))
+    assert sweep.config_hash(config) != sweep.config_hash(train_cnn.training_config(10, fast=True))
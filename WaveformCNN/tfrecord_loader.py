@@ -0,0 +1,127 @@
+# Exports a labelled wav corpus (a directory of wav files + a FileID/Category csv) into a few compressed TFRecord
+# shards, and reads them back as a Dataset. On a cluster's shared filesystem, reading a handful of large shards
+# sequentially is much faster than opening and decoding thousands of small wav files.
+# Each example holds the decoded audio (already zero-padded or cut to slice_len, like id_loader's output), the
+# integer index of its category, and its file ID; the category order is saved next to the shards in categories.json.
+import json
+import os
+import random
+import sys
+
+import tensorflow as tf
+
+import id_loader
+
+
+_CATEGORIES_FN = "categories.json"
+
+
+#Returns the file names of the shards in record_dir, in shard order
+def shard_files(record_dir):
+    return sorted(os.path.join(record_dir, fn) for fn in os.listdir(record_dir) if fn.endswith(".tfrecord"))
+
+
+#Returns the list of categories saved with the shards in record_dir; category index i in the records is categories[i]
+def read_categories(record_dir):
+    with open(os.path.join(record_dir, _CATEGORIES_FN)) as categories_file:
+        return json.load(categories_file)
+
+
+#Returns a serialized tf.train.Example for one file
+#audio: [slice_len, 1] numpy float32 array
+#label: category index (int)
+#file_id: file name (string)
+def serialize_example(audio, label, file_id):
+    feature = {"audio": tf.train.Feature(float_list=tf.train.FloatList(value=audio.reshape(-1))),
+               "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+               "file_id": tf.train.Feature(bytes_list=tf.train.BytesList(value=[file_id.encode("utf-8")]))}
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+#Decodes every wav file in wav_file_dir and writes them, with their categories from info_csv, into num_shards
+#GZIP-compressed TFRecord files in record_dir
+#wav_file_dir: directory of wav files (end with /)
+#info_csv: csv file with FileID and Category columns (see data_processing.get_golds)
+#num_shards: number of shard files; the files are spread across them in a fixed random order so every shard has a
+#mix of categories
+#decode_fs, slice_len, fast_wav: as for data_processing.get_data
+#Returns the list of categories, in label index order
+def export_tfrecords(wav_file_dir, info_csv, record_dir, num_shards=8, decode_fs=16000, slice_len=8192,
+                     fast_wav='auto'):
+    import data_processing as data
+    file_category_maps = data.get_golds(info_csv)
+    file_names = sorted(os.listdir(wav_file_dir))
+    missing = [fn for fn in file_names if fn not in file_category_maps]
+    if missing:
+        raise KeyError("No category in " + info_csv + " for files " + str(missing))
+    categories = sorted(set(file_category_maps[fn] for fn in file_names))
+    random.Random(0).shuffle(file_names)
+
+    os.makedirs(record_dir, exist_ok=True)
+    options = tf.io.TFRecordOptions(compression_type="GZIP")
+    writers = [tf.io.TFRecordWriter(os.path.join(record_dir, "shard-%05d-of-%05d.tfrecord" % (shard, num_shards)),
+                                    options=options)
+               for shard in range(num_shards)]
+    for index, fn in enumerate(file_names):
+        audio = id_loader.decode_first_slice(wav_file_dir + fn, decode_fs, decode_fast_wav=fast_wav,
+                                             slice_len=slice_len)
+        writers[index % num_shards].write(serialize_example(audio, categories.index(file_category_maps[fn]), fn))
+    for writer in writers:
+        writer.close()
+
+    with open(os.path.join(record_dir, _CATEGORIES_FN), "w") as categories_file:
+        json.dump(categories, categories_file)
+    return categories
+
+
+#Reads the shards in record_dir into batches of (file ID, audio, category index) examples
+#The shards are read in parallel with interleave, each one sequentially from start to end
+#record_dir: directory written by export_tfrecords
+#shuffle: True to shuffle the shard order and the examples (through a shuffle buffer), False to read them in order
+#slice_len: number of samples per example the shards were written with
+#shuffle_seed: seed for the shard order and shuffle buffer (a new order every epoch)
+#Other arguments as for id_loader.id_decode_extract_and_batch
+#Returns a batched Dataset of (string file IDs, [batch, slice_len, 1] float32 audio, int64 category indices)
+def tfrecord_decode_and_batch(record_dir, batch_size, shuffle=True, shuffle_buffer_size=1000, prefetch_size=None,
+                              prefetch_gpu_num=None, slice_len=8192, shuffle_seed=1):
+    files = shard_files(record_dir)
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if shuffle:
+        dataset = dataset.shuffle(len(files), seed=shuffle_seed)
+    dataset = dataset.interleave(lambda fn: tf.data.TFRecordDataset(fn, compression_type="GZIP"),
+                                 cycle_length=len(files), num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=not shuffle)
+
+    features = {"audio": tf.io.FixedLenFeature([slice_len, 1], tf.float32),
+                "label": tf.io.FixedLenFeature([], tf.int64),
+                "file_id": tf.io.FixedLenFeature([], tf.string)}
+
+    def _parse(record):
+        example = tf.io.parse_single_example(record, features)
+        return example["file_id"], example["audio"], example["label"]
+
+    dataset = dataset.map(_parse, num_parallel_calls=tf.data.AUTOTUNE)
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=shuffle_buffer_size, seed=shuffle_seed)
+    dataset = dataset.batch(batch_size, drop_remainder=False)
+    if prefetch_size is not None:
+        dataset = dataset.prefetch(prefetch_size)
+        if prefetch_gpu_num is not None and prefetch_gpu_num >= 0:
+            dataset = dataset.apply(tf.data.experimental.prefetch_to_device("/device:GPU:{}".format(prefetch_gpu_num)))
+    return dataset
+
+
+#Program to export a labelled wav corpus to TFRecord shards, e.g.
+#python tfrecord_loader.py ../klatt_synthesis/sounds_pulse_voicing/ laff_vcv/sampled_stop_categories_pulse_voicing.csv tfrecords/pulse_voicing/ 8
+#Command line arguments: 1st: directory of wav files (end with /)
+# Second: stop category information csv file
+# Third: output directory for the shards
+# Fourth (optional): number of shards (default 8)
+if __name__ == "__main__":
+    wav_file_dir = sys.argv[1]
+    info_csv = sys.argv[2]
+    record_dir = sys.argv[3]
+    num_shards = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    categories = export_tfrecords(wav_file_dir, info_csv, record_dir, num_shards=num_shards)
+    print("Wrote", len(os.listdir(wav_file_dir)), "files with categories", categories, "to", num_shards, "shards in",
+          record_dir)
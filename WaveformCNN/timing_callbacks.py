@@ -0,0 +1,52 @@
+# Keras callbacks for instrumentation.RunMetrics. Kept apart from instrumentation.py so that module can be imported
+# (e.g. by the probing scripts) without loading Tensorflow.
+import time
+
+import tensorflow as tf
+
+
+#Keras callback that records every training epoch as an "epoch" stage in run_metrics, with its number of batches,
+#the time spent inside training steps (which includes waiting for input), its loss, and its samples if
+#examples_per_epoch is given
+#Put it last in fit's callbacks: the time from the epoch's last step to its own on_epoch_end is then the time the
+#other callbacks' end-of-epoch work (e.g. a checkpoint save) held up training, recorded as the epoch's
+#"epoch_end_time" and, if epoch_end_stage is given, as a stage of that name
+class EpochTimingCallback(tf.keras.callbacks.Callback):
+    def __init__(self, run_metrics, examples_per_epoch=None, epoch_end_stage=None):
+        super().__init__()
+        self.run_metrics = run_metrics
+        self.examples_per_epoch = examples_per_epoch
+        self.epoch_end_stage = epoch_end_stage
+        self.total_step_time = 0.0
+        self.total_batches = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+        self.step_time = 0.0
+        self.batches = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batch_end = time.perf_counter()
+        self.step_time += self.batch_end - self.batch_start
+        self.batches += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_end_time = time.perf_counter() - self.batch_end if self.batches else 0.0
+        if self.epoch_end_stage is not None:
+            self.run_metrics.add(self.epoch_end_stage, epoch_end_time, epoch=epoch + 1)
+        info = {"epoch": epoch + 1, "batches": self.batches, "step_time": self.step_time,
+                "epoch_end_time": epoch_end_time}
+        if self.examples_per_epoch is not None:
+            info["samples"] = self.examples_per_epoch
+        if logs and "loss" in logs:
+            info["loss"] = float(logs["loss"])
+        self.run_metrics.add("epoch", time.perf_counter() - self.epoch_start, **info)
+        self.total_step_time += self.step_time
+        self.total_batches += self.batches
+
+    #Returns the mean seconds per training step over every epoch so far
+    def mean_step_time(self):
+        return self.total_step_time / self.total_batches if self.total_batches else None
@@ -6,9 +6,15 @@ random.set_seed(2)
 
 import numpy as np
 import data_processing as data
+import checkpointing
 import cnn #scratch_cnn as cnn
+import id_loader
+import instrumentation
+import timing_callbacks
 import tensorflow as tf
 
+import inspect
+import os
 import sys
 
 #Program to train and save a CNN voiced vs voiceless stop categorizer.
@@ -16,55 +22,93 @@ import sys
 # Second: name to save model to under saved_models (string)
 # Third: name of directory containing sound data (end with /)
 # Fourth: name of stop category information csv file
-seed(int(sys.argv[1]))  #Reset seed to user specification
-random.set_seed(int(sys.argv[1]))
+# Fifth (optional): directory for the decoded audio cache (see id_loader.compile_audio_cache)
 
 debug = False
 
 
-wavfile_directory = sys.argv[3] #"../klatt_synthesis/sounds/"# "sample_wavs/"#
-label_csv_file = sys.argv[4]#"laff_vcv/sampled_stop_categories.csv"# "sample_file_info.csv"#
 num_epochs = 10 #todo: What should this be? Donahue's method - inception score- doesn't transfer here because it's for GAN productions
-model_save_path = "saved_models/"+sys.argv[2] #Model name
-
-
-
-
-if __name__ == "__main__":
-    #Load in data
+early_stopping = {"monitor": "loss", "min_delta": 0.001, "patience": 30} #todo: get rid of these magic numbers
+
+
+#Returns the default value of each keyword argument of function, by name
+def _defaults(function):
+    return {name: parameter.default for name, parameter in inspect.signature(function).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+
+#Returns a dictionary of the settings train_cnn trains with for epochs and fast (besides the run seed, which also
+#seeds the data shuffling), e.g. to tell whether a saved model was trained the same way as a new one would be
+def training_config(epochs=num_epochs, fast=False):
+    data_defaults = _defaults(data.get_data)
+    loader_defaults = _defaults(id_loader.id_decode_extract_and_batch)
+    return {"epochs": epochs, "fast": fast, "precision": cnn.fast_mode_precision() if fast else None,
+            "batch_size": data_defaults["batch_size"], "decode_fs": data_defaults["decode_fs"],
+            "fast_wav": data_defaults["fast_wav"], "slice_len": loader_defaults["slice_len"],
+            "decode_normalize": loader_defaults["decode_normalize"], "shuffle_seed": "run_seed",
+            "early_stopping": early_stopping}
+
+
+#Trains a CNN categorizer on the wav files in wavfile_directory and saves it to model_save_path
+#run_seed: random seed (int) for numpy and tensorflow
+#model_save_path: path to save the model to (string)
+#wavfile_directory: name of directory containing sound data (end with /)
+#label_csv_file: name of stop category information csv file
+#cache_dir: if not None, directory for the decoded audio cache (see id_loader.compile_audio_cache)
+#fast: True to train in cnn.create_model's fast mode (XLA + mixed precision)
+#Per-stage timings and memory use are written to model_save_path + "_metrics.json" (see fit_cnn)
+#checkpoint_every, keep_checkpoints, resume: as for fit_cnn
+#Returns the trained model and its Keras History
+def train_cnn(run_seed, model_save_path, wavfile_directory, label_csv_file, epochs=num_epochs, cache_dir=None,
+              fast=False, checkpoint_every=1, keep_checkpoints=2, resume=True):
+    seed(run_seed)  #Reset seed to user specification
+    random.set_seed(run_seed)
+
+    run_metrics = instrumentation.RunMetrics({"script": "train_cnn", "run_seed": run_seed,
+                                              "model_save_path": model_save_path,
+                                              "wavfile_directory": wavfile_directory, "label_csv_file": label_csv_file,
+                                              "cache_dir": cache_dir, "fast": fast})
+
+    #Load in data (the decoding itself happens during the epochs, unless the audio cache is being compiled)
     print("Loading in data from directory", wavfile_directory, "with category-labeling csv file", label_csv_file)
-    training_data,\
-    category_encoding_map, encoding_category_map = data.get_data(wavfile_directory, label_csv_file)
-
-    print(training_data)
-    #exit()
-
-
-    batched_encoded_categories = training_data.map(lambda category, audio: category)
-    batched_audio_vectors = training_data.map(lambda category, audio: audio)
+    num_examples = len(os.listdir(wavfile_directory))
+    with run_metrics.stage("data_load", samples=num_examples):
+        training_data,\
+        category_encoding_map, encoding_category_map = data.get_data(wavfile_directory, label_csv_file,
+                                                                     cache_dir=cache_dir, shuffle_seed=run_seed)
     print("Categories are ", category_encoding_map.keys())
-    print("Audio Dataset", batched_audio_vectors)
-    print("Gold Dataset", batched_encoded_categories)
-    for element in batched_encoded_categories:
-        print("Label",element)
-    index = 0
-    for element in batched_audio_vectors:
-        print("Audio", element, element.shape)
-        if index > 1:
-            break
 
-    if debug:
-        saved_model = tf.keras.models.load_model('saved_models/trial_run_1000_tokens_converge')
-        y_pred = np.array(saved_model.predict(batched_audio_vectors))
-        print(y_pred)
-        print(element for element in np.array(batched_encoded_categories))
-        ac = tf.keras.metrics.CategoricalAccuracy()
-        ac.update_state(tf.convert_to_tensor(np.array(batched_encoded_categories)), y_pred)
-        print(ac.result().numpy())
-        exit()
+    return fit_cnn(training_data, len(category_encoding_map.keys()), model_save_path, epochs=epochs, fast=fast,
+                   run_metrics=run_metrics, examples_per_epoch=num_examples, checkpoint_every=checkpoint_every,
+                   keep_checkpoints=keep_checkpoints, resume=resume)
+
+
+#Sets up a CNN categorizer, trains it on training_data and saves it to model_save_path
+#training_data: batched Dataset of (audio, one-hot category) pairs, e.g. from data_processing.get_data
+#num_categories: number of categories
+#model_save_path: path to save the model to (string)
+#fast: True to train in cnn.create_model's fast mode (XLA + mixed precision)
+#run_metrics: instrumentation.RunMetrics to add this run's stages to (a new one if None); the timings of model build,
+#every epoch, checkpoint saves and the final save, whether training was input-bound, and how many training clips
+#were cut to the slice length (see id_loader.truncated_clip_count), are written to model_save_path + "_metrics.json"
+#examples_per_epoch: number of training examples in an epoch, if known, for the metrics
+#checkpoint_every: checkpoint the weights and optimizer state every this many epochs, in the background
+#(see checkpointing.AsyncCheckpointCallback), to checkpointing.checkpoint_dir(model_save_path)
+#keep_checkpoints: number of most recent checkpoints to keep while training; they're deleted once the model is saved
+#resume: True to continue from the latest checkpoint if an earlier run was interrupted (the data order of the
+#resumed epochs differs from an uninterrupted run's, since the shuffling restarts)
+#Returns the trained model and its Keras History (of this run's epochs only; the total number of epochs trained,
+#including any resumed from, is the metrics' "epochs_trained")
+def fit_cnn(training_data, num_categories, model_save_path, epochs=num_epochs, fast=False, run_metrics=None,
+            examples_per_epoch=None, checkpoint_every=1, keep_checkpoints=2, resume=True):
+    if run_metrics is None:
+        run_metrics = instrumentation.RunMetrics({"model_save_path": model_save_path, "fast": fast})
+
     #Set up and train model
     print("Setting up the CNN categorizer")
-    cnn_model = cnn.create_model(len(category_encoding_map.keys()))
+    with run_metrics.stage("model_build"):
+        cnn_model = cnn.create_model(num_categories, fast=fast)
+        checkpointing.build_for_checkpointing(cnn_model, training_data.element_spec[0].shape)
     print("Training the CNN categorizer")
     #This callback ends training when the metric it's monitoring stops changing by more than "delta"
     #Because the loss doesn't decrease on every single epoch (not fully batch, and stochasticity in gradient
@@ -72,20 +116,88 @@ if __name__ == "__main__":
     #todo: the delta value I pick is somewhat arbitrary; in my ML education it's always been arbitrary, but
     #maybe I should check the literature to see if there's a more principled way to decide, e.g. by seeing
     #how much loss usually changes for this task+model
-    converge_callback = tf.keras.callbacks.EarlyStopping(monitor='loss', min_delta = 0.001, patience=30) #Stop training condition  #todo: get rid of this magic number. 16 is number of batches per epoch, 10 is number of epochs
+    converge_callback = tf.keras.callbacks.EarlyStopping(**early_stopping) #Stop training condition  #todo: get rid of this magic number. 16 is number of batches per epoch, 10 is number of epochs
+
+    #Checkpoint the weights just in case training gets interrupted; the full model is only saved at the end
+    checkpoint_callback = checkpointing.AsyncCheckpointCallback(cnn_model, checkpointing.checkpoint_dir(model_save_path),
+                                                                save_every_epochs=checkpoint_every,
+                                                                keep_last=keep_checkpoints, run_metrics=run_metrics)
+    initial_epoch = 0
+    training_finished = False
+    if resume:
+        with run_metrics.stage("checkpoint_restore"):
+            initial_epoch = checkpoint_callback.restore_latest()
+        training_finished = checkpoint_callback.training_finished()
+        run_metrics.summary["resumed_from_epoch"] = initial_epoch
+
+    #Last, so the time checkpoint saves hold up training is each epoch's epoch_end_time (the checkpoint callback also
+    #records its own checkpoint_save stages)
+    timing_callback = timing_callbacks.EpochTimingCallback(run_metrics, examples_per_epoch)
+    if training_finished or initial_epoch >= epochs:
+        #An earlier run finished training (or stopped early) but was interrupted before the model was saved
+        print("Training already finished after", initial_epoch, "epochs")
+        history = tf.keras.callbacks.History()
+        history.epoch = []
+    else:
+        truncated_before = id_loader.truncated_clip_count()
+        history = cnn_model.fit(training_data, epochs=epochs, initial_epoch=initial_epoch,
+                                callbacks = [converge_callback, checkpoint_callback, timing_callback])
+        #Counted once per epoch, like the clips themselves; clips longer than the slice length lose their ends
+        truncated_clips = id_loader.truncated_clip_count() - truncated_before
+        run_metrics.summary["truncated_clips"] = truncated_clips
+        if truncated_clips:
+            print("Cut", truncated_clips, "training clips (over all epochs) that were longer than the slice length")
+    run_metrics.summary["epochs_trained"] = initial_epoch + len(history.epoch)
 
-    #Save model after each epoch just in case training gets interrupted
-    checkpoint_callback = tf.keras.callbacks.ModelCheckpoint(model_save_path, save_freq = "epoch")
 
-    cnn_model.fit(training_data, epochs=num_epochs,
-                  callbacks = [converge_callback, checkpoint_callback])
 
+    print("Saving model to ", model_save_path)
+    with run_metrics.stage("final_save"):
+        cnn_model.save(model_save_path)
+    checkpoint_callback.remove()
 
+    instrumentation.probe_input_pipeline(run_metrics, training_data, step_time=timing_callback.mean_step_time())
+    run_metrics.write(model_save_path + "_metrics.json")
+    return cnn_model, history
 
-    print("Saving model to ", model_save_path)
-    cnn_model.save(model_save_path)
 
 
 
+if __name__ == "__main__":
+    run_seed = int(sys.argv[1])
+    wavfile_directory = sys.argv[3] #"../klatt_synthesis/sounds/"# "sample_wavs/"#
+    label_csv_file = sys.argv[4]#"laff_vcv/sampled_stop_categories.csv"# "sample_file_info.csv"#
+    model_save_path = "saved_models/"+sys.argv[2] #Model name
+    cache_dir = sys.argv[5] if len(sys.argv) > 5 else None
+
+    if debug:
+        #Load in data
+        training_data,\
+        category_encoding_map, encoding_category_map = data.get_data(wavfile_directory, label_csv_file, cache_dir=cache_dir)
+
+        print(training_data)
+        #exit()
+
+
+        batched_encoded_categories = training_data.map(lambda category, audio: category)
+        batched_audio_vectors = training_data.map(lambda category, audio: audio)
+        print("Audio Dataset", batched_audio_vectors)
+        print("Gold Dataset", batched_encoded_categories)
+        for element in batched_encoded_categories:
+            print("Label",element)
+        index = 0
+        for element in batched_audio_vectors:
+            print("Audio", element, element.shape)
+            if index > 1:
+                break
 
+        saved_model = tf.keras.models.load_model('saved_models/trial_run_1000_tokens_converge')
+        y_pred = np.array(saved_model.predict(batched_audio_vectors))
+        print(y_pred)
+        print(element for element in np.array(batched_encoded_categories))
+        ac = tf.keras.metrics.CategoricalAccuracy()
+        ac.update_state(tf.convert_to_tensor(np.array(batched_encoded_categories)), y_pred)
+        print(ac.result().numpy())
+        exit()
 
+    train_cnn(run_seed, model_save_path, wavfile_directory, label_csv_file, cache_dir=cache_dir)
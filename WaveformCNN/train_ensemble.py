@@ -0,0 +1,127 @@
+# Program for training several seeds of the CNN at once, as an ensemble trained in a single Tensorflow graph
+# The WaveCNN models are small and the training corpus is only ~1000 clips, so training each seed on its own
+# (train_cnn.py) is dominated by per-step overhead. This stacks K independently initialized copies (members) of the
+# WaveCNN architecture and trains all of them in one compiled training step. Each member has its own
+# seed-derived initialization and its own shuffled data order, and is saved on its own as
+# saved_models/saved_models/run_seed_N, exactly like a model from train_cnn.py, so discrimination_task.py
+# sees no difference.
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+import cnn
+import data_processing as data
+
+
+batch_size = 64 #Same as data_processing.get_data's default
+num_epochs = 10 #Same as train_cnn.py
+
+
+#Returns a list of compiled WaveCNN models, one for each seed in seeds, each initialized from its own seed
+#num_classes: number of categories for the classifier
+#slice_len: number of samples in each input waveform
+def create_members(seeds, num_classes, slice_len=8192):
+    members = []
+    for run_seed in seeds:
+        np.random.seed(run_seed)
+        tf.random.set_seed(run_seed)
+        member = cnn.create_model(num_classes)
+        member.build((None, slice_len, 1))
+        #Create the optimizer's variables now rather than inside the compiled training step
+        member.optimizer.build(member.trainable_variables)
+        members.append(member)
+    return members
+
+
+#Returns a [len(seeds), num_examples] numpy array of example indices where row k is the order
+#member k sees the training data in during epoch number epoch
+def member_orders(seeds, epoch, num_examples):
+    return np.stack([np.random.default_rng([run_seed, epoch]).permutation(num_examples) for run_seed in seeds])
+
+
+#Returns a compiled function that takes a [K, batch size] tensor of example indices (row k is member k's batch),
+#takes one training step for every member on its own batch, and returns each member's loss and accuracy on its batch
+#members: list of K compiled Keras models from create_members
+#audio: [num_examples, slice_len, 1] numpy array of training audio
+#labels: [num_examples, num_classes] numpy array of one-hot categories, parallel to audio
+def make_train_step(members, audio, labels):
+    audio = tf.constant(audio)
+    labels = tf.constant(labels)
+    loss_function = tf.keras.losses.CategoricalCrossentropy() #Same loss as cnn.create_model
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[len(members), None], dtype=tf.int64)])
+    def train_step(batch_indices):
+        losses = []
+        accuracies = []
+        #This loop is unrolled into one graph, so the members' steps run as a group rather than one Python call each
+        for k, member in enumerate(members):
+            batch_audio = tf.gather(audio, batch_indices[k])
+            batch_labels = tf.gather(labels, batch_indices[k])
+            with tf.GradientTape() as tape:
+                predictions = member(batch_audio, training=True)
+                loss = loss_function(batch_labels, predictions)
+            gradients = tape.gradient(loss, member.trainable_variables)
+            member.optimizer.apply_gradients(zip(gradients, member.trainable_variables)) #Applies the clipvalue too
+            correct = tf.equal(tf.argmax(predictions, axis=1), tf.argmax(batch_labels, axis=1))
+            losses.append(loss)
+            accuracies.append(tf.reduce_mean(tf.cast(correct, tf.float32)))
+        return tf.stack(losses), tf.stack(accuracies)
+
+    return train_step
+
+
+#Trains one member per seed on the same data and returns the list of trained models
+#seeds: list of int random seeds
+#audio, labels: training data arrays, as from data_processing.get_arrays
+#epochs: number of passes over the data
+#Returns the list of trained members and a [epochs, K] numpy array of each member's mean loss per epoch
+def train_ensemble(seeds, audio, labels, epochs=num_epochs, batch_size=batch_size):
+    members = create_members(seeds, labels.shape[1], slice_len=audio.shape[1])
+    train_step = make_train_step(members, audio, labels)
+    num_examples = len(audio)
+
+    epoch_losses = []
+    for epoch in range(epochs):
+        orders = member_orders(seeds, epoch, num_examples)
+        loss_sums = np.zeros(len(seeds))
+        accuracy_sums = np.zeros(len(seeds))
+        for start in range(0, num_examples, batch_size):
+            batch_indices = orders[:, start:start + batch_size]
+            losses, accuracies = train_step(tf.constant(batch_indices, dtype=tf.int64))
+            #Weight by batch size so the last, smaller batch counts for less, like Keras's epoch averages
+            loss_sums += losses.numpy() * batch_indices.shape[1]
+            accuracy_sums += accuracies.numpy() * batch_indices.shape[1]
+        epoch_losses.append(loss_sums / num_examples)
+        print("Epoch", epoch + 1, "/", epochs)
+        for k, run_seed in enumerate(seeds):
+            print("\tseed", run_seed, "- loss:", round(loss_sums[k] / num_examples, 4),
+                  "- accuracy:", round(accuracy_sums[k] / num_examples, 4))
+    return members, np.array(epoch_losses)
+
+
+#Program to train and save an ensemble of CNN voiced vs voiceless stop categorizers, one per seed.
+#Command line arguments: 1st: first random seed (number)
+# Second: last random seed (number); one member is trained for every seed from the first to the last
+# Third: name of directory containing sound data (end with /)
+# Fourth: name of stop category information csv file
+# Fifth (optional): directory for the decoded audio cache (see id_loader.compile_audio_cache)
+#Each member is saved to saved_models/saved_models/run_seed_N, the same place run_many_seeds.sh saves them
+if __name__ == "__main__":
+    seeds = list(range(int(sys.argv[1]), int(sys.argv[2]) + 1))
+    wavfile_directory = sys.argv[3]
+    label_csv_file = sys.argv[4]
+    cache_dir = sys.argv[5] if len(sys.argv) > 5 else None
+
+    print("Loading in data from directory", wavfile_directory, "with category-labeling csv file", label_csv_file)
+    audio, labels, category_encoding_map, encoding_category_map = data.get_arrays(wavfile_directory, label_csv_file,
+                                                                                cache_dir=cache_dir)
+    print("Categories are ", category_encoding_map.keys())
+
+    print("Training an ensemble of", len(seeds), "CNN categorizers")
+    members, epoch_losses = train_ensemble(seeds, audio, labels)
+
+    for run_seed, member in zip(seeds, members):
+        model_save_path = "saved_models/saved_models/run_seed_" + str(run_seed)
+        print("Saving model to ", model_save_path)
+        member.save(model_save_path)
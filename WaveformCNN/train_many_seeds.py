@@ -0,0 +1,141 @@
+# Program for training many seeds of the CNN concurrently on a CPU-only node
+# Each seed is trained by train_cnn.train_cnn in its own worker process. The cores are split between the workers
+# (each worker's Tensorflow thread pools are pinned to its share) instead of every seed trying to use every core,
+# and the audio is decoded once into a cache (see id_loader.compile_audio_cache) that every worker reads as a
+# read-only memmap.
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+
+#Runs once in each worker process, before Tensorflow is used, to pin its thread pools to this worker's share of the cores
+#intra_op_threads: threads for parallelism inside a single op (e.g. a convolution)
+#inter_op_threads: threads for running independent ops at the same time
+def init_worker(intra_op_threads, inter_op_threads):
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+#Trains and saves a single seed; runs in a worker process
+#job: (seed, model_save_path, wavfile_directory, label_csv_file, epochs, cache_dir) tuple
+#Returns a dictionary of the seed, its wall time (seconds), number of epochs trained (including any from an
+#interrupted earlier run it resumed from) and number of training examples seen in this run
+def train_seed(job):
+    run_seed, model_save_path, wavfile_directory, label_csv_file, epochs, cache_dir = job
+    import train_cnn #Imported here so Tensorflow is only loaded after init_worker has configured it
+
+    start = time.perf_counter()
+    model, history = train_cnn.train_cnn(run_seed, model_save_path, wavfile_directory, label_csv_file,
+                                         epochs=epochs, cache_dir=cache_dir)
+    wall_time = time.perf_counter() - start
+    with open(model_save_path + "_metrics.json") as metrics_file:
+        epochs_trained = json.load(metrics_file)["summary"]["epochs_trained"]
+    num_examples = len(os.listdir(wavfile_directory)) * len(history.epoch)
+    return {"seed": run_seed, "wall_time": wall_time, "epochs": epochs_trained, "examples": num_examples}
+
+
+#Entry point of a worker process: configures Tensorflow, trains one seed, and puts its result on result_queue
+def run_worker(job, intra_op_threads, inter_op_threads, result_queue):
+    init_worker(intra_op_threads, inter_op_threads)
+    result_queue.put(train_seed(job))
+
+
+#Trains every seed in seeds, num_workers at a time, and saves each to model_save_prefix + str(seed)
+#seeds: list of int random seeds
+#model_save_prefix: path prefix for the saved models (string), e.g. "saved_models/saved_models/run_seed_"
+#wavfile_directory: name of directory containing sound data (end with /)
+#label_csv_file: name of stop category information csv file
+#num_workers: number of seeds to train at the same time
+#cache_dir: directory for the shared decoded audio cache; compiled here before any worker starts
+#epochs: maximum number of epochs per seed
+#on_result: if not None, function called (in this process) with each seed's dictionary from train_seed as soon as
+#that seed finishes
+#Returns a list of the per-seed dictionaries from train_seed, a list of the seeds whose worker failed,
+#and the total wall time (seconds)
+def train_many_seeds(seeds, model_save_prefix, wavfile_directory, label_csv_file, num_workers, cache_dir,
+                     epochs=None, on_result=None):
+    import id_loader
+    import train_cnn
+    if epochs is None:
+        epochs = train_cnn.num_epochs
+
+    #Decode the audio once, up front, so the workers only ever read the cache
+    fps = [wavfile_directory + fn for fn in os.listdir(wavfile_directory)]
+    id_loader.load_audio_cache(fps, cache_dir, 16000)
+
+    num_cores = os.cpu_count() or 1
+    intra_op_threads = max(1, num_cores // num_workers)
+    inter_op_threads = 1
+    print("Training", len(seeds), "seeds with", num_workers, "workers of", intra_op_threads, "threads each")
+
+    jobs = [(run_seed, model_save_prefix + str(run_seed), wavfile_directory, label_csv_file, epochs, cache_dir)
+            for run_seed in seeds]
+    start = time.perf_counter()
+    #Every seed gets its own freshly spawned process, so no Tensorflow state or memory carries over between seeds,
+    #and a worker that dies (e.g. killed for running out of memory) only loses its own seed
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    pending = list(jobs)
+    running = {}
+    results = []
+    failed_seeds = []
+    while pending or running:
+        while pending and len(running) < num_workers:
+            job = pending.pop(0)
+            process = context.Process(target=run_worker,
+                                      args=(job, intra_op_threads, inter_op_threads, result_queue))
+            process.start()
+            running[job[0]] = process
+
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            #Check for workers that exited without a result
+            for run_seed, process in list(running.items()):
+                if process.exitcode is not None and process.exitcode != 0:
+                    print("Seed", run_seed, "failed: worker exited with code", process.exitcode)
+                    failed_seeds.append(run_seed)
+                    del running[run_seed]
+            continue
+        running.pop(result["seed"]).join()
+        print("Seed", result["seed"], "trained", result["epochs"], "epochs in", round(result["wall_time"], 1), "s")
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    total_wall_time = time.perf_counter() - start
+    return results, failed_seeds, total_wall_time
+
+
+#Command line arguments: 1st: first random seed (number)
+# Second: last random seed (number)
+# Third: name of directory containing sound data (end with /)
+# Fourth: name of stop category information csv file
+# Fifth: number of seeds to train at the same time
+# Sixth: directory for the shared decoded audio cache
+#Models are saved to saved_models/saved_models/run_seed_N, the same place run_many_seeds.sh saves them
+if __name__ == "__main__":
+    start_seed = int(sys.argv[1])
+    end_seed = int(sys.argv[2])
+    wavfile_directory = sys.argv[3]
+    label_csv_file = sys.argv[4]
+    num_workers = int(sys.argv[5])
+    cache_dir = sys.argv[6]
+
+    results, failed_seeds, total_wall_time = train_many_seeds(list(range(start_seed, end_seed + 1)), "saved_models/saved_models/run_seed_",
+                                                wavfile_directory, label_csv_file, num_workers, cache_dir)
+
+    results.sort(key=lambda result: result["seed"])
+    for result in results:
+        print("Seed", result["seed"], ":", round(result["wall_time"], 1), "s,", result["epochs"], "epochs,",
+              round(result["examples"] / result["wall_time"], 1), "examples/s")
+    total_examples = sum(result["examples"] for result in results)
+    print("Trained", len(results), "seeds in", round(total_wall_time, 1), "s:",
+          round(len(results) / total_wall_time * 3600, 1), "seeds/hour,",
+          round(total_examples / total_wall_time, 1), "examples/s overall")
+    if failed_seeds:
+        print("Failed seeds:", sorted(failed_seeds))